@@ -1,112 +1,99 @@
-import boto3
-import os
-from io import BytesIO
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.embeddings.bedrock import BedrockEmbeddings
-from langchain_community.chat_models import BedrockChat
-from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains import RetrievalQA
+import contextvars
+import time
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.prompts import PromptTemplate
 from langchain.agents import Tool, create_react_agent, AgentExecutor
 from django.conf import settings
+from ai_chatbot.clients import get_client_registry
+from ai_chatbot.conversation_memory import Conversation, get_conversation_memory, standalone_question
+from ai_chatbot.rag_engine import answer_question, ensure_s3_document, get_chat_llm
+from ai_chatbot.shards import DEFAULT_INDEX_NAME, index_name_for_company
+from ai_chatbot.tool_memo import SessionToolMemo, get_tool_memo
 import logging
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Define the Bedrock client once for all functions in this module
-bedrock_runtime = boto3.client('bedrock-runtime',
-    region_name=settings.AWS_REGION_NAME
-)
-
-def ingest_from_s3(bucket_name, file_key):
-    # This is your existing function from Task 2
-    s3_client = boto3.client('s3')
-    try:
-        logger.info(f"Downloading {file_key} from S3 bucket {bucket_name}...")
-        file_stream = BytesIO()
-        s3_client.download_fileobj(bucket_name, file_key, file_stream)
-        file_stream.seek(0)
-        
-        temp_file_path = f"/tmp/{os.path.basename(file_key)}"
-        with open(temp_file_path, "wb") as f:
-            f.write(file_stream.read())
-        
-        loader = PyPDFLoader(temp_file_path)
-        documents = loader.load()
-        
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-        docs = text_splitter.split_documents(documents)
-        logger.info(f"Split document into {len(docs)} chunks.")
-        
-        os.remove(temp_file_path)
-        
-        return docs
-    except Exception as e:
-        logger.error(f"Error ingesting file from S3: {e}")
-        return []
-
-
-def create_faiss_index(documents, index_name="faiss_index"):
-    if not documents:
-        logger.error("No documents to process. Aborting index creation.")
-        return None
-        
-    logger.info("Creating embeddings and building FAISS index...")
-    embeddings = BedrockEmbeddings(client=bedrock_runtime, model_id="amazon.titan-embed-text-v1")
-    vector_store = FAISS.from_documents(documents, embeddings)
-    vector_store.save_local(index_name)
-    logger.info(f"FAISS index saved to '{index_name}' directory.")
-    return vector_store
+# The index queried by DocumentQA; set per request, since tools only receive the query string
+current_index_name = contextvars.ContextVar("current_index_name", default=DEFAULT_INDEX_NAME)
+# The chat session whose tool memo DocumentQA uses, and the trace of the agent run in progress
+current_session_id = contextvars.ContextVar("current_session_id", default=None)
+current_trace = contextvars.ContextVar("current_trace", default=None)
 
+KNOWLEDGE_BASE_UNAVAILABLE = "An error occurred. The knowledge base is not available."
+NO_COMPANY_DOCUMENTS = "Your company has not uploaded any documents yet. Upload a PDF to ask questions about it."
+REPEATED_OBSERVATION_HINT = "\n(You already have this observation. Give the Final Answer now.)"
+# What AgentExecutor answers when it stops the loop at max_iterations or max_execution_time
+AGENT_STOPPED_PREFIX = "Agent stopped due to"
 
-def perform_qa_with_rag(query):
+def perform_qa_with_rag(query, callbacks=None):
     """
     Performs a Q&A using the RAG pipeline.
-    This function takes only the query as input,
-    as required by the Tool class. It will load the index itself.
-    """
-    index_name = "faiss_index"
-    if not os.path.exists(index_name):
-        # If the index doesn't exist, try to build it first.
-        S3_BUCKET_NAME = settings.S3_BUCKET_NAME
-        S3_FILE_KEY = "uploads/PythonAI.pdf"
-        documents = ingest_from_s3(S3_BUCKET_NAME, S3_FILE_KEY)
-        vector_store = create_faiss_index(documents, index_name)
-    else:
-        # Load the existing index
-        embeddings = BedrockEmbeddings(client=bedrock_runtime, model_id="amazon.titan-embed-text-v1")
-        vector_store = FAISS.load_local(index_name, embeddings, allow_dangerous_deserialization=True)
-        
-    if not vector_store:
+    The Tool class passes only the query; ``callbacks`` (used when the
+    router answers directly) stream the answer's tokens. The index (the
+    requester's company shard, or the shared one) is served by the shared
+    RAG engine. Only the shared index is built from the seeded PDF when it
+    does not exist yet; a company is only ever answered from its own shard.
+    """
+    index_name = current_index_name.get()
+    try:
+        response = answer_question(query, index_name, callbacks=callbacks)
+        if response is None and index_name != DEFAULT_INDEX_NAME:
+            logger.info(f"'{index_name}' has no documents yet.")
+            return NO_COMPANY_DOCUMENTS
+        if response is None:
+            # If the index doesn't exist, try to build it first.
+            entry = ensure_s3_document(settings.S3_BUCKET_NAME, "uploads/PythonAI.pdf", index_name)
+            response = answer_question(query, index_name, entry=entry, callbacks=callbacks)
+    except Exception as e:
+        logger.error(f"Error answering from the knowledge base: {e}")
+        response = None
+
+    if response is None:
         logger.error("No vector store provided for Q&A.")
-        return "An error occurred. The knowledge base is not available."
-        
-    logger.info(f"Processing query with RAG: '{query}'")
-    llm = BedrockChat(client=bedrock_runtime, model_id=settings.BEDROCK_MODEL_ID)
-    
-    qa = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=vector_store.as_retriever(search_kwargs={"k": 3})
-    )
-    
-    response = qa.run(query)
+        return KNOWLEDGE_BASE_UNAVAILABLE
     return response
 
-def process_file_upload(file_path):
+def memoized_per_session(tool_name, func):
+    """
+    Wraps a side-effect-free tool so that, within a chat session, the same (normalized) input
+    returns the earlier observation instead of running the tool again. Calls outside a
+    session, and error observations, are not remembered.
+    """
+    def run(tool_input):
+        session_id = current_session_id.get()
+        if session_id is None:
+            return func(tool_input)
+        memo = get_tool_memo()
+        key = SessionToolMemo.key(current_index_name.get(), tool_name, tool_input)
+        trace = current_trace.get()
+        observation = memo.lookup(session_id, key)
+        if observation is None:
+            observation = func(tool_input)
+            if observation != KNOWLEDGE_BASE_UNAVAILABLE:
+                memo.store(session_id, key, observation)
+            if trace is not None:
+                trace.seen(key)
+            return observation
+        logger.info(f"{tool_name}: reused the session's observation for '{tool_input}'.")
+        if trace is None:
+            return observation
+        trace.mark_memoized()
+        # The agent is going in circles; nudge it to answer instead of using up its iterations
+        return observation + REPEATED_OBSERVATION_HINT if trace.seen(key) else observation
+
+    return run
+
+def process_file_upload(file_path, company_id=None):
     """
     A tool to handle file uploads.
-    It will trigger a background task to process the file.
+    It will trigger a background task to process the file
+    into the company's shard.
     """
     from .tasks import process_uploaded_file
     
-    # Pass only the file_path to the Celery task.
-    task = process_uploaded_file.delay(file_path)
+    # Pass only the file_path and company to the Celery task.
+    task = process_uploaded_file.delay(file_path, company_id)
     
     # Return the Celery task object
     return task
@@ -115,7 +102,7 @@ def process_file_upload(file_path):
 agent_tools = [
     Tool(
         name="DocumentQA",
-        func=perform_qa_with_rag,
+        func=memoized_per_session("DocumentQA", perform_qa_with_rag),
         description="""Useful for answering questions or summarizing content from the pre-processed
         'PythonAI.pdf' document. Input should be a specific question or a command like
         'summarize the document'. Always use this tool for any questions about the
@@ -132,9 +119,6 @@ agent_tools = [
 
 # The agent creation logic
 
-# Define the LLM for the agent
-llm = BedrockChat(client=bedrock_runtime, model_id=settings.BEDROCK_MODEL_ID)
-
 # Define a custom prompt for the agent to guide its behavior.
 # This prompt tells the agent what its purpose is and what tools it has.
 prompt_template = PromptTemplate.from_template("""
@@ -156,43 +140,171 @@ Observation: the result of the action.
 Thought: I now know the final answer.
 Final Answer: the final answer to the original input question.
 
+Conversation so far (use it to understand follow-up questions):
+{chat_history}
+
 Begin!
 
 Question: {input}
 Thought:{agent_scratchpad}
 """)
 
-# Create the agent executor. This is the main runnable object.
-agent = create_react_agent(
-    tools=agent_tools,
-    llm=llm,
-    prompt=prompt_template,
-)
+def _build_agent_executor():
+    # Create the agent executor. This is the main runnable object.
+    agent = create_react_agent(
+        tools=agent_tools,
+        llm=get_chat_llm(),
+        prompt=prompt_template,
+    )
+
+    # The AgentExecutor is responsible for running the agent with the provided tools.
+    # A confused loop is cut off after AGENT_MAX_ITERATIONS steps or AGENT_MAX_EXECUTION_TIME
+    # seconds; the intermediate steps are returned so run_agent_task can still answer from them.
+    return AgentExecutor(
+        agent=agent, 
+        tools=agent_tools, 
+        verbose=True, 
+        handle_parsing_errors=True,
+        max_iterations=settings.AGENT_MAX_ITERATIONS,
+        max_execution_time=settings.AGENT_MAX_EXECUTION_TIME,
+        early_stopping_method="force",
+        return_intermediate_steps=True,
+    )
+
+def get_agent_executor():
+    """
+    Builds the agent on first use (or during warm-up) instead of at import time.
+    It is kept in the client registry with the chat model it wraps, so a forked
+    worker builds its own rather than sharing the parent's Bedrock connections.
+    """
+    return get_client_registry().get("agent_executor", _build_agent_executor)
 
-# The AgentExecutor is responsible for running the agent with the provided tools.
-agent_executor = AgentExecutor(
-    agent=agent, 
-    tools=agent_tools, 
-    verbose=True, 
-    handle_parsing_errors=True
+UPLOAD_HELP = (
+    "To add a document, choose a PDF with the Upload File button below the chat; "
+    "it is processed in the background and you will see its progress here."
 )
 
-def run_agent_task(user_input, file_path=None):
+class LLMCallCounter(BaseCallbackHandler):
+    """Counts the LLM calls made by one agent run."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.calls += 1
+
+def answer_directly(intent, user_input, callbacks=None):
+    """
+    Handles a message the intent router recognized, without the ReAct loop.
+    ``callbacks`` receive the answer's tokens as they are generated.
+    """
+    from ai_chatbot.intent_router import UPLOAD, rag_query_for
+
+    if intent == UPLOAD:
+        return UPLOAD_HELP
+    return perform_qa_with_rag(rag_query_for(intent, user_input), callbacks=callbacks)
+
+def route_message(user_input):
+    """
+    Returns the intent the message can be answered for directly, or None for the agent.
+    """
+    if not settings.INTENT_ROUTER_ENABLED:
+        return None
+    from ai_chatbot.intent_router import get_intent_router
+    try:
+        intent, method = get_intent_router().classify(user_input)
+    except Exception as e:
+        logger.error(f"Intent routing failed, falling back to the agent: {e}")
+        return None
+    if intent:
+        logger.info(f"Routed message to '{intent}' by {method}.")
+    return intent
+
+def log_router_stats(every=100):
+    from ai_chatbot.intent_router import get_router_metrics
+
+    stats = get_router_metrics().stats()
+    if sum(stats["requests"].values()) % every == 0:
+        logger.info(f"Intent router: {stats}")
+
+def answer_from_stopped_run(response):
+    """
+    Returns the answer for a run that hit the iteration or time budget: the last knowledge
+    base observation it got, or an apology when it got none.
+    """
+    for action, observation in reversed(response.get("intermediate_steps", [])):
+        if action.tool == "DocumentQA" and isinstance(observation, str) and observation != KNOWLEDGE_BASE_UNAVAILABLE:
+            return observation.replace(REPEATED_OBSERVATION_HINT, "")
+    return "I could not work out an answer in time. Please rephrase your question or make it more specific."
+
+def run_agent_task(user_input, file_path=None, company_id=None, callbacks=None, session_id=None):
     """
     The main function to run the agent.
-    It takes user input and an optional file path.
+    It takes user input, an optional file path and the requester's
+    company, whose index shard the agent searches. ``callbacks`` receive
+    the agent's steps and LLM tokens as they happen (used for streaming).
+    ``session_id`` identifies the conversation: its DocumentQA
+    observations are reused for repeated tool inputs, and its memory
+    gives follow-up questions their context.
     """
-    logger.info(f"Received request: '{user_input}' with file_path: '{file_path}'")
+    logger.info(f"Received request: '{user_input}' with file_path: '{file_path}' (company {company_id})")
 
     # If a file is uploaded, we will force the agent to use the FileUploader tool
     if file_path:
         # Now this call returns the Celery task object
-        return process_file_upload(file_path)
+        return process_file_upload(file_path, company_id)
     
-    # Otherwise, let the agent reason and decide which tool to use
+    from ai_chatbot.intent_router import get_router_metrics
+
+    token = current_index_name.set(index_name_for_company(company_id))
+    started = time.perf_counter()
+    memory = get_conversation_memory() if session_id else None
     try:
-        response = agent_executor.invoke({"input": user_input})
-        return response.get('output', "I am unable to process that request at this time.")
+        conversation = memory.load(session_id) if memory else Conversation()
+        # A follow-up is rewritten with its context, so routing and retrieval see the whole question
+        question = standalone_question(conversation, user_input)
+
+        # Obvious document questions, summaries and upload requests skip the agent loop
+        intent = route_message(question)
+        if intent:
+            response = answer_directly(intent, question, callbacks=callbacks)
+            saved = get_router_metrics().record(intent, time.perf_counter() - started)
+            logger.info(
+                f"Answered '{intent}' directly in {time.perf_counter() - started:.2f}s, saving about {saved:.1f} LLM calls."
+            )
+            log_router_stats()
+            if memory:
+                memory.append(session_id, user_input, response)
+            return response
+
+        # Otherwise, let the agent reason and decide which tool to use
+        from ai_chatbot.agent_trace import AgentTrace
+
+        counter = LLMCallCounter()
+        trace = AgentTrace()
+        session_token = current_session_id.set(session_id)
+        trace_token = current_trace.set(trace)
+        try:
+            chat_history = conversation.render(settings.CONVERSATION_MEMORY_PROMPT_TOKENS) or "(none)"
+            response = get_agent_executor().invoke(
+                {"input": user_input, "chat_history": chat_history},
+                config={"callbacks": (callbacks or []) + [counter, trace]}
+            )
+        finally:
+            current_trace.reset(trace_token)
+            current_session_id.reset(session_token)
+        output = response.get('output', "I am unable to process that request at this time.")
+        if output.startswith(AGENT_STOPPED_PREFIX):
+            trace.stopped_early = True
+            output = answer_from_stopped_run(response)
+        trace.log()
+        get_router_metrics().record("agent", time.perf_counter() - started, counter.calls)
+        log_router_stats()
+        if memory:
+            memory.append(session_id, user_input, output)
+        return output
     except Exception as e:
         logger.error(f"Error in agent execution: {e}")
         return "I apologize, but an error occurred while processing your request."
+    finally:
+        current_index_name.reset(token)
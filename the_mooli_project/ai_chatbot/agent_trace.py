@@ -0,0 +1,141 @@
+import json
+import logging
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+
+def _token_usage(response):
+    """
+    Returns ``(prompt_tokens, completion_tokens)`` reported by the model for one call, or None.
+    """
+    llm_output = response.llm_output or {}
+    usage = llm_output.get("usage") or llm_output.get("token_usage")
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return metadata.get("input_tokens", 0), metadata.get("output_tokens", 0)
+    return None
+
+
+def _estimate_tokens(chars):
+    # About four characters per token for English text
+    return max(1, chars // 4) if chars else 0
+
+
+class AgentTrace(BaseCallbackHandler):
+    """
+    Records one agent run as a list of steps: every LLM call (duration and token usage) and
+    every tool call (tool, input, duration, whether the observation came from the session's
+    tool memo). Token counts are the ones Bedrock reports; when a streamed response carries
+    none, they are estimated from the text and the step is marked ``estimated``.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps = []
+        self.iterations = 0
+        self.stopped_early = False
+        self._open = {}
+        self._tool_inputs = set()
+        self._lock = threading.Lock()
+
+    def _elapsed_ms(self, since):
+        return round((time.perf_counter() - since) * 1000, 1)
+
+    def _begin(self, run_id, step):
+        with self._lock:
+            step["offset_ms"] = self._elapsed_ms(self.started)
+            self.steps.append(step)
+            self._open[run_id] = (step, time.perf_counter())
+
+    def _end(self, run_id):
+        with self._lock:
+            step, started = self._open.pop(run_id, (None, None))
+            if step is not None:
+                step["ms"] = self._elapsed_ms(started)
+            return step
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._begin(run_id, {"type": "llm", "prompt_chars": sum(len(prompt) for prompt in prompts)})
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        chars = sum(len(str(message.content)) for batch in messages for message in batch)
+        self._begin(run_id, {"type": "llm", "prompt_chars": chars})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        step = self._end(run_id)
+        if step is None:
+            return
+        usage = _token_usage(response)
+        if usage is None:
+            text = "".join(generation.text for generations in response.generations for generation in generations)
+            usage = (_estimate_tokens(step["prompt_chars"]), _estimate_tokens(len(text)))
+            step["estimated"] = True
+        del step["prompt_chars"]
+        step["prompt_tokens"], step["completion_tokens"] = usage
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        step = self._end(run_id)
+        if step is not None:
+            step.pop("prompt_chars", None)
+            step["error"] = str(error)
+
+    def on_agent_action(self, action, **kwargs):
+        self.iterations += 1
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._begin(run_id, {"type": "tool", "tool": (serialized or {}).get("name"), "input": input_str[:200]})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        step = self._end(run_id)
+        if step is not None:
+            step["error"] = str(error)
+
+    def seen(self, key):
+        """
+        Records a tool input; returns True if this run already used it.
+        """
+        with self._lock:
+            if key in self._tool_inputs:
+                return True
+            self._tool_inputs.add(key)
+            return False
+
+    def mark_memoized(self):
+        """
+        Flags the tool call in progress as answered from the session's tool memo.
+        """
+        with self._lock:
+            for step in reversed(self.steps):
+                if step["type"] == "tool":
+                    step["memoized"] = True
+                    return
+
+    def summary(self):
+        with self._lock:
+            llm_steps = [step for step in self.steps if step["type"] == "llm"]
+            return {
+                "total_ms": self._elapsed_ms(self.started),
+                "iterations": self.iterations,
+                "stopped_early": self.stopped_early,
+                "llm_calls": len(llm_steps),
+                "prompt_tokens": sum(step.get("prompt_tokens", 0) for step in llm_steps),
+                "completion_tokens": sum(step.get("completion_tokens", 0) for step in llm_steps),
+                "tool_calls": sum(1 for step in self.steps if step["type"] == "tool"),
+                "memoized_tool_calls": sum(1 for step in self.steps if step.get("memoized")),
+                "steps": list(self.steps),
+            }
+
+    def log(self):
+        # One JSON line per run, so traces can be shipped to a log pipeline and queried
+        logger.info(f"Agent trace: {json.dumps(self.summary(), default=str)}")
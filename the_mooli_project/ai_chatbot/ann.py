@@ -0,0 +1,191 @@
+import logging
+import math
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "sq_fp16", "ivf_flat", "ivf_pq", "ivf_pq_refine", "hnsw")
+
+
+def choose_index_type(n_vectors, index_type=None):
+    """
+    Resolves the configured index type; ``auto`` uses exact search for small corpora
+    and switches to FAISS_ANN_INDEX_TYPE once the corpus passes FAISS_ANN_THRESHOLD.
+    """
+    index_type = index_type or settings.FAISS_INDEX_TYPE
+    if index_type == "auto":
+        index_type = "flat" if n_vectors < settings.FAISS_ANN_THRESHOLD else settings.FAISS_ANN_INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type '{index_type}', expected one of {INDEX_TYPES}.")
+    # IVF variants need enough vectors to train their coarse quantizer
+    if index_type.startswith("ivf") and n_vectors < 39 * _nlist_for(n_vectors):
+        return "flat"
+    return index_type
+
+
+def configured_index_type(index_name):
+    """
+    Returns the index type set for ``index_name`` in FAISS_INDEX_TYPE_OVERRIDES, or FAISS_INDEX_TYPE.
+    """
+    return settings.FAISS_INDEX_TYPE_OVERRIDES.get(index_name, settings.FAISS_INDEX_TYPE)
+
+
+def index_type_of(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        return "ivf_pq_refine"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq_fp16"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def supports_remove(index):
+    """
+    Returns True if LangChain's FAISS.delete is safe for ``index``: HNSW cannot remove
+    vectors, and IVF keeps the old ids after removal while LangChain renumbers them.
+    """
+    return index_type_of(index) in ("flat", "sq_fp16")
+
+
+def is_lossy(index):
+    """
+    Returns True if vectors reconstructed from ``index`` are only approximations.
+    """
+    return index_type_of(index) in ("sq_fp16", "ivf_pq", "ivf_pq_refine")
+
+
+def ivf_of(index):
+    """
+    Returns the IVF index inside ``index`` (the base of a refine index), or None.
+    """
+    concrete = faiss.downcast_index(index)
+    if isinstance(concrete, faiss.IndexRefine):
+        concrete = faiss.downcast_index(concrete.base_index)
+    return concrete if isinstance(concrete, faiss.IndexIVF) else None
+
+
+def estimate_index_bytes(index):
+    """
+    Approximates the memory held by ``index``, without serializing it.
+    """
+    concrete = faiss.downcast_index(index)
+    index_type = index_type_of(concrete)
+    if index_type == "sq_fp16":
+        return concrete.ntotal * concrete.d * 2
+    if index_type in ("ivf_pq", "ivf_pq_refine"):
+        # PQ codes plus an 8-byte id per vector, and the coarse centroids
+        ivf = ivf_of(concrete)
+        pq_bytes = ivf.ntotal * (ivf.pq.M + 8) + ivf.nlist * ivf.d * 4
+        # The refine index keeps a float16 copy of every vector for re-ranking
+        return pq_bytes + (concrete.ntotal * concrete.d * 2 if index_type == "ivf_pq_refine" else 0)
+    vector_bytes = concrete.ntotal * concrete.d * 4
+    if index_type == "hnsw":
+        return vector_bytes + concrete.ntotal * concrete.hnsw.nb_neighbors(0) * 4
+    if index_type == "ivf_flat":
+        return vector_bytes + concrete.ntotal * 8 + concrete.nlist * concrete.d * 4
+    return vector_bytes
+
+
+def limit_search_threads():
+    """
+    Caps FAISS's OpenMP threads, so one large search cannot take every core from the others.
+    """
+    faiss.omp_set_num_threads(settings.FAISS_OMP_THREADS)
+
+
+def _nlist_for(n_vectors):
+    return max(1, min(4096, int(4 * math.sqrt(max(n_vectors, 1)))))
+
+
+def new_index(index_type, dimensions, n_vectors):
+    """
+    Creates an empty FAISS index of ``index_type`` sized for about ``n_vectors`` vectors.
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimensions)
+    if index_type == "sq_fp16":
+        # Half the memory of flat; float16 rounding barely moves embedding distances
+        return faiss.IndexScalarQuantizer(dimensions, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimensions, settings.FAISS_HNSW_M)
+        index.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+        return index
+    quantizer = faiss.IndexFlatL2(dimensions)
+    nlist = _nlist_for(n_vectors)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dimensions, nlist)
+    if index_type == "ivf_pq":
+        return faiss.IndexIVFPQ(quantizer, dimensions, nlist, settings.FAISS_PQ_M, 8)
+    if index_type == "ivf_pq_refine":
+        # PQ finds k * FAISS_REFINE_K_FACTOR candidates, which are re-ranked with float16 vectors
+        base = faiss.IndexIVFPQ(quantizer, dimensions, nlist, settings.FAISS_PQ_M, 8)
+        return faiss.IndexRefine(base, faiss.IndexScalarQuantizer(dimensions, faiss.ScalarQuantizer.QT_fp16))
+    raise ValueError(f"Unknown FAISS index type '{index_type}'.")
+
+
+def configure_search(index):
+    """
+    Applies the configured search-time parameters (nprobe / efSearch) to ``index``.
+    """
+    # The downcast proxy does not own the index, so the original object is returned
+    concrete = faiss.downcast_index(index)
+    if isinstance(concrete, faiss.IndexRefine):
+        concrete.k_factor = settings.FAISS_REFINE_K_FACTOR
+    ivf = ivf_of(concrete)
+    if ivf is not None:
+        ivf.nprobe = settings.FAISS_IVF_NPROBE
+    elif isinstance(concrete, faiss.IndexHNSW):
+        concrete.hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+    return index
+
+
+def build_index(index_type, vectors):
+    """
+    Builds (and trains, where needed) an index of ``index_type`` holding ``vectors`` in order.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = new_index(index_type, vectors.shape[1], len(vectors))
+    if not index.is_trained:
+        # k-means does not improve past a few hundred points per centroid, so large corpora are subsampled
+        step = max(1, len(vectors) // (256 * _nlist_for(len(vectors))))
+        logger.info(f"Training {index_type} index on {len(vectors[::step])} of {len(vectors)} vectors...")
+        index.train(vectors[::step])
+    if len(vectors):
+        index.add(vectors)
+    return configure_search(index)
+
+
+def reconstruct_all(index):
+    """
+    Returns every vector stored in ``index``, in insertion order.
+    """
+    index = faiss.downcast_index(index)
+    # Refine indexes reconstruct from their flat refine index, which needs no direct map
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def retype_vector_store(vector_store, index_type=None, vectors=None):
+    """
+    Rebuilds the FAISS index behind a LangChain vector store with the type chosen for its size.
+    Vector positions are preserved, so ``index_to_docstore_id`` stays valid.
+    """
+    current_type = index_type_of(vector_store.index)
+    index_type = choose_index_type(vector_store.index.ntotal, index_type)
+    if index_type == current_type and vectors is None:
+        return vector_store
+    if vectors is None:
+        vectors = reconstruct_all(vector_store.index)
+    logger.info(f"Rebuilding {current_type} index with {len(vectors)} vectors as {index_type}.")
+    vector_store.index = build_index(index_type, vectors)
+    return vector_store
@@ -0,0 +1,214 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    """
+    Lowercases a question and drops punctuation and repeated whitespace,
+    so trivially different phrasings share one cache entry.
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+
+_SUMMARY_RULE = re.compile(r"\b(summar(y|ize|ise|izing|ising)|tl;?dr|overview)\b", re.IGNORECASE)
+_NEGATION_RULE = re.compile(r"\b(not|no|never|none|nor|without|cannot|except)\b|n['’]t\b", re.IGNORECASE)
+_QUESTION_WORDS = (
+    "what", "which", "who", "whom", "whose", "when", "where", "why", "how",
+    "is", "are", "was", "were", "do", "does", "did", "can", "could", "should", "will", "would",
+)
+# Words that change the phrasing of a question but not what it asks about
+_FUNCTION_WORDS = set(_QUESTION_WORDS) | {
+    "a", "an", "the", "of", "in", "on", "at", "to", "for", "from", "by", "with", "about", "and", "or",
+    "i", "me", "my", "we", "you", "your", "it", "its", "this", "that", "these", "those", "there",
+    "be", "been", "has", "have", "had", "please", "tell", "explain", "describe", "give", "say", "says",
+    "document", "doc", "pdf", "file", "text", "s", "t", "much", "many", "some", "any",
+}
+
+
+def query_signature(query):
+    """
+    Returns what two questions must share for one's answer to be reused for the other:
+    their intent (a summary request, or the question word they start with), whether they
+    are negated, and their content words (entities, numbers and the terms asked about).
+    """
+    words = normalize_query(query).split()
+    if _SUMMARY_RULE.search(query):
+        intent = "summarize"
+    else:
+        intent = next((word for word in words if word in _QUESTION_WORDS), "statement")
+    content = frozenset(
+        # A crude plural fold, so "supports" and "support" are the same term
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+        for word in words if word not in _FUNCTION_WORDS
+    )
+    return intent, bool(_NEGATION_RULE.search(query)), content
+
+
+def signatures_compatible(first, second):
+    """
+    Returns True if near-duplicate questions with these signatures may share an answer.
+    One may add terms the other leaves implicit, but a term swapped for another
+    ("does pandas support parquet" vs "does numpy support parquet") means a different question.
+    """
+    if first[:2] != second[:2]:
+        return False
+    return not (first[2] - second[2] and second[2] - first[2])
+
+
+class CachedAnswer:
+    def __init__(self, answer, embedding, signature=None):
+        self.answer = answer
+        self.embedding = embedding
+        self.signature = signature
+        self.created_at = time.monotonic()
+
+
+class AnswerCache:
+    """
+    Caches generated answers per (namespace, index version, normalized query).
+
+    A namespace is one knowledge base (an index name or an S3 object). On an exact miss,
+    the query embedding is compared with the cached ones and the closest answer is reused
+    if its cosine similarity reaches ``similarity_threshold`` and the two questions have
+    compatible signatures (same intent and polarity, no swapped entity; see
+    ``query_signature``). Entries expire after ``ttl``
+    seconds, the least recently used are evicted beyond ``max_entries``, and a namespace
+    is cleared as soon as it is queried with a different index version.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _check_version(self, namespace, version):
+        if self._versions.get(namespace) != version:
+            stale = [key for key in self._entries if key[0] == namespace]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                logger.info(f"Answer cache: dropped {len(stale)} answers for '{namespace}' after index change.")
+            self._versions[namespace] = version
+
+    def _expired(self, entry):
+        return time.monotonic() - entry.created_at > self.ttl
+
+    def _lookup_exact(self, key):
+        # Called with the lock held
+        entry = self._entries.get(key)
+        if entry is not None and not self._expired(entry):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.answer
+        if entry is not None:
+            del self._entries[key]
+        return None
+
+    def lookup_exact(self, namespace, version, query):
+        """
+        Returns the answer cached for the same normalized question, without counting a miss.
+        """
+        with self._lock:
+            self._check_version(namespace, version)
+            return self._lookup_exact((namespace, normalize_query(query)))
+
+    def lookup(self, namespace, version, query, embedding=None):
+        key = (namespace, normalize_query(query))
+        with self._lock:
+            self._check_version(namespace, version)
+            answer = self._lookup_exact(key)
+            if answer is not None:
+                return answer
+
+            if embedding is not None:
+                best_key, best_score = self._nearest(namespace, embedding, query_signature(query))
+                if best_key is not None and best_score >= self.similarity_threshold:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    logger.info(f"Answer cache: semantic hit (similarity {best_score:.3f}) for '{query}'.")
+                    return self._entries[best_key].answer
+            self.misses += 1
+            return None
+
+    def _nearest(self, namespace, embedding, signature):
+        candidates = [
+            (key, entry) for key, entry in self._entries.items()
+            if key[0] == namespace and entry.embedding is not None and not self._expired(entry)
+            and entry.signature is not None and signatures_compatible(entry.signature, signature)
+        ]
+        if not candidates:
+            return None, 0.0
+        matrix = np.stack([entry.embedding for _, entry in candidates])
+        scores = matrix @ embedding
+        best = int(np.argmax(scores))
+        return candidates[best][0], float(scores[best])
+
+    def put(self, namespace, version, query, answer, embedding=None):
+        key = (namespace, normalize_query(query))
+        with self._lock:
+            self._check_version(namespace, version)
+            self._entries[key] = CachedAnswer(answer, embedding, query_signature(query))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, namespace, version, query, compute, embed=None):
+        """
+        Returns a cached answer for ``query`` or computes, caches and returns a new one.
+        ``embed(query)`` enables near-duplicate matching; it is only called when the exact
+        normalized question is not cached.
+        """
+        answer = self.lookup_exact(namespace, version, query)
+        if answer is not None:
+            return answer
+        embedding = None
+        if embed is not None:
+            vector = np.asarray(embed(query), dtype=np.float32)
+            embedding = vector / (np.linalg.norm(vector) or 1.0)
+        answer = self.lookup(namespace, version, query, embedding)
+        if answer is not None:
+            return answer
+        answer = compute()
+        self.put(namespace, version, query, answer, embedding)
+        return answer
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """
+    Returns the process-wide answer cache configured from settings.
+    """
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache(
+                max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+                ttl=settings.ANSWER_CACHE_TTL,
+                similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+            )
+        return _answer_cache
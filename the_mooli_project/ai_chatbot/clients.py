@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+    """
+    Holds one instance of each network client per process, so connection pools, TLS sessions
+    and credentials are reused across requests and tasks instead of being rebuilt on hot paths.
+
+    Pooled sockets must never be shared between processes: a Celery prefork child (or any
+    forked process) starts with an empty registry and builds its own clients on first use.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        # A fresh lock too: another thread may have held the old one at fork time
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        self._clients = {}
+        self._stats = {}
+
+    def get(self, name, factory):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            stats = self._stats.setdefault(name, {"created": 0, "reused": 0})
+            client = self._clients.get(name)
+            if client is None:
+                client = factory()
+                self._clients[name] = client
+                stats["created"] += 1
+                logger.info(f"Created client '{name}' in process {self._pid}.")
+            else:
+                stats["reused"] += 1
+            return client
+
+    def peek(self, name):
+        """
+        Returns the client if this process has already created it, without counting a use.
+        """
+        with self._lock:
+            return self._clients.get(name) if self._pid == os.getpid() else None
+
+    def discard(self, name):
+        """
+        Drops a client (e.g. after its credentials were rotated); the next ``get`` rebuilds it.
+        """
+        with self._lock:
+            self._clients.pop(name, None)
+
+    def after_fork(self):
+        self._reset()
+
+    def stats(self):
+        with self._lock:
+            clients = {}
+            for name, stats in self._stats.items():
+                uses = stats["created"] + stats["reused"]
+                clients[name] = dict(stats, reuse_ratio=round(stats["reused"] / uses, 4) if uses else 0.0)
+            return {"pid": self._pid, "clients": clients}
+
+
+_client_registry = ClientRegistry()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_client_registry.after_fork)
+
+
+def get_client_registry():
+    return _client_registry
+
+
+def aws_config(max_pool_connections):
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=max_pool_connections,
+        tcp_keepalive=True,
+        connect_timeout=settings.AWS_CONNECT_TIMEOUT,
+        read_timeout=settings.AWS_READ_TIMEOUT,
+        retries={"max_attempts": settings.AWS_MAX_ATTEMPTS, "mode": settings.AWS_RETRY_MODE},
+    )
+
+
+def get_boto3_session():
+    # boto3's default session is not safe to create clients from concurrently
+    import boto3
+
+    return _client_registry.get("boto3_session", lambda: boto3.session.Session(region_name=settings.AWS_REGION_NAME))
+
+
+def get_bedrock_runtime():
+    return _client_registry.get("bedrock-runtime", lambda: get_boto3_session().client(
+        "bedrock-runtime",
+        # Room for every concurrent embedding worker plus the chat calls
+        config=aws_config(settings.EMBEDDING_MAX_WORKERS + 4)
+    ))
+
+
+def get_s3_client():
+    return _client_registry.get("s3", lambda: get_boto3_session().client(
+        "s3",
+        # Room for every concurrent ranged download of the S3 cache plus uploads
+        config=aws_config(settings.S3_CACHE_MAX_CONCURRENCY + 2)
+    ))
+
+
+def _build_slack_client():
+    from slack_sdk import WebClient
+    from slack_sdk.http_retry.builtin_handlers import ConnectionErrorRetryHandler
+
+    return WebClient(
+        token=settings.SLACK_BOT_TOKEN,
+        timeout=settings.SLACK_TIMEOUT,
+        # 429s are not retried here: the outbox (slack_outbox.py) paces the channel by Retry-After instead
+        retry_handlers=[ConnectionErrorRetryHandler(max_retry_count=settings.SLACK_MAX_RETRIES)],
+    )
+
+
+def get_redis_client():
+    """
+    Returns the Redis client of the conversation memory; redis-py keeps a connection pool per client.
+    """
+    import redis
+
+    return _client_registry.get("redis", lambda: redis.Redis.from_url(
+        settings.CONVERSATION_MEMORY_REDIS_URL,
+        socket_timeout=settings.CONVERSATION_MEMORY_REDIS_TIMEOUT,
+        socket_connect_timeout=settings.CONVERSATION_MEMORY_REDIS_TIMEOUT,
+        health_check_interval=30,
+    ))
+
+
+def get_slack_client():
+    """
+    Returns the Slack Web API client. Unlike ``slack_bolt.App`` it does not call auth.test when created.
+    """
+    return _client_registry.get("slack", _build_slack_client)
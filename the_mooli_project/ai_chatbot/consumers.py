@@ -0,0 +1,27 @@
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from ai_chatbot.progress import TERMINAL_STAGES, snapshot, task_group
+
+
+class TaskProgressConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes the progress events of one Celery task to the browser. The current state is sent on
+    connect, so a client that subscribes late (or reconnects) does not miss where the task is.
+    """
+
+    async def connect(self):
+        self.task_id = self.scope["url_route"]["kwargs"]["task_id"]
+        self.group_name = task_group(self.task_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await self.task_progress({"event": await sync_to_async(snapshot)(self.task_id)})
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def task_progress(self, message):
+        event = message["event"]
+        await self.send_json(event)
+        if event["stage"] in TERMINAL_STAGES:
+            await self.close()
@@ -0,0 +1,265 @@
+import json
+import logging
+import re
+import threading
+import zlib
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "chat_memory:"
+
+# Messages that only make sense with the conversation before them: they open with a
+# connective or a pronoun ("and its limitations?", "what about Java?", "it crashes"), or are
+# short and made only of pronouns and function words ("tell me more", "why is that?").
+# Anything naming its own subject is answered as it is, without a rewrite.
+_FOLLOW_UP_START = re.compile(
+    r"^(and|but|so|also|then|what about|how about|what else|it|its|it's|they|them|their|those|these|same)\b",
+    re.IGNORECASE,
+)
+_REFERRING_WORDS = {
+    "it", "its", "it's", "this", "that", "these", "those", "they", "them", "their", "he", "she", "his", "her",
+    "one", "ones", "more", "else", "again", "above", "previous", "earlier", "same",
+}
+_FUNCTION_WORDS = {
+    "what", "who", "when", "where", "why", "how", "which", "is", "are", "was", "were", "be", "do", "does",
+    "did", "can", "could", "would", "should", "will", "the", "a", "an", "of", "to", "in", "on", "for",
+    "about", "with", "from", "and", "or", "but", "so", "not", "no", "yes", "me", "you", "i", "we", "us",
+    "tell", "explain", "mean", "means", "say", "says", "said", "show", "give", "please", "any", "some",
+    "there", "than", "then", "also", "ok", "okay", "thanks", "example", "examples", "detail", "details",
+}
+FOLLOW_UP_MAX_WORDS = 6
+
+SUMMARY_PROMPT = """Update the summary of a conversation between a user and the Mooli chatbot.
+Keep facts, names, documents and open questions the user may refer back to; drop small talk.
+Answer with the updated summary only, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New exchanges:
+{turns}
+
+Updated summary:"""
+
+STANDALONE_PROMPT = """Rewrite the user's last message as a standalone question that can be understood
+without the conversation. Keep document names. Answer with the question only.
+
+Conversation:
+{history}
+
+Last message: {message}
+
+Standalone question:"""
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(settings.CONVERSATION_MEMORY_ENCODING)
+        return _encoding
+
+
+def count_tokens(text):
+    return len(_get_encoding().encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, keep="head"):
+    """
+    Cuts ``text`` to ``max_tokens`` tokens, keeping its start (or its end with ``keep="tail"``).
+    """
+    if max_tokens <= 0:
+        return ""
+    tokens = _get_encoding().encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    # One token is left for the ellipsis
+    kept = tokens[:max_tokens - 1] if keep == "head" else tokens[-max_tokens:]
+    return _get_encoding().decode(kept).strip() + (" …" if keep == "head" else "")
+
+
+def conversation_id_for(platform, channel_id=None, conversation_id=None, session_key=None):
+    """
+    Returns the memory key of a conversation: a Slack channel, a Teams conversation or a web session.
+    """
+    if platform == "slack":
+        return f"slack:{channel_id}"
+    if platform == "teams":
+        return f"teams:{conversation_id}"
+    return f"web:{session_key}"
+
+
+def is_follow_up(text):
+    if _FOLLOW_UP_START.match(text.strip()):
+        return True
+    words = re.findall(r"[\w']+", text.lower())
+    return (
+        0 < len(words) <= FOLLOW_UP_MAX_WORDS
+        and any(word in _REFERRING_WORDS for word in words)
+        and all(word in _REFERRING_WORDS or word in _FUNCTION_WORDS for word in words)
+    )
+
+
+class Conversation:
+    """
+    The memory of one conversation: a rolling summary of older exchanges plus the most recent
+    exchanges verbatim, each stored with its token count so budgets never need a recount.
+    """
+
+    def __init__(self, summary="", turns=None, summary_tokens=0):
+        self.summary = summary
+        self.summary_tokens = summary_tokens
+        self.turns = turns or []  # [user, assistant, tokens]
+
+    @classmethod
+    def decode(cls, raw):
+        if not raw:
+            return cls()
+        data = json.loads(zlib.decompress(raw))
+        return cls(data.get("s", ""), data.get("t", []), data.get("n", 0))
+
+    def encode(self):
+        # Short keys, no whitespace and zlib keep a conversation to a few KB in Redis
+        data = {"s": self.summary, "n": self.summary_tokens, "t": self.turns}
+        return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode())
+
+    def tokens(self):
+        return self.summary_tokens + sum(turn[2] for turn in self.turns)
+
+    def render(self, max_tokens):
+        """
+        Returns the history to put in a prompt, at most ``max_tokens`` tokens: as many of the
+        latest exchanges as fit, after the summary (cut short if it alone exceeds the budget).
+        """
+        summary = self.summary
+        summary_tokens = self.summary_tokens
+        if summary_tokens > max_tokens // 2:
+            summary = truncate_tokens(summary, max_tokens // 2)
+            summary_tokens = max_tokens // 2
+        budget = max_tokens - summary_tokens
+        recent = []
+        for user, assistant, tokens in reversed(self.turns):
+            if tokens > budget:
+                break
+            recent.append(f"User: {user}\nMooli: {assistant}")
+            budget -= tokens
+        parts = [f"Summary of the earlier conversation: {summary}"] if summary else []
+        parts.extend(reversed(recent))
+        return "\n".join(parts)
+
+
+class ConversationMemory:
+    """
+    Stores conversations in Redis under ``chat_memory:<conversation id>``.
+
+    Each exchange is kept verbatim (every message cut to ``turn_tokens``) until the
+    conversation exceeds ``max_tokens``; the oldest exchanges are then folded into the
+    rolling summary (at most ``summary_tokens``) by the chat model. Updates of one
+    conversation are serialized with a Redis lock, since Slack and Teams messages of the same
+    channel can be handled by different workers at once. Idle conversations expire after ``ttl``.
+    """
+
+    def __init__(self, redis_client, max_tokens=2000, summary_tokens=400, turn_tokens=300, ttl=7 * 24 * 3600):
+        self.redis = redis_client
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.turn_tokens = turn_tokens
+        self.ttl = ttl
+
+    def load(self, conversation_id):
+        try:
+            return Conversation.decode(self.redis.get(KEY_PREFIX + conversation_id))
+        except Exception as e:
+            # Answering without history beats not answering
+            logger.warning(f"Could not load conversation memory '{conversation_id}': {e}")
+            return Conversation()
+
+    def append(self, conversation_id, user_message, answer):
+        key = KEY_PREFIX + conversation_id
+        user_message = truncate_tokens(user_message, self.turn_tokens)
+        answer = truncate_tokens(answer, self.turn_tokens)
+        turn = [user_message, answer, count_tokens(user_message) + count_tokens(answer) + 4]
+        try:
+            with self.redis.lock(key + ":lock", timeout=60, blocking_timeout=10):
+                conversation = Conversation.decode(self.redis.get(key))
+                conversation.turns.append(turn)
+                if conversation.tokens() > self.max_tokens:
+                    self._fold(conversation)
+                self.redis.set(key, conversation.encode(), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Could not update conversation memory '{conversation_id}': {e}")
+
+    def _fold(self, conversation):
+        """
+        Moves the oldest exchanges into the summary until the conversation fits its budget,
+        keeping at least the latest exchange verbatim.
+        """
+        budget = self.max_tokens - self.summary_tokens
+        folded = []
+        while len(conversation.turns) > 1 and sum(turn[2] for turn in conversation.turns) > budget:
+            folded.append(conversation.turns.pop(0))
+        if not folded:
+            return
+        turns = "\n".join(f"User: {user}\nMooli: {assistant}" for user, assistant, _ in folded)
+        try:
+            summary = summarize(conversation.summary, turns, self.summary_tokens)
+        except Exception as e:
+            logger.warning(f"Could not summarize conversation, keeping the latest text instead: {e}")
+            summary = (conversation.summary + "\n" + turns).strip()
+        summary = truncate_tokens(summary, self.summary_tokens, keep="tail")
+        conversation.summary = summary
+        conversation.summary_tokens = count_tokens(summary)
+
+    def clear(self, conversation_id):
+        self.redis.delete(KEY_PREFIX + conversation_id)
+
+
+def summarize(summary, turns, max_tokens):
+    from ai_chatbot.rag_engine import get_chat_llm
+
+    prompt = SUMMARY_PROMPT.format(max_words=int(max_tokens * 0.7), summary=summary or "(none)", turns=turns)
+    return get_chat_llm().invoke(prompt).content.strip()
+
+
+def standalone_question(conversation, message):
+    """
+    Rewrites a follow-up ("what about its limitations?") into a question retrieval can answer
+    on its own. Messages that do not look like follow-ups, or come without history, are
+    returned unchanged, so they cost no extra LLM call and keep hitting the answer cache.
+    """
+    if (not conversation.turns and not conversation.summary) or not is_follow_up(message):
+        return message
+    from ai_chatbot.rag_engine import get_chat_llm
+
+    history = conversation.render(settings.CONVERSATION_MEMORY_PROMPT_TOKENS)
+    try:
+        question = get_chat_llm().invoke(STANDALONE_PROMPT.format(history=history, message=message)).content.strip()
+    except Exception as e:
+        logger.warning(f"Could not rewrite follow-up question: {e}")
+        return message
+    logger.info(f"Rewrote follow-up '{message}' as '{question}'.")
+    return question or message
+
+
+def get_conversation_memory():
+    """
+    Returns the conversation store, or None when CONVERSATION_MEMORY_ENABLED is off.
+    """
+    if not settings.CONVERSATION_MEMORY_ENABLED:
+        return None
+    from ai_chatbot.clients import get_client_registry, get_redis_client
+
+    return get_client_registry().get("conversation_memory", lambda: ConversationMemory(
+        get_redis_client(),
+        max_tokens=settings.CONVERSATION_MEMORY_MAX_TOKENS,
+        summary_tokens=settings.CONVERSATION_MEMORY_SUMMARY_TOKENS,
+        turn_tokens=settings.CONVERSATION_MEMORY_TURN_TOKENS,
+        ttl=settings.CONVERSATION_MEMORY_TTL,
+    ))
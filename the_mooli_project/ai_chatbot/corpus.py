@@ -0,0 +1,434 @@
+import itertools
+import json
+import logging
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from filelock import FileLock
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from ai_chatbot.rag_engine import get_bedrock_embeddings, load_vector_store
+from ai_chatbot.ann import (
+    build_index,
+    choose_index_type,
+    configured_index_type,
+    estimate_index_bytes,
+    index_type_of,
+    is_lossy,
+    reconstruct_all,
+    retype_vector_store,
+    supports_remove,
+)
+from ai_chatbot.dedup import FingerprintIndex, fingerprint
+from ai_chatbot.vector_store_registry import (
+    MANIFEST_FILE,
+    publish_index,
+    read_index_version,
+    resolve_index_path,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def document_id_for(file_path):
+    """
+    Returns the stable document id of an uploaded file (its S3 key).
+    """
+    return f"uploads/{os.path.basename(file_path)}"
+
+
+class CorpusManager:
+    """
+    Maintains one FAISS index holding many documents.
+
+    Documents are added, replaced or deleted incrementally instead of rebuilding the
+    whole index. Every chunk gets a stable id (``<doc_id>#<n>``) and the manifest
+    published with each index version records which chunks belong to which document,
+    which chunks of a document are aliases of a duplicate stored once, and every
+    stored chunk's fingerprint.
+    Writers are serialised with a file lock; readers keep using the previous version
+    until the new one is published.
+    """
+
+    def __init__(self, index_name="faiss_index", embeddings=None, index_type=None):
+        self.index_name = index_name
+        self.embeddings = embeddings or get_bedrock_embeddings()
+        # e.g. "sq_fp16" or "ivf_pq_refine" to store this index compressed
+        self.index_type = index_type or configured_index_type(index_name)
+        self.last_dedup_stats = {}
+
+    def _lock(self):
+        os.makedirs(self.index_name, exist_ok=True)
+        return FileLock(os.path.join(self.index_name, ".write.lock"))
+
+    def _load(self):
+        """
+        Loads a private, writable copy of the current version and its manifest.
+        """
+        version = read_index_version(self.index_name)
+        if version is None:
+            return None, {"documents": {}, "deleted_chunks": 0}
+        path = resolve_index_path(self.index_name, version)
+        vector_store = load_vector_store(path)
+        try:
+            with open(os.path.join(path, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = self._manifest_from_docstore(vector_store)
+        return vector_store, manifest
+
+    def _manifest_from_docstore(self, vector_store):
+        # Indexes built before the corpus manager have no manifest; group their chunks by source
+        documents = {}
+        for chunk_id in vector_store.index_to_docstore_id.values():
+            doc = vector_store.docstore.search(chunk_id)
+            source = doc.metadata.get("doc_id") or document_id_for(doc.metadata.get("source", "unknown"))
+            documents.setdefault(source, {"chunks": [], "added_at": None})["chunks"].append(chunk_id)
+        return {"documents": documents, "deleted_chunks": 0}
+
+    def _fingerprint_index(self, vector_store, manifest):
+        """
+        Returns the fingerprints of every stored chunk, computing (once) those missing
+        from manifests written before deduplication.
+        """
+        stored = manifest.setdefault("fingerprints", {})
+        index = FingerprintIndex(settings.INGEST_DEDUP_MIN_BANDS)
+        for entry in manifest["documents"].values():
+            for chunk_id in entry["chunks"]:
+                if chunk_id not in stored:
+                    stored[chunk_id] = fingerprint(vector_store.docstore.search(chunk_id).page_content)
+                index.add(chunk_id, stored[chunk_id])
+        return index
+
+    def _release_chunks(self, manifest, chunk_ids):
+        """
+        Returns which of ``chunk_ids`` (chunks of a document being removed) can leave the index.
+        A chunk that another document aliases is handed over to that document instead.
+        """
+        referenced = {}
+        for other_id, entry in manifest["documents"].items():
+            for alias_id, chunk_id in entry.get("aliases", {}).items():
+                referenced.setdefault(chunk_id, (other_id, alias_id))
+        removable = []
+        for chunk_id in chunk_ids:
+            if chunk_id in referenced:
+                other_id, alias_id = referenced[chunk_id]
+                entry = manifest["documents"][other_id]
+                del entry["aliases"][alias_id]
+                entry["chunks"].append(chunk_id)
+            else:
+                removable.append(chunk_id)
+        fingerprints = manifest.get("fingerprints", {})
+        for chunk_id in removable:
+            fingerprints.pop(chunk_id, None)
+        return removable
+
+    def list_documents(self):
+        _, manifest = self._load()
+        return {
+            doc_id: len(entry["chunks"]) + len(entry.get("aliases", {}))
+            for doc_id, entry in manifest["documents"].items()
+        }
+
+    def add_document(self, doc_id, documents):
+        """
+        Adds ``documents`` (the chunks of one file) under ``doc_id``, replacing any
+        chunks previously stored for that document.
+        """
+        return self.add_document_batches(doc_id, [documents] if documents else [])
+
+    def add_document_batches(self, doc_id, batches, info=None):
+        """
+        Adds the chunks of one document as they arrive from an iterable of batches,
+        replacing any chunks previously stored for that document. Nothing is published
+        if the iterable fails part-way, so readers keep the previous version.
+        """
+        with self.writer() as writer:
+            chunk_count, replaced = writer.add_document_batches(doc_id, batches, info)
+        self.last_dedup_stats = writer.dedup_stats
+
+        if not chunk_count:
+            logger.error(f"No chunks to add for {doc_id}.")
+            return None
+        logger.info(
+            f"{'Replaced' if replaced else 'Added'} {doc_id} ({chunk_count} chunks) "
+            f"in '{self.index_name}' version {writer.version}. Deduplication: {writer.dedup_stats}"
+        )
+        return writer.vector_store
+
+    def writer(self):
+        """
+        Returns a context manager that holds the write lock so several documents can be
+        added with a single publish (see CorpusWriter).
+        """
+        return CorpusWriter(self)
+
+    def delete_document(self, doc_id):
+        with self._lock():
+            vector_store, manifest = self._load()
+            entry = manifest["documents"].pop(doc_id, None)
+            if vector_store is None or entry is None:
+                logger.warning(f"{doc_id} is not in '{self.index_name}'.")
+                return False
+            removable = self._release_chunks(manifest, entry["chunks"])
+            if removable:
+                vector_store = self._remove_chunks(vector_store, removable)
+            manifest["deleted_chunks"] += len(removable)
+            publish_index(vector_store, self.index_name, manifest)
+        logger.info(f"Deleted {doc_id} ({len(entry['chunks'])} chunks) from '{self.index_name}'.")
+        return True
+
+    def _remove_chunks(self, vector_store, chunk_ids):
+        if supports_remove(vector_store.index):
+            vector_store.delete(chunk_ids)
+            return vector_store
+        # ANN indexes cannot drop vectors in place, so the index is rebuilt without them
+        removed = set(chunk_ids)
+        live_ids = [chunk_id for chunk_id in vector_store.index_to_docstore_id.values() if chunk_id not in removed]
+        return self._rebuild(vector_store, live_ids, index_type_of(vector_store.index))
+
+    def _rebuild(self, vector_store, live_ids, index_type=None):
+        """
+        Returns a new vector store holding only ``live_ids``, with a freshly trained index.
+        """
+        position = {chunk_id: i for i, chunk_id in vector_store.index_to_docstore_id.items()}
+        documents = [vector_store.docstore.search(chunk_id) for chunk_id in live_ids]
+        if is_lossy(vector_store.index):
+            # PQ codes only approximate the vectors; exact ones come back from the embedding cache
+            vectors = np.asarray(self.embeddings.embed_documents([doc.page_content for doc in documents]), dtype=np.float32)
+        else:
+            vectors = reconstruct_all(vector_store.index)[[position[chunk_id] for chunk_id in live_ids]]
+        index_type = choose_index_type(len(live_ids), index_type)
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=build_index(index_type, vectors.reshape(len(live_ids), vector_store.index.d)),
+            docstore=InMemoryDocstore(dict(zip(live_ids, documents))),
+            index_to_docstore_id=dict(enumerate(live_ids)),
+        )
+
+    def compact(self):
+        """
+        Rebuilds the index from the vectors of the chunks listed in the manifest,
+        dropping orphaned docstore entries and vectors left behind by deletes, and
+        retraining ANN indexes so their partitions match the current corpus.
+        """
+        with self._lock():
+            vector_store, manifest = self._load()
+            if vector_store is None:
+                return None
+
+            live_ids = [chunk_id for entry in manifest["documents"].values() for chunk_id in entry["chunks"]]
+            stored_ids = set(vector_store.index_to_docstore_id.values())
+            missing = [chunk_id for chunk_id in live_ids if chunk_id not in stored_ids]
+            if missing:
+                logger.warning(f"Compaction: {len(missing)} manifest chunks have no vector, dropping them.")
+                for entry in manifest["documents"].values():
+                    entry["chunks"] = [chunk_id for chunk_id in entry["chunks"] if chunk_id in stored_ids]
+                live_ids = [chunk_id for chunk_id in live_ids if chunk_id in stored_ids]
+
+            fingerprints = manifest.get("fingerprints", {})
+            manifest["fingerprints"] = {chunk_id: fingerprints[chunk_id] for chunk_id in live_ids if chunk_id in fingerprints}
+            compacted = self._rebuild(vector_store, live_ids, self.index_type)
+            dropped = vector_store.index.ntotal - compacted.index.ntotal
+            manifest["deleted_chunks"] = 0
+            manifest["index_type"] = index_type_of(compacted.index)
+            version = publish_index(compacted, self.index_name, manifest)
+
+        logger.info(
+            f"Compacted '{self.index_name}' into {manifest['index_type']} version {version}: "
+            f"{compacted.index.ntotal} vectors, {dropped} dropped."
+        )
+        return compacted
+
+
+class CorpusWriterError(Exception):
+    """Raised when a writer's changes can no longer be published consistently."""
+
+
+class CorpusWriter:
+    """
+    Holds the corpus write lock and a private copy of the index while documents are added.
+
+    Changes are published when ``publish()`` is called and once more on a clean exit;
+    if the block raises, unpublished changes are dropped. A document whose chunks fail
+    part-way is rolled back, so the writer can go on with other documents; if even that
+    fails the writer is ``broken`` and refuses to publish.
+    """
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.vector_store = None
+        self.manifest = None
+        self.version = None
+        self.dirty = False
+        self.broken = False
+        self.fingerprints = None
+        self.dedup_stats = {}
+        self._lock = corpus._lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self.vector_store, self.manifest = self.corpus._load()
+            if settings.INGEST_DEDUP:
+                self.fingerprints = self.corpus._fingerprint_index(self.vector_store, self.manifest)
+        except Exception:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None and self.dirty:
+                self.publish()
+        finally:
+            self._lock.release()
+
+    def add_document_batches(self, doc_id, batches, info=None):
+        """
+        Adds one document's chunks batch by batch and returns ``(chunk_count, replaced)``.
+        ``info`` is stored with the document's manifest entry.
+
+        With INGEST_DEDUP, chunks whose normalized text is already stored are not embedded: a
+        match in the previous version of the document keeps its vector, any other match becomes
+        an alias. Near duplicates (at least INGEST_DEDUP_MIN_BANDS shared MinHash bands) are only
+        counted: an edited chunk of a revised PDF must be stored with its own text, or answers
+        would quote the old one. ``dedup_stats`` reports the embedding calls and index bytes saved.
+
+        If ``batches`` (or embedding them) raises, the chunks added so far are removed and
+        the document's previous entry is restored before the exception propagates.
+        """
+        if self.broken:
+            raise CorpusWriterError(f"Writer for '{self.corpus.index_name}' is broken; no more documents can be added.")
+        chunk_ids = []
+        new_chunk_ids = []
+        popped = None
+        created_store = self.vector_store is None
+        was_dirty = self.dirty
+        aliases = {}
+        previous = None
+        reused = set()
+        stats = {"chunks": 0, "exact_duplicates": 0, "near_duplicates": 0, "reused_from_previous": 0, "index_bytes_saved": 0}
+        bytes_per_vector = self._bytes_per_vector()
+        sequence = itertools.count()
+
+        def next_chunk_id():
+            # Chunks of the previous version stay in the index until the end, so their ids are skipped
+            while True:
+                chunk_id = f"{doc_id}#{next(sequence)}"
+                if chunk_id not in previous_ids:
+                    return chunk_id
+
+        try:
+            for batch in batches:
+                if previous is None:
+                    popped = self.manifest["documents"].pop(doc_id, None)
+                    previous = popped or {"chunks": []}
+                    previous_ids = set(previous["chunks"])
+                new_docs, new_ids = [], []
+                for doc in batch:
+                    doc.metadata["doc_id"] = doc_id
+                    stats["chunks"] += 1
+                    if self.fingerprints is not None:
+                        chunk_fingerprint = fingerprint(doc.page_content)
+                        match, kind = self.fingerprints.match(chunk_fingerprint)
+                        if kind == "near":
+                            stats["near_duplicates"] += 1
+                        elif match is not None:
+                            stats["exact_duplicates"] += 1
+                            stats["index_bytes_saved"] += bytes_per_vector + len(doc.page_content.encode("utf-8"))
+                            if match in previous_ids and match not in reused:
+                                reused.add(match)
+                                chunk_ids.append(match)
+                                stats["reused_from_previous"] += 1
+                            else:
+                                aliases[next_chunk_id()] = match
+                            continue
+                    chunk_id = next_chunk_id()
+                    doc.metadata["chunk_id"] = chunk_id
+                    new_chunk_ids.append(chunk_id)
+                    if self.fingerprints is not None:
+                        self.fingerprints.add(chunk_id, chunk_fingerprint)
+                        self.manifest["fingerprints"][chunk_id] = chunk_fingerprint
+                    new_docs.append(doc)
+                    new_ids.append(chunk_id)
+                if new_docs:
+                    if self.vector_store is None:
+                        self.vector_store = FAISS.from_documents(new_docs, self.corpus.embeddings, ids=new_ids)
+                    else:
+                        self.vector_store.add_documents(new_docs, ids=new_ids)
+                chunk_ids.extend(new_ids)
+                self.dirty = True
+        except Exception:
+            self._roll_back(doc_id, popped, new_chunk_ids, created_store, was_dirty)
+            raise
+
+        replaced = False
+        if previous is not None:
+            try:
+                stale = [chunk_id for chunk_id in previous["chunks"] if chunk_id not in reused]
+                removable = self.corpus._release_chunks(self.manifest, stale)
+                if removable:
+                    self.vector_store = self.corpus._remove_chunks(self.vector_store, removable)
+                    self.manifest["deleted_chunks"] += len(removable)
+                    if self.fingerprints is not None:
+                        self.fingerprints.discard(removable)
+            except Exception:
+                # Other documents' aliases may already have been handed over; nothing to roll back to
+                self.broken = True
+                raise
+            replaced = bool(previous["chunks"])
+            entry = dict(info or {}, chunks=chunk_ids, added_at=time.time())
+            if aliases:
+                entry["aliases"] = aliases
+            self.manifest["documents"][doc_id] = entry
+
+        stats["embedding_calls_saved"] = stats["exact_duplicates"]
+        self.dedup_stats = stats
+        return stats["chunks"], replaced
+
+    def _roll_back(self, doc_id, popped, new_chunk_ids, created_store, was_dirty):
+        """
+        Undoes a document that failed part-way: drops the vectors and fingerprints of the
+        chunks it added and puts its previous manifest entry back.
+        """
+        try:
+            if created_store:
+                self.vector_store = None
+            elif self.vector_store is not None:
+                stored = set(self.vector_store.index_to_docstore_id.values())
+                added = [chunk_id for chunk_id in new_chunk_ids if chunk_id in stored]
+                if added:
+                    self.vector_store = self.corpus._remove_chunks(self.vector_store, added)
+            if self.fingerprints is not None:
+                self.fingerprints.discard(new_chunk_ids)
+                for chunk_id in new_chunk_ids:
+                    self.manifest["fingerprints"].pop(chunk_id, None)
+            if popped is not None:
+                self.manifest["documents"][doc_id] = popped
+            self.dirty = was_dirty
+        except Exception as e:
+            self.broken = True
+            logger.error(f"Could not roll back {doc_id} in '{self.corpus.index_name}': {e}")
+            return
+        logger.warning(f"Rolled back {doc_id} ({len(new_chunk_ids)} chunks) in '{self.corpus.index_name}'.")
+
+    def _bytes_per_vector(self):
+        if self.vector_store is None or not self.vector_store.index.ntotal:
+            return 0
+        return estimate_index_bytes(self.vector_store.index) // self.vector_store.index.ntotal
+
+    def publish(self):
+        if self.broken:
+            raise CorpusWriterError(f"Writer for '{self.corpus.index_name}' is broken; its changes were dropped.")
+        if not self.dirty:
+            return self.version
+        # Switches to an ANN index (training it) once the corpus outgrows exact search
+        self.vector_store = retype_vector_store(self.vector_store, self.corpus.index_type)
+        self.manifest["index_type"] = index_type_of(self.vector_store.index)
+        self.version = publish_index(self.vector_store, self.corpus.index_name, self.manifest)
+        self.dirty = False
+        return self.version
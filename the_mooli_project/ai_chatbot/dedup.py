@@ -0,0 +1,110 @@
+import hashlib
+import logging
+from collections import Counter
+
+import numpy as np
+
+from ai_chatbot.embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+_PRIME = np.uint64(4294967291)  # largest prime below 2**32, so (a * h + b) never overflows uint64
+
+
+def _permutation_parameter(name, i):
+    # Derived from a hash rather than a RNG so fingerprints stay comparable across numpy versions
+    return int.from_bytes(hashlib.blake2b(f"{name}{i}".encode(), digest_size=4).digest(), "big")
+
+
+_A = np.array([_permutation_parameter("a", i) % (2 ** 32 - 2) + 1 for i in range(NUM_PERMUTATIONS)], dtype=np.uint64)
+_B = np.array([_permutation_parameter("b", i) for i in range(NUM_PERMUTATIONS)], dtype=np.uint64)
+
+
+def _shingles(words, size=3):
+    if len(words) <= size:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def minhash_bands(text):
+    """
+    Returns the MinHash signature of a chunk's word 3-shingles, hashed into NUM_BANDS band keys.
+    Two chunks share a band with probability J ** ROWS_PER_BAND, where J is their Jaccard similarity.
+    """
+    shingles = _shingles(normalize_text(text).lower().split())
+    hashes = np.frombuffer(
+        b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest() for shingle in shingles),
+        dtype=np.uint32,
+    ).astype(np.uint64)
+    signature = ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0)
+    return [
+        hashlib.blake2b(signature[i:i + ROWS_PER_BAND].tobytes(), digest_size=2).hexdigest()
+        for i in range(0, NUM_PERMUTATIONS, ROWS_PER_BAND)
+    ]
+
+
+def fingerprint(text):
+    """
+    Returns ``[exact hash, band keys]`` as hex strings, the compact form stored in the corpus manifest.
+    """
+    exact = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()[:16]
+    return [exact, "".join(minhash_bands(text))]
+
+
+class FingerprintIndex:
+    """
+    Finds chunks already in the corpus that are exact or near duplicates of a new chunk.
+
+    Near duplicates share at least ``min_bands`` of the NUM_BANDS MinHash bands. With
+    the default of 4 that catches chunks differing by a word or two out of a 1000-character
+    chunk, while neighbouring chunks that only share the splitter's 200-character overlap
+    essentially never match.
+    """
+
+    def __init__(self, min_bands=4):
+        self.min_bands = min_bands
+        self._exact = {}
+        self._bands = [{} for _ in range(NUM_BANDS)]
+        self._band_keys = {}
+
+    def _split(self, band_hex):
+        return [band_hex[i:i + 4] for i in range(0, len(band_hex), 4)]
+
+    def add(self, chunk_id, chunk_fingerprint):
+        exact, band_hex = chunk_fingerprint
+        keys = self._split(band_hex)
+        self._exact.setdefault(exact, chunk_id)
+        self._band_keys[chunk_id] = keys
+        for band, key in zip(self._bands, keys):
+            band.setdefault(key, []).append(chunk_id)
+
+    def discard(self, chunk_ids):
+        chunk_ids = set(chunk_ids)
+        self._exact = {exact: chunk_id for exact, chunk_id in self._exact.items() if chunk_id not in chunk_ids}
+        for chunk_id in chunk_ids:
+            keys = self._band_keys.pop(chunk_id, None)
+            if keys is None:
+                continue
+            for band, key in zip(self._bands, keys):
+                band[key] = [other for other in band.get(key, []) if other != chunk_id]
+
+    def match(self, chunk_fingerprint):
+        """
+        Returns ``(chunk_id, "exact" | "near")`` for a duplicate of the chunk, or ``(None, None)``.
+        """
+        exact, band_hex = chunk_fingerprint
+        if exact in self._exact:
+            return self._exact[exact], "exact"
+        if self.min_bands <= 0:
+            return None, None
+        shared = Counter()
+        for band, key in zip(self._bands, self._split(band_hex)):
+            shared.update(band.get(key, ()))
+        if shared:
+            chunk_id, count = shared.most_common(1)[0]
+            if count >= self.min_bands:
+                return chunk_id, "near"
+        return None, None
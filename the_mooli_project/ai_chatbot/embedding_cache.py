@@ -0,0 +1,232 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """
+    Normalizes a chunk so that whitespace-only differences map to the same cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    A persistent embedding store keyed by (model id, normalized chunk text hash).
+
+    Vectors are stored as raw float32 blobs in a local SQLite database, which is
+    safe to share between the web process and every Celery worker on the host.
+    Query embeddings are only kept in a bounded in-process LRU, and hit/miss counters
+    are added to the store's totals at most every ``flush_interval`` seconds, so
+    lookups do not write to the database.
+    """
+
+    def __init__(self, path, max_queries=1024, flush_interval=60.0):
+        self.path = str(path)
+        self.hits = 0
+        self.misses = 0
+        self.max_queries = max_queries
+        self.flush_interval = flush_interval
+        self._unflushed = {"hits": 0, "misses": 0}
+        self._flushed_at = time.monotonic()
+        self._queries = OrderedDict()
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model_id TEXT NOT NULL,"
+                " text_hash BLOB NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " PRIMARY KEY (model_id, text_hash)"
+                ") WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters ("
+                " name TEXT PRIMARY KEY,"
+                " value INTEGER NOT NULL"
+                ")"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get_many(self, model_id, texts):
+        """
+        Returns a list with one float32 vector per text, or None where the text is not cached.
+        """
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        conn = self._connect()
+        unique = list(set(hashes))
+        # SQLite limits the number of bound parameters per statement
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model_id = ? AND text_hash IN ({placeholders})",
+                [model_id, *batch],
+            )
+            for digest, blob in rows:
+                found[digest] = np.frombuffer(blob, dtype=np.float32)
+
+        vectors = [found.get(digest) for digest in hashes]
+        hits = sum(1 for vector in vectors if vector is not None)
+        self._count(hits, len(vectors) - hits)
+        return vectors
+
+    def put_many(self, model_id, texts, vectors):
+        rows = [
+            (model_id, text_hash(text), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model_id, text_hash, vector) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    def get_query(self, model_id, text):
+        """
+        Returns the cached vector of a query, or None. Queries are not persisted.
+        """
+        key = (model_id, text_hash(text))
+        with self._counter_lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+        self._count(int(vector is not None), int(vector is None))
+        return vector
+
+    def put_query(self, model_id, text, vector):
+        with self._counter_lock:
+            self._queries[(model_id, text_hash(text))] = vector
+            while len(self._queries) > self.max_queries:
+                self._queries.popitem(last=False)
+
+    def _count(self, hits, misses):
+        with self._counter_lock:
+            self.hits += hits
+            self.misses += misses
+            self._unflushed["hits"] += hits
+            self._unflushed["misses"] += misses
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+        if due:
+            self.flush_counters()
+
+    def flush_counters(self):
+        """
+        Adds the counts since the last flush to the store's cumulative totals.
+        """
+        with self._counter_lock:
+            pending = [(name, value) for name, value in self._unflushed.items() if value]
+            self._unflushed = {"hits": 0, "misses": 0}
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                pending,
+            )
+
+    def stats(self):
+        """
+        Returns hit/miss counters for this process and cumulative ones for the store.
+        """
+        self.flush_counters()
+        conn = self._connect()
+        totals = dict(conn.execute("SELECT name, value FROM counters"))
+        entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "process_hits": self.hits,
+            "process_misses": self.misses,
+            "total_hits": totals.get("hits", 0),
+            "total_misses": totals.get("misses", 0),
+            "entries": entries,
+        }
+
+
+def embed_with_cache(model_id, texts, embed_fn, cache=None):
+    """
+    Embeds ``texts``, only sending cache misses to ``embed_fn``.
+    """
+    cache = cache or get_embedding_cache()
+    vectors = cache.get_many(model_id, texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        # Identical chunks in one batch only need one Bedrock call
+        unique_texts = list(dict.fromkeys(normalize_text(texts[i]) for i in missing))
+        first_index = {}
+        for i in missing:
+            first_index.setdefault(normalize_text(texts[i]), i)
+        fresh = embed_fn([texts[first_index[text]] for text in unique_texts])
+        cache.put_many(model_id, unique_texts, fresh)
+        by_text = dict(zip(unique_texts, fresh))
+        for i in missing:
+            vectors[i] = np.asarray(by_text[normalize_text(texts[i])], dtype=np.float32)
+    logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses.")
+    return [vector.tolist() for vector in vectors]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain embeddings wrapper that serves repeated chunks from the embedding cache.
+    """
+
+    def __init__(self, embeddings, model_id, cache=None):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        return embed_with_cache(self.model_id, texts, self.embeddings.embed_documents, self.cache)
+
+    def embed_query(self, text):
+        cache = self.cache or get_embedding_cache()
+        vector = cache.get_query(self.model_id, text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            cache.put_query(self.model_id, text, vector)
+        return list(vector)
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Returns the process-wide embedding cache configured from settings.
+    """
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                settings.EMBEDDING_CACHE_PATH, max_queries=settings.EMBEDDING_QUERY_CACHE_SIZE
+            )
+        return _embedding_cache
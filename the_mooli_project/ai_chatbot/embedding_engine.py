@@ -0,0 +1,214 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "ServiceUnavailableException",
+}
+
+
+def is_throttling_error(exc):
+    """
+    Returns True if ``exc`` (or an exception it wraps) is a Bedrock throttling error.
+    LangChain re-raises Bedrock errors as ValueError, so the message is checked as well.
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, ClientError):
+            if exc.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+                return True
+        message = str(exc)
+        if any(code in message for code in THROTTLING_ERROR_CODES) or "Too many requests" in message:
+            return True
+        status = getattr(exc, "status", None) or getattr(exc, "code", None)
+        if status == 429:
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket whose refill rate can be adjusted at runtime.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._rate_changed = self._updated
+        self._rate_decreased = None
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def decrease_rate(self, factor, min_rate=1.0, window=1.0):
+        """
+        Multiplies the refill rate by ``factor``, at most once per ``window`` seconds: the
+        requests already in flight when Bedrock starts throttling fail together, and should
+        count as one signal rather than halve the rate once each. Returns the rate.
+        """
+        with self._lock:
+            now = self._clock()
+            if self._rate_decreased is None or now - self._rate_decreased >= window:
+                self._refill()
+                self.rate = max(min_rate, self.rate * factor)
+                self._rate_changed = self._rate_decreased = now
+            return self.rate
+
+    def increase_rate(self, step, max_rate=None, window=1.0):
+        """
+        Adds ``step`` to the refill rate if ``window`` seconds have passed since the last
+        change, so the rate grows by ``step`` per window however many requests succeed in it.
+        Returns the rate.
+        """
+        with self._lock:
+            now = self._clock()
+            if now - self._rate_changed >= window:
+                self._refill()
+                rate = self.rate + step
+                self.rate = min(max_rate, rate) if max_rate else rate
+                self._rate_changed = now
+            return self.rate
+
+
+class BatchedEmbedder:
+    """
+    Embeds texts in bounded-concurrency batches from a thread pool.
+
+    Requests are paced by a token bucket. The rate is halved when Bedrock throttles
+    and grows back by ``rate_step`` requests/s per ``rate_window`` seconds of
+    successful calls (AIMD), so the engine settles just under the account's quota
+    instead of climbing straight back into throttling. Results keep input order.
+    """
+
+    def __init__(self, embed_one, max_workers=8, batch_size=16, rate=20.0, bucket=None,
+                 min_rate=1.0, max_rate=None, max_retries=6, rate_step=0.5, rate_window=1.0):
+        self.embed_one = embed_one
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 2
+        self.max_retries = max_retries
+        self.rate_step = rate_step
+        self.rate_window = rate_window
+        self.bucket = bucket or TokenBucket(rate, capacity=max_workers)
+        self.throttled = 0
+        self._throttled_lock = threading.Lock()
+
+    def _on_success(self):
+        self.bucket.increase_rate(self.rate_step, max_rate=self.max_rate, window=self.rate_window)
+
+    def _on_throttle(self):
+        with self._throttled_lock:
+            self.throttled += 1
+        new_rate = self.bucket.decrease_rate(0.5, min_rate=self.min_rate, window=self.rate_window)
+        logger.warning(f"Embedding request throttled, pacing down to {new_rate:.1f} req/s.")
+
+    def _embed_with_retry(self, text):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                vector = self.embed_one(text)
+            except Exception as e:
+                if not is_throttling_error(e) or attempt == self.max_retries:
+                    raise
+                self._on_throttle()
+                time.sleep(min(10.0, 0.25 * 2 ** attempt))
+                continue
+            self._on_success()
+            return vector
+
+    def _embed_batch(self, batch):
+        return [self._embed_with_retry(text) for text in batch]
+
+    def embed(self, texts):
+        if not texts:
+            return []
+        started = time.monotonic()
+        # Small inputs are split finer so every worker gets a share
+        batch_size = max(1, min(self.batch_size, -(-len(texts) // self.max_workers)))
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+            # map() yields results in submission order, which keeps vectors aligned with texts
+            results = list(pool.map(self._embed_batch, batches))
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Embedded {len(texts)} chunks in {elapsed:.2f}s "
+            f"({len(texts) / max(elapsed, 1e-9):.1f} chunks/s, {self.throttled} throttled)."
+        )
+        return [vector for batch in results for vector in batch]
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    LangChain embeddings wrapper that fans ``embed_documents`` out through a BatchedEmbedder.
+    """
+
+    def __init__(self, embeddings, embedder=None):
+        self.embeddings = embeddings
+        self.embedder = embedder or get_batched_embedder(embeddings.embed_query)
+
+    def embed_documents(self, texts):
+        return self.embedder.embed(texts)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+_bedrock_bucket = None
+_bedrock_bucket_lock = threading.Lock()
+
+
+def get_bedrock_bucket():
+    """
+    Returns the process-wide token bucket, so the learned Bedrock rate is shared by every embedder.
+    """
+    global _bedrock_bucket
+    with _bedrock_bucket_lock:
+        if _bedrock_bucket is None:
+            _bedrock_bucket = TokenBucket(
+                settings.EMBEDDING_REQUESTS_PER_SECOND, capacity=settings.EMBEDDING_MAX_WORKERS
+            )
+        return _bedrock_bucket
+
+
+def get_batched_embedder(embed_one):
+    """
+    Returns a BatchedEmbedder configured from settings.
+    """
+    return BatchedEmbedder(
+        embed_one,
+        max_workers=settings.EMBEDDING_MAX_WORKERS,
+        batch_size=settings.EMBEDDING_BATCH_SIZE,
+        rate=settings.EMBEDDING_REQUESTS_PER_SECOND,
+        bucket=get_bedrock_bucket(),
+        rate_step=settings.EMBEDDING_RATE_STEP,
+        rate_window=settings.EMBEDDING_RATE_WINDOW,
+    )
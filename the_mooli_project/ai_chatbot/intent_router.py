@@ -0,0 +1,179 @@
+import logging
+import re
+import threading
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SUMMARIZE = "summarize"
+DOCUMENT_QA = "document_qa"
+UPLOAD = "upload"
+OTHER = "other"
+
+SUMMARY_QUERY = "Provide a concise summary of the document."
+
+_SUMMARIZE_RULE = re.compile(r"\b(summar(y|ize|ise|izing|ising)|tl;?dr|overview)\b", re.IGNORECASE)
+# Only requests to upload, not questions that mention uploading
+_UPLOAD_RULE = re.compile(
+    r"^(please |can you |could you |i want to |i'd like to |help me )?(upload|ingest|index|process|add)\b.*\b(file|pdf|document)s?\b",
+    re.IGNORECASE,
+)
+# A summary request made only of these words is about the whole document
+_SUMMARY_WORDS = {
+    "summarize", "summarise", "summary", "summarizing", "summarising", "tldr", "tl;dr", "overview",
+    "please", "can", "could", "you", "give", "me", "provide", "a", "an", "the", "of", "this", "that", "it",
+    "short", "brief", "quick", "document", "doc", "pdf", "file", "pythonai", "pythonai.pdf",
+}
+_DOCUMENT_RULE = re.compile(r"\b(pdf|document|doc|file|pythonai)\b", re.IGNORECASE)
+_QUESTION_RULE = re.compile(r"\?\s*$|^(what|who|when|where|why|how|which|does|do|is|are|can|explain|describe|list)\b", re.IGNORECASE)
+
+# Examples the embedding classifier compares a message against. Questions that do not mention
+# the document are only routed when they are clearly closer to DOCUMENT_QA than to OTHER.
+EXEMPLARS = {
+    DOCUMENT_QA: [
+        "What does the document say about machine learning?",
+        "Explain the main concept described in the report.",
+        "How does the author define artificial intelligence?",
+        "Which Python libraries are mentioned?",
+        "What are the steps described for training a model?",
+        "List the advantages discussed in the text.",
+    ],
+    OTHER: [
+        "Hello, how are you?",
+        "Thanks, that was helpful!",
+        "Who are you and what can you do?",
+        "Tell me a joke.",
+        "What is the weather like today?",
+        "Can you help me write an email to my manager?",
+    ],
+}
+
+
+class RouterMetrics:
+    """
+    Counts routed and agent requests with their latencies, and the LLM calls the agent loop
+    makes per request, from which the calls saved by routing are estimated.
+    """
+
+    def __init__(self, window=1000):
+        self._latency = {}
+        self._agent_llm_calls = deque(maxlen=window)
+        self._window = window
+        self._counts = {}
+        self.llm_calls_saved = 0.0
+        self._lock = threading.Lock()
+
+    def agent_llm_calls_per_request(self):
+        # The ReAct loop needs at least a Thought/Action call and a Final Answer call
+        return float(np.mean(self._agent_llm_calls)) if self._agent_llm_calls else 2.0
+
+    def record(self, route, seconds, agent_llm_calls=None):
+        """
+        Records one request; returns the agent LLM calls it saved (0 for agent requests).
+        """
+        with self._lock:
+            self._counts[route] = self._counts.get(route, 0) + 1
+            self._latency.setdefault(route, deque(maxlen=self._window)).append(seconds)
+            if route == "agent":
+                if agent_llm_calls is not None:
+                    self._agent_llm_calls.append(agent_llm_calls)
+                return 0.0
+            saved = self.agent_llm_calls_per_request()
+            self.llm_calls_saved += saved
+            return saved
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": dict(self._counts),
+                "mean_latency_ms": {
+                    route: round(float(np.mean(values)) * 1000, 1) for route, values in self._latency.items()
+                },
+                "agent_llm_calls_per_request": round(self.agent_llm_calls_per_request(), 2),
+                "llm_calls_saved": round(self.llm_calls_saved, 1),
+            }
+
+
+class IntentRouter:
+    """
+    Decides whether a chat message can skip the ReAct agent.
+
+    Rules catch the unambiguous cases (summaries, uploads, questions naming the document).
+    Other questions are embedded and compared with EXEMPLARS; they are routed to DOCUMENT_QA
+    only when the closest document example is at least ``min_similarity`` and beats the
+    closest OTHER example by ``margin``. Everything else goes to the agent.
+    """
+
+    def __init__(self, embeddings, min_similarity=0.6, margin=0.05):
+        self.embeddings = embeddings
+        self.min_similarity = min_similarity
+        self.margin = margin
+        self._exemplars = None
+        self._exemplars_lock = threading.Lock()
+
+    def _exemplar_vectors(self):
+        with self._exemplars_lock:
+            if self._exemplars is None:
+                # Goes through the embedding cache, so this is only paid once per deployment
+                self._exemplars = {
+                    intent: _normalize(np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32))
+                    for intent, texts in EXEMPLARS.items()
+                }
+            return self._exemplars
+
+    def classify(self, text):
+        """
+        Returns ``(intent, method)``; intent is None when the message should go to the agent.
+        """
+        text = text.strip()
+        if _UPLOAD_RULE.search(text):
+            return UPLOAD, "rule"
+        if _SUMMARIZE_RULE.search(text):
+            return SUMMARIZE, "rule"
+        if not _QUESTION_RULE.search(text):
+            return None, None
+        if _DOCUMENT_RULE.search(text):
+            return DOCUMENT_QA, "rule"
+
+        query = _normalize(np.asarray([self.embeddings.embed_query(text)], dtype=np.float32))[0]
+        similarity = {intent: float((vectors @ query).max()) for intent, vectors in self._exemplar_vectors().items()}
+        if (similarity[DOCUMENT_QA] >= self.min_similarity
+                and similarity[DOCUMENT_QA] - similarity[OTHER] >= self.margin):
+            return DOCUMENT_QA, "embedding"
+        return None, None
+
+
+def rag_query_for(intent, text):
+    """
+    Returns the query to send to the RAG engine for a routed message. Requests to summarize
+    the whole document share one canonical query, so they also share cached answers.
+    """
+    if intent == SUMMARIZE and not [w for w in re.findall(r"[\w.;]+", text.lower()) if w not in _SUMMARY_WORDS]:
+        return SUMMARY_QUERY
+    return text
+
+
+def _normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+_router_metrics = RouterMetrics()
+
+
+def get_router_metrics():
+    return _router_metrics
+
+
+def get_intent_router():
+    from ai_chatbot.clients import get_client_registry
+    from ai_chatbot.rag_engine import get_bedrock_embeddings
+
+    # Kept with the clients, since it holds the Bedrock embeddings client
+    return get_client_registry().get("intent_router", lambda: IntentRouter(
+        get_bedrock_embeddings(),
+        min_similarity=settings.INTENT_ROUTER_MIN_SIMILARITY,
+        margin=settings.INTENT_ROUTER_MARGIN,
+    ))
@@ -0,0 +1,67 @@
+import time
+
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from ai_chatbot.ann import INDEX_TYPES, build_index
+
+
+def synthetic_vectors(n, dimensions, clusters, seed):
+    """
+    Clustered Gaussian vectors, which resemble text embeddings better than uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.35 * rng.standard_normal((n, dimensions)).astype(np.float32)
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports build time, memory (serialized size), recall@k and p50/p99 search latency "
+        "for each FAISS index type, including the compressed ones, on synthetic vectors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vectors", type=int, default=50000)
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--dimensions", type=int, default=1536)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        n, k = options["vectors"], options["k"]
+        clusters = max(8, n // 500)
+        data = synthetic_vectors(n, options["dimensions"], clusters, options["seed"])
+        queries = synthetic_vectors(options["queries"], options["dimensions"], clusters, options["seed"])
+
+        ground_truth = faiss.IndexFlatL2(options["dimensions"])
+        ground_truth.add(data)
+        _, expected = ground_truth.search(queries, k)
+
+        self.stdout.write(
+            f"{n} vectors x {options['dimensions']}d, {len(queries)} queries, k={k}\n"
+            f"{'type':<14}{'build s':>10}{'size MB':>10}{'B/vector':>10}{f'recall@{k}':>12}{'p50 ms':>10}{'p99 ms':>10}"
+        )
+        for index_type in options["types"]:
+            started = time.perf_counter()
+            index = build_index(index_type, data)
+            build_seconds = time.perf_counter() - started
+            size_mb = faiss.serialize_index(index).nbytes / 1e6
+
+            latencies = []
+            found = np.empty_like(expected)
+            for i, query in enumerate(queries):
+                started = time.perf_counter()
+                _, labels = index.search(query.reshape(1, -1), k)
+                latencies.append((time.perf_counter() - started) * 1000)
+                found[i] = labels[0]
+
+            recall = np.mean([len(set(found[i]) & set(expected[i])) / k for i in range(len(queries))])
+            self.stdout.write(
+                f"{index_type:<14}{build_seconds:>10.2f}{size_mb:>10.1f}{size_mb * 1e6 / n:>10.0f}{recall:>12.3f}"
+                f"{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}"
+            )
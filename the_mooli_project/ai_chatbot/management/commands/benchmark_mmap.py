@@ -0,0 +1,112 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import django
+import numpy as np
+from django.core.management.base import BaseCommand
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from ai_chatbot.ann import build_index
+from ai_chatbot.management.commands.benchmark_ann import synthetic_vectors
+from ai_chatbot.mmap_index import load_serving_vector_store, save_serving_files
+
+MODES = ("load_local", "mmap")
+
+
+def memory_status():
+    """
+    Returns (private, file-backed) resident memory in bytes; file-backed pages are shared between processes.
+    """
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("RssAnon", "RssFile"):
+                values[key] = int(value.split()[0]) * 1024
+    return values["RssAnon"], values["RssFile"]
+
+
+def open_and_query(mode, path, dimensions, results, release):
+    """
+    Runs in a fresh process: opens the index like a worker would and answers one query.
+    The process stays alive until ``release`` is set, so every worker is resident at once.
+    """
+    django.setup()
+    embeddings = FakeEmbeddings(size=dimensions)
+    query = synthetic_vectors(1, dimensions, 8, seed=os.getpid())[0].tolist()
+
+    private_before, file_before = memory_status()
+    started = time.perf_counter()
+    if mode == "mmap":
+        vector_store = load_serving_vector_store(path, embeddings)
+    else:
+        vector_store = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    vector_store.similarity_search_by_vector(query, k=3)
+    cold_start = time.perf_counter() - started
+    private_after, file_after = memory_status()
+
+    results.put((mode, cold_start, private_after - private_before, file_after - file_before))
+    release.wait()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares per-worker RSS and cold-start time of FAISS.load_local against memory-mapped "
+        "serving, with several worker processes holding the same flat index at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vectors", type=int, default=50000)
+        parser.add_argument("--dimensions", type=int, default=1536)
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        n, dimensions = options["vectors"], options["dimensions"]
+        path = tempfile.mkdtemp(prefix="benchmark_mmap_")
+        try:
+            vectors = synthetic_vectors(n, dimensions, max(8, n // 500), options["seed"])
+            ids = [str(i) for i in range(n)]
+            vector_store = FAISS(
+                FakeEmbeddings(size=dimensions),
+                build_index("flat", vectors),
+                InMemoryDocstore({i: Document(page_content=f"chunk {i}") for i in ids}),
+                dict(enumerate(ids)),
+            )
+            vector_store.save_local(path)
+            save_serving_files(vector_store.index, path)
+            del vector_store, vectors
+
+            self.stdout.write(
+                f"{n} vectors x {dimensions}d ({n * dimensions * 4 / 1e6:.0f} MB), {options['workers']} workers\n"
+                f"{'mode':<12}{'cold start s':>14}{'private MB/worker':>20}{'shared MB/worker':>18}{'private MB total':>18}"
+            )
+            context = multiprocessing.get_context("spawn")
+            for mode in MODES:
+                results, release = context.Queue(), context.Event()
+                processes = [
+                    context.Process(target=open_and_query, args=(mode, path, dimensions, results, release))
+                    for _ in range(options["workers"])
+                ]
+                for process in processes:
+                    process.start()
+                measurements = [results.get() for _ in processes]
+                release.set()
+                for process in processes:
+                    process.join()
+
+                cold_starts = [m[1] for m in measurements]
+                private = [m[2] / 1e6 for m in measurements]
+                shared = [m[3] / 1e6 for m in measurements]
+                self.stdout.write(
+                    f"{mode:<12}{np.mean(cold_starts):>14.3f}{np.mean(private):>20.1f}"
+                    f"{np.mean(shared):>18.1f}{sum(private):>18.1f}"
+                )
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
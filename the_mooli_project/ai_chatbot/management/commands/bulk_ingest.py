@@ -0,0 +1,176 @@
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ai_chatbot.clients import get_s3_client
+from ai_chatbot.corpus import CorpusManager
+from ai_chatbot.pdf_pipeline import iter_batches, iter_chunks, iter_pages
+from ai_chatbot.s3_cache import get_s3_cache
+from ai_chatbot.shards import index_name_for_company
+
+
+def init_worker():
+    """
+    Process pool initializer: makes settings available under the spawn start method.
+    """
+    django.setup()
+
+
+def parse_pdf(bucket_name, file_key, etag):
+    """
+    Runs in a pool process: fetches one PDF through the S3 cache and returns its chunks.
+    pypdf parsing is CPU-bound, so each document gets its own interpreter.
+    """
+    file_path, _ = get_s3_cache().fetch(get_s3_client(), bucket_name, file_key, etag=etag)
+    return list(iter_chunks(iter_pages(file_path)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfills every PDF under an S3 prefix into the corpus index. PDFs are parsed in a "
+        "process pool, embedded through the batched embedder and published incrementally. "
+        "Progress is checkpointed so an interrupted run resumes where it stopped. The corpus "
+        "write lock is only held while a checkpoint's documents are embedded and published, "
+        "so uploads are indexed between checkpoints."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefix", default="uploads/")
+        parser.add_argument("--bucket", default=None, help="Defaults to S3_BUCKET_NAME.")
+        parser.add_argument("--index", default=None, help="Defaults to the company's shard, or the shared index.")
+        parser.add_argument("--company", type=int, default=None, help="Company id whose shard receives the documents.")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+        parser.add_argument("--publish-every", type=int, default=50, help="Documents per published index version.")
+        parser.add_argument("--checkpoint", default=None, help="Defaults to <index>/bulk_ingest.<prefix>.json.")
+        parser.add_argument("--limit", type=int, default=None)
+        parser.add_argument("--retry-failed", action="store_true")
+
+    def handle(self, *args, **options):
+        bucket_name = options["bucket"] or settings.S3_BUCKET_NAME
+        options["index"] = options["index"] or index_name_for_company(options["company"])
+        checkpoint_path = options["checkpoint"] or os.path.join(
+            options["index"], f"bulk_ingest.{options['prefix'].strip('/').replace('/', '_') or 'root'}.json"
+        )
+        checkpoint = self.load_checkpoint(checkpoint_path)
+        if options["retry_failed"]:
+            checkpoint["failed"] = {}
+
+        pending = []
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=options["prefix"]):
+            for obj in page.get("Contents", []):
+                key, etag = obj["Key"], obj["ETag"]
+                if not key.lower().endswith(".pdf"):
+                    continue
+                if checkpoint["done"].get(key) == etag or checkpoint["failed"].get(key, {}).get("etag") == etag:
+                    continue
+                pending.append((key, etag))
+        if options["limit"]:
+            pending = pending[:options["limit"]]
+        self.stdout.write(f"{len(pending)} PDFs to ingest ({len(checkpoint['done'])} already done).")
+        if not pending:
+            return
+
+        corpus = CorpusManager(options["index"])
+        started = time.monotonic()
+        totals = {"ingested": 0, "chunks": 0, "calls_saved": 0, "bytes_saved": 0}
+        parsed = []
+        queue = list(reversed(pending))
+
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=init_worker) as pool:
+            in_flight = {}
+
+            def submit_more():
+                # A small window keeps parsed-but-not-embedded documents from piling up in memory
+                while queue and len(in_flight) + len(parsed) < options["publish_every"] + options["workers"] * 2:
+                    key, etag = queue.pop()
+                    in_flight[pool.submit(parse_pdf, bucket_name, key, etag)] = (key, etag)
+
+            submit_more()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, etag = in_flight.pop(future)
+                    try:
+                        parsed.append((key, etag, future.result()))
+                    except Exception as e:
+                        self.stderr.write(f"Failed to parse {key}: {e}")
+                        checkpoint["failed"][key] = {"etag": etag, "error": str(e)}
+                if len(parsed) >= options["publish_every"] or (parsed and not in_flight and not queue):
+                    self.ingest_checkpoint(corpus, parsed, checkpoint, checkpoint_path, totals)
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f"{totals['ingested']}/{len(pending)} documents, {totals['chunks']} chunks, "
+                        f"{totals['ingested'] / elapsed:.2f} docs/s, {totals['chunks'] / elapsed:.1f} chunks/s"
+                    )
+                submit_more()
+        self.save_checkpoint(checkpoint_path, checkpoint)
+
+        ingested, chunks = totals["ingested"], totals["chunks"]
+        calls_saved, bytes_saved = totals["calls_saved"], totals["bytes_saved"]
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {ingested} documents ({chunks} chunks) in {elapsed:.1f}s: "
+            f"{ingested / elapsed:.2f} docs/s, {chunks / elapsed:.1f} chunks/s, "
+            f"{len(checkpoint['failed'])} failed. Deduplication saved {calls_saved} embedding calls "
+            f"and {bytes_saved / 1e6:.1f} MB of index."
+        ))
+
+    def ingest_checkpoint(self, corpus, parsed, checkpoint, checkpoint_path, totals):
+        """
+        Embeds the parsed documents and publishes them as one index version. The corpus write
+        lock is taken for this checkpoint only, so uploads queued behind it run in between.
+        """
+        unpublished = {}
+        with corpus.writer() as writer:
+            for key, etag, documents in parsed:
+                try:
+                    chunk_count, _ = writer.add_document_batches(
+                        key, iter_batches(documents, settings.INGEST_BATCH_SIZE)
+                    )
+                except Exception as e:
+                    self.stderr.write(f"Failed to ingest {key}: {e}")
+                    if writer.broken:
+                        # The writer could not undo the document; abort so its changes are dropped
+                        raise
+                    # The writer rolled the document back, so the others can still be published
+                    checkpoint["failed"][key] = {"etag": etag, "error": str(e)}
+                    continue
+                unpublished[key] = etag
+                totals["ingested"] += 1
+                totals["chunks"] += chunk_count
+                totals["calls_saved"] += writer.dedup_stats.get("embedding_calls_saved", 0)
+                totals["bytes_saved"] += writer.dedup_stats.get("index_bytes_saved", 0)
+            self.publish(writer, checkpoint, checkpoint_path, unpublished)
+        parsed.clear()
+
+    def publish(self, writer, checkpoint, checkpoint_path, unpublished):
+        """
+        Publishes the index and only then records the documents as done, so a crash
+        never marks a document whose vectors were not saved.
+        """
+        writer.publish()
+        checkpoint["done"].update(unpublished)
+        for key in unpublished:
+            checkpoint["failed"].pop(key, None)
+        unpublished.clear()
+        self.save_checkpoint(checkpoint_path, checkpoint)
+
+    def load_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"done": {}, "failed": {}}
+
+    def save_checkpoint(self, path, checkpoint):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,12 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from ai_chatbot.embedding_cache import get_embedding_cache
+
+
+class Command(BaseCommand):
+    help = "Prints hit/miss counters and the number of entries in the shared embedding cache."
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(get_embedding_cache().stats(), indent=2))
@@ -0,0 +1,71 @@
+import logging
+import os
+import pickle
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from ai_chatbot.ann import configure_search, index_type_of, ivf_of, reconstruct_all
+
+logger = logging.getLogger(__name__)
+
+SERVING_INDEX_FILE = "serving.faiss"
+
+
+def flat_as_ivf(index):
+    """
+    Copies a flat index into an IVF index with a single inverted list. Searching its one
+    list is the same exhaustive scan, but FAISS can memory-map IVF lists and not flat codes.
+    """
+    vectors = reconstruct_all(index)
+    quantizer = faiss.IndexFlat(index.d, index.metric_type)
+    quantizer.add(np.zeros((1, index.d), dtype=np.float32))
+    ivf = faiss.IndexIVFFlat(quantizer, index.d, 1, index.metric_type)
+    ivf.is_trained = True
+    if len(vectors):
+        ivf.add(vectors)
+    return ivf
+
+
+def save_serving_files(index, path):
+    """
+    Writes the memory-mappable copy of a flat index next to ``index.faiss``.
+    IVF indexes need nothing extra: FAISS maps their inverted lists from ``index.faiss``.
+    """
+    if index_type_of(index) != "flat":
+        return
+    faiss.write_index(flat_as_ivf(index), os.path.join(path, SERVING_INDEX_FILE))
+    logger.info(f"Wrote memory-mappable copy of {index.ntotal} vectors to {path}.")
+
+
+def load_serving_index(path):
+    """
+    Opens the index of a published version so that its vectors are shared between processes,
+    with FAISS's mmap flag: flat indexes through their single-list IVF copy, IVF indexes
+    directly. HNSW graphs cannot be mapped by FAISS 1.7, so they (and versions published
+    without serving files) are read into memory as before.
+    """
+    serving_file = os.path.join(path, SERVING_INDEX_FILE)
+    if os.path.exists(serving_file):
+        return faiss.read_index(serving_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    # The mmap flag only affects IVF inverted lists; other index types are read as usual
+    index = faiss.read_index(os.path.join(path, "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return configure_search(index)
+
+
+def is_memory_mapped(index):
+    ivf = ivf_of(index)
+    if ivf is not None:
+        return isinstance(faiss.downcast_InvertedLists(ivf.invlists), faiss.OnDiskInvertedLists)
+    return False
+
+
+def load_serving_vector_store(path, embeddings):
+    """
+    Like ``FAISS.load_local``, but with the index opened by ``load_serving_index``.
+    Only the docstore is unpickled into the process.
+    """
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, load_serving_index(path), docstore, index_to_docstore_id)
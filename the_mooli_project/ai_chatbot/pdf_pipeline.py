@@ -0,0 +1,171 @@
+import logging
+import os
+import queue
+import resource
+import sys
+import threading
+import time
+
+from django.conf import settings
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import PyPDFLoader
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def iter_pages(file_path):
+    """
+    Yields the pages of a PDF one at a time instead of loading the whole document.
+    """
+    yield from PyPDFLoader(file_path).lazy_load()
+
+
+def iter_chunks(pages, chunk_size=1000, chunk_overlap=200):
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+    for page in pages:
+        yield from text_splitter.split_documents([page])
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(items, maxsize=2):
+    """
+    Runs the upstream generator in a background thread, keeping at most ``maxsize``
+    items buffered, so parsing the next pages overlaps with embedding the current batch.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                buffer.put(item)
+            buffer.put(_DONE)
+        except BaseException as e:
+            buffer.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting on a full buffer
+        try:
+            buffer.get_nowait()
+        except queue.Empty:
+            pass
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs (e.g. macOS): fall back to the process-wide peak
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssMonitor:
+    """
+    Samples the resident set size in the background and records the peak seen during a run.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.start_rss = 0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, current_rss_bytes())
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = current_rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, current_rss_bytes())
+
+
+def ingest_pdf(file_path, doc_id, corpus, batch_size=None, info=None, progress=None):
+    """
+    Streams a PDF through page iterator -> splitter -> embedding batches -> index add.
+
+    Only ``batch_size`` chunks (plus a small prefetch buffer) are held in memory at once,
+    and embedding starts as soon as the first pages are parsed. Returns run statistics,
+    including the peak RSS observed while ingesting and what deduplication saved.
+    ``info`` (e.g. the source ETag) is recorded with the document in the manifest.
+    ``progress(stage, **data)`` is called when parsing finishes ("parsed"), after each
+    embedded batch ("embedded", with ``done`` and the ``total`` chunks once known) and
+    once the new version is published ("indexed").
+    """
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    started = time.monotonic()
+    stats = {"doc_id": doc_id, "pages": 0, "chunks": 0}
+    parsed = {"chunks": None}
+    progress = progress or (lambda stage, **data: None)
+
+    def counted_pages():
+        for page in iter_pages(file_path):
+            stats["pages"] += 1
+            yield page
+
+    def counted_chunks():
+        count = 0
+        for chunk in iter_chunks(counted_pages()):
+            count += 1
+            yield chunk
+        parsed["chunks"] = count
+        progress("parsed", pages=stats["pages"], chunks=count)
+
+    def counted_batches():
+        for batch in prefetch(iter_batches(counted_chunks(), batch_size)):
+            if stats["chunks"]:
+                # The corpus asks for the next batch once the previous one is embedded and added
+                progress("embedded", done=stats["chunks"], total=parsed["chunks"])
+            stats["chunks"] += len(batch)
+            yield batch
+
+    with RssMonitor() as rss:
+        vector_store = corpus.add_document_batches(doc_id, counted_batches(), info)
+    if stats["chunks"]:
+        progress("embedded", done=stats["chunks"], total=stats["chunks"])
+    progress("indexed", chunks=stats["chunks"])
+
+    stats.update(
+        embedding_calls_saved=corpus.last_dedup_stats.get("embedding_calls_saved", 0),
+        index_bytes_saved=corpus.last_dedup_stats.get("index_bytes_saved", 0),
+        seconds=round(time.monotonic() - started, 2),
+        peak_rss_mb=round(rss.peak_rss / 1e6, 1),
+        rss_growth_mb=round((rss.peak_rss - rss.start_rss) / 1e6, 1),
+    )
+    logger.info(f"Streaming ingestion finished: {stats}")
+    return vector_store, stats
@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+import logging
+import threading
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STAGES = ("completed", "failed")
+
+
+def task_group(task_id):
+    """
+    Returns the channel layer group that receives a task's progress events.
+    """
+    return f"task_{task_id}"
+
+
+class ProgressReporter:
+    """
+    Reports the stages of a Celery task: each event is stored as the task's PROGRESS state
+    in the result backend (so late subscribers and the long-poll fallback can read the
+    latest one) and pushed to the task's channel layer group (so connected browsers get
+    it immediately). Safe to call from the ingestion pipeline's prefetch thread: Celery's
+    ``task.request`` is thread-local, so the task id is captured when the reporter is created.
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.task_id = task.request.id
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __call__(self, stage, **data):
+        with self._lock:
+            event = dict(data, stage=stage, seq=next(self._seq))
+            try:
+                self.task.update_state(task_id=self.task_id, state="PROGRESS", meta=event)
+            except Exception as e:
+                logger.warning(f"Could not store progress of task {self.task_id}: {e}")
+            publish_event(self.task_id, event)
+
+
+def publish_event(task_id, event):
+    from channels.layers import get_channel_layer
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(task_group(task_id), {"type": "task.progress", "event": event})
+    except Exception as e:
+        # Progress is best effort; the result backend still has the final state
+        logger.warning(f"Could not publish progress of task {task_id}: {e}")
+
+
+def publish_completion(task_id, state, result):
+    """
+    Pushes the terminal event once Celery has stored the task's result.
+    """
+    if state == "SUCCESS":
+        event = {"stage": "completed", "result": result}
+    else:
+        event = {"stage": "failed", "result": str(result)}
+    publish_event(task_id, dict(event, seq=0))
+
+
+def snapshot(task_id):
+    """
+    Returns the latest event of a task from the result backend (one Redis GET).
+    """
+    from celery.result import AsyncResult
+
+    result = AsyncResult(task_id)
+    state = result.state
+    if state == "PROGRESS" and isinstance(result.info, dict):
+        return result.info
+    if state == "SUCCESS":
+        return {"stage": "completed", "result": result.result, "seq": 0}
+    if state == "FAILURE":
+        return {"stage": "failed", "result": str(result.result), "seq": 0}
+    return {"stage": state.lower(), "seq": 0}
+
+
+async def wait_for_event(task_id, after_seq, timeout):
+    """
+    Long-poll fallback: returns the task's latest event if it is newer than ``after_seq``
+    (or terminal), otherwise waits up to ``timeout`` seconds for the next pushed one.
+    Returns None on timeout.
+    """
+    from channels.layers import get_channel_layer
+
+    channel_layer = get_channel_layer()
+    channel_name = None
+    if channel_layer is not None:
+        # Subscribe before reading the snapshot, so an event published in between is not lost
+        channel_name = await channel_layer.new_channel()
+        await channel_layer.group_add(task_group(task_id), channel_name)
+    try:
+        event = await sync_to_async(snapshot)(task_id)
+        if event["stage"] in TERMINAL_STAGES or event.get("seq", 0) > after_seq:
+            return event
+        if channel_layer is None:
+            return None
+        try:
+            message = await asyncio.wait_for(channel_layer.receive(channel_name), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return message["event"]
+    finally:
+        if channel_layer is not None:
+            await channel_layer.group_discard(task_group(task_id), channel_name)
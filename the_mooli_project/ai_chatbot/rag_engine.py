@@ -0,0 +1,191 @@
+import json
+import logging
+import math
+import os
+import threading
+
+from django.conf import settings
+from langchain.chains import RetrievalQA
+from langchain_community.chat_models import BedrockChat
+from langchain_community.embeddings.bedrock import BedrockEmbeddings
+from langchain_community.vectorstores import FAISS
+
+from ai_chatbot.ann import configure_search, estimate_index_bytes, limit_search_threads
+from ai_chatbot.answer_cache import get_answer_cache
+from ai_chatbot.clients import get_bedrock_runtime, get_client_registry, get_s3_client
+from ai_chatbot.embedding_cache import CachedEmbeddings
+from ai_chatbot.embedding_engine import BatchedEmbeddings
+from ai_chatbot.mmap_index import is_memory_mapped, load_serving_vector_store
+from ai_chatbot.pdf_pipeline import ingest_pdf
+from ai_chatbot.s3_cache import get_s3_cache
+from ai_chatbot.shards import DEFAULT_INDEX_NAME
+from ai_chatbot.streaming import ANSWER_STREAM_TAG
+from ai_chatbot.vector_store_registry import (
+    MANIFEST_FILE,
+    VectorStoreRegistry,
+    resolve_index_path,
+)
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
+
+
+class EmptyDocumentError(Exception):
+    """Raised when a downloaded document yields no readable content."""
+
+
+def get_bedrock_embeddings(model_id=EMBEDDING_MODEL_ID):
+    """
+    Returns Titan embeddings backed by the shared embedding cache,
+    so only chunks that have never been embedded reach Bedrock,
+    and those are sent in concurrent, rate-paced batches.
+    """
+    embeddings = BedrockEmbeddings(client=get_bedrock_runtime(), model_id=model_id)
+    return CachedEmbeddings(BatchedEmbeddings(embeddings), model_id)
+
+
+def get_chat_llm():
+    """
+    Returns the Bedrock chat model shared by every QA chain (and the agent) in this process.
+    It lives in the client registry because it holds the pooled Bedrock client. Responses are
+    streamed, so callbacks (the web chat's SSE stream) receive tokens as they are generated.
+    """
+    return get_client_registry().get(
+        "chat_llm",
+        lambda: BedrockChat(client=get_bedrock_runtime(), model_id=settings.BEDROCK_MODEL_ID, streaming=True)
+    )
+
+
+def load_vector_store(path):
+    """
+    Loads a private, writable copy of a published version.
+    """
+    vector_store = FAISS.load_local(path, get_bedrock_embeddings(), allow_dangerous_deserialization=True)
+    configure_search(vector_store.index)
+    return vector_store
+
+
+def load_serving_store(path):
+    """
+    Opens a published version for queries only. With FAISS_MMAP_SERVING the vectors are
+    memory-mapped, so every worker on the host shares one page-cache copy.
+    """
+    if settings.FAISS_MMAP_SERVING:
+        return load_serving_vector_store(path, get_bedrock_embeddings())
+    return load_vector_store(path)
+
+
+def vector_store_size(vector_store):
+    # Private vectors plus a rough allowance for the chunk texts kept in the docstore;
+    # memory-mapped vectors live in the shared page cache and are not counted
+    index = vector_store.index
+    index_bytes = 0 if is_memory_mapped(index) else estimate_index_bytes(index)
+    return index_bytes + index.ntotal * 2000
+
+
+_vector_store_registry = None
+_vector_store_registry_lock = threading.Lock()
+
+
+def get_vector_store_registry():
+    """
+    Returns the process-wide registry of loaded indexes. Indexes stay loaded for the lifetime
+    of the worker and are swapped when a new version is published; company shards share a
+    memory budget and the least recently queried are unloaded first.
+    """
+    global _vector_store_registry
+    with _vector_store_registry_lock:
+        if _vector_store_registry is None:
+            limit_search_threads()
+            _vector_store_registry = VectorStoreRegistry(
+                load_serving_store,
+                check_interval=settings.VECTOR_STORE_CHECK_INTERVAL,
+                max_bytes=settings.VECTOR_STORE_MAX_BYTES,
+                sizer=vector_store_size
+            )
+        return _vector_store_registry
+
+
+def get_manifest(index_name, entry):
+    """
+    Returns the corpus manifest of a loaded index version, read once per version.
+    """
+    manifest = entry.resources.get("manifest")
+    if manifest is None:
+        try:
+            with open(os.path.join(resolve_index_path(index_name, entry.version), MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {"documents": {}}
+        entry.resources["manifest"] = manifest
+    return manifest
+
+
+def ensure_s3_document(bucket_name, file_key, index_name=DEFAULT_INDEX_NAME):
+    """
+    Makes sure the current version of an S3 PDF is in ``index_name``, ingesting it only
+    when its ETag differs from the one recorded in the manifest. Returns the registry entry.
+    """
+    file_path, etag = get_s3_cache().fetch(get_s3_client(), bucket_name, file_key)
+    registry = get_vector_store_registry()
+    entry = registry.get(index_name)
+    if entry is not None:
+        info = get_manifest(index_name, entry)["documents"].get(file_key)
+        if info is not None and info.get("etag") == etag:
+            return entry
+
+    from .corpus import CorpusManager
+    vector_store, stats = ingest_pdf(file_path, file_key, CorpusManager(index_name), info={"etag": etag})
+    if not stats["chunks"]:
+        raise EmptyDocumentError(f"File {file_key} is empty or could not be read.")
+    # Load the version just published instead of waiting for the next registry check
+    registry.invalidate(index_name)
+    return registry.get(index_name)
+
+
+def get_qa_chain(entry, index_name=DEFAULT_INDEX_NAME, doc_id=None):
+    """
+    Returns the RetrievalQA chain for a loaded index version, optionally restricted to
+    the chunks of one document, building it once per version.
+    """
+    qa = entry.resources.get(("qa", doc_id))
+    if qa is None:
+        search_kwargs = {"k": 3}
+        if doc_id is not None:
+            document = get_manifest(index_name, entry)["documents"].get(doc_id, {})
+            allowed = set(document.get("chunks", [])) | set(document.get("aliases", {}).values())
+            search_kwargs["filter"] = lambda metadata: (
+                metadata.get("chunk_id") in allowed or metadata.get("doc_id") == doc_id
+            )
+            # Enough candidates that a document holding a small share of the corpus still gets k hits
+            ntotal = entry.vector_store.index.ntotal
+            search_kwargs["fetch_k"] = min(ntotal, 20 * math.ceil(ntotal / max(len(allowed), 1)))
+        qa = RetrievalQA.from_chain_type(
+            llm=get_chat_llm(),
+            chain_type="stuff",
+            retriever=entry.vector_store.as_retriever(search_kwargs=search_kwargs)
+        )
+        entry.resources[("qa", doc_id)] = qa
+    return qa
+
+
+def answer_question(query, index_name=DEFAULT_INDEX_NAME, doc_id=None, entry=None, callbacks=None):
+    """
+    Answers ``query`` from ``index_name`` (optionally only from document ``doc_id``).
+    Returns None if the index has not been built yet or holds no chunks.
+    ``callbacks`` receive the answer's LLM tokens as they are generated (cached answers send none).
+    """
+    entry = entry or get_vector_store_registry().get(index_name)
+    if entry is None or not entry.vector_store.index.ntotal:
+        return None
+    logger.info(f"Processing query with RAG: '{query}' ('{index_name}' version {entry.version}, document {doc_id})")
+    namespace = index_name if doc_id is None else f"{index_name}:{doc_id}"
+    # Answers are reused until the index is republished
+    return get_answer_cache().get_or_compute(
+        namespace, entry.version, query,
+        lambda: get_qa_chain(entry, index_name, doc_id).run(
+            query, callbacks=callbacks, tags=[ANSWER_STREAM_TAG] if callbacks else None
+        ),
+        embed=entry.vector_store.embedding_function.embed_query
+    )
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import TaskProgressConsumer
+
+websocket_urlpatterns = [
+    path('ws/ai_chatbot/tasks/<str:task_id>/', TaskProgressConsumer.as_asgi()),
+]
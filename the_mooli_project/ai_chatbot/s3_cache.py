@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+
+class S3ObjectCache:
+    """
+    A size-bounded, host-wide cache of S3 objects on local disk.
+
+    Objects are streamed straight into the cache file with parallel ranged GETs
+    (no in-memory copy), and later fetches only send a HEAD request to check the
+    ETag. File locks and atomic renames make it safe for several Celery workers to
+    fetch the same key at once: one downloads, the others wait and reuse the file.
+    """
+
+    def __init__(self, root, max_bytes, part_size=8 * 1024 * 1024, max_concurrency=8, min_age_for_eviction=300):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        # Entries used more recently than this are never evicted, since a reader may still open them
+        self.min_age_for_eviction = min_age_for_eviction
+        os.makedirs(self.root, exist_ok=True)
+
+    def _entry_path(self, bucket_name, file_key):
+        digest = hashlib.sha256(f"{bucket_name}/{file_key}".encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.root, digest + (os.path.splitext(file_key)[1] or ".bin"))
+
+    def _read_meta(self, path):
+        try:
+            with open(f"{path}.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, path, meta):
+        tmp_path = f"{path}.json.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, f"{path}.json")
+
+    def fetch(self, s3_client, bucket_name, file_key, etag=None):
+        """
+        Returns ``(local_path, etag)`` for the current version of the object, downloading
+        it only if the cached copy is missing or stale. Pass a known ``etag`` to skip the HEAD.
+        """
+        if etag is None:
+            head = s3_client.head_object(Bucket=bucket_name, Key=file_key)
+            etag, size = head["ETag"], head["ContentLength"]
+        else:
+            size = None
+
+        path = self._entry_path(bucket_name, file_key)
+        with FileLock(f"{path}.lock"):
+            meta = self._read_meta(path)
+            if meta and meta["etag"] == etag and os.path.exists(path):
+                logger.info(f"S3 cache hit for s3://{bucket_name}/{file_key}.")
+            else:
+                if size is None:
+                    size = s3_client.head_object(Bucket=bucket_name, Key=file_key, IfMatch=etag)["ContentLength"]
+                self._download(s3_client, bucket_name, file_key, etag, size, path)
+                meta = {"bucket": bucket_name, "key": file_key, "etag": etag, "size": size}
+            meta["last_used"] = time.time()
+            self._write_meta(path, meta)
+
+        self.evict()
+        return path, etag
+
+    def _download(self, s3_client, bucket_name, file_key, etag, size, path):
+        started = time.monotonic()
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        ranges = [(start, min(start + self.part_size, size) - 1) for start in range(0, size, self.part_size)]
+
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+
+            def fetch_range(byte_range):
+                start, end = byte_range
+                # IfMatch guarantees every part comes from the same object version
+                body = s3_client.get_object(
+                    Bucket=bucket_name, Key=file_key, Range=f"bytes={start}-{end}", IfMatch=etag
+                )["Body"]
+                offset = start
+                for block in body.iter_chunks(chunk_size=1024 * 1024):
+                    os.pwrite(fd, block, offset)
+                    offset += len(block)
+                if offset != end + 1:
+                    raise IOError(f"Short read for bytes {start}-{end} of {file_key}.")
+
+            if len(ranges) > 1:
+                with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(ranges))) as pool:
+                    list(pool.map(fetch_range, ranges))
+            elif ranges:
+                fetch_range(ranges[0])
+            os.fsync(fd)
+        except Exception:
+            os.close(fd)
+            os.remove(tmp_path)
+            raise
+        os.close(fd)
+        os.replace(tmp_path, path)
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Downloaded s3://{bucket_name}/{file_key} ({size / 1e6:.1f} MB in {len(ranges)} parts) "
+            f"in {elapsed:.2f}s."
+        )
+
+    def evict(self):
+        """
+        Removes least recently used objects until the cache fits in ``max_bytes``.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.root, name[:-len(".json")])
+            meta = self._read_meta(path)
+            if not meta or not os.path.exists(path):
+                continue
+            total += meta["size"]
+            entries.append((meta.get("last_used", 0), meta["size"], path))
+
+        now = time.time()
+        for last_used, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if now - last_used < self.min_age_for_eviction:
+                continue
+            with FileLock(f"{path}.lock"):
+                for stale in (path, f"{path}.json"):
+                    try:
+                        os.remove(stale)
+                    except FileNotFoundError:
+                        pass
+            total -= size
+            logger.info(f"Evicted {path} from the S3 cache.")
+
+
+_s3_cache = None
+_s3_cache_lock = threading.Lock()
+
+
+def get_s3_cache():
+    """
+    Returns the process-wide S3 object cache configured from settings.
+    """
+    global _s3_cache
+    with _s3_cache_lock:
+        if _s3_cache is None:
+            _s3_cache = S3ObjectCache(
+                settings.S3_CACHE_DIR,
+                max_bytes=settings.S3_CACHE_MAX_BYTES,
+                part_size=settings.S3_CACHE_PART_SIZE,
+                max_concurrency=settings.S3_CACHE_MAX_CONCURRENCY,
+            )
+        return _s3_cache
@@ -0,0 +1,41 @@
+import os
+
+from django.conf import settings
+
+DEFAULT_INDEX_NAME = "faiss_index"
+
+
+def index_name_for_company(company_id):
+    """
+    Returns the index directory of a company's shard, or the shared index when there is none
+    (e.g. Slack and Teams messages, which are not tied to a Mooli user).
+    """
+    if company_id is None:
+        return DEFAULT_INDEX_NAME
+    return os.path.join(settings.FAISS_SHARD_ROOT, f"company_{company_id}")
+
+
+def company_id_for_user(user):
+    """
+    Returns the id of the requester's current company, if any.
+    """
+    if user is None or not user.is_authenticated:
+        return None
+    try:
+        return user.userprofile.current_company_id
+    except Exception:
+        return None
+
+
+def list_index_names():
+    """
+    Returns the shared index and every company shard that has been published.
+    """
+    names = [DEFAULT_INDEX_NAME]
+    if os.path.isdir(settings.FAISS_SHARD_ROOT):
+        names += sorted(
+            os.path.join(settings.FAISS_SHARD_ROOT, name)
+            for name in os.listdir(settings.FAISS_SHARD_ROOT)
+            if name.startswith("company_")
+        )
+    return names
@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from ai_chatbot.clients import get_client_registry, get_slack_client
+
+logger = logging.getLogger(__name__)
+
+ACK_TEXT = ":wave: Got it! Working on that now..."
+
+# chat.postMessage is limited per channel, chat.update per workspace
+_RATE_LIMIT_SCOPE = {"chat.postMessage": "channel", "chat.update": "workspace"}
+
+
+class Delivery:
+    """
+    One outbound Slack message. ``update_of`` is the ts of the message this one replaces.
+    """
+
+    def __init__(self, channel, text, due, update_of=None):
+        self.channel = channel
+        self.text = text
+        self.due = due
+        self.update_of = update_of
+        self.state = "pending"  # pending -> sending -> sent | failed
+        self.ts = None
+        self.attempts = 0
+        self.done = threading.Event()
+
+
+class SlackOutbox:
+    """
+    Delivers outbound Slack messages from one background thread per process.
+
+    - Messages to a channel are spaced by ``channel_interval`` (Slack allows about one
+      message per second per channel). A 429 pauses the channel, or the whole workspace
+      for workspace-scoped methods, for the Retry-After the response asks for, and the
+      message is retried then instead of immediately.
+    - An answer to a message the web view acknowledged replaces the acknowledgement with
+      chat.update, so the user ends up with one message. If the acknowledgement cannot be
+      updated, the answer is posted as a new message instead.
+    - Every message is sent on its own: messages to a channel can be answers to different
+      users, so they are never merged into one post.
+    """
+
+    def __init__(self, client, channel_interval=1.0, max_attempts=3):
+        self.client = client
+        self.channel_interval = channel_interval
+        self.max_attempts = max_attempts
+        self._queues = {}
+        self._channel_ready = {}
+        self._workspace_ready = {}
+        self._sending = 0
+        self._stats = {"posted": 0, "updated": 0, "rate_limited": 0, "failed": 0}
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="slack-outbox", daemon=True)
+        self._thread.start()
+
+    def post(self, channel, text, due=None):
+        return self._enqueue(Delivery(channel, text, due or time.time()))
+
+    def reply(self, channel, text, ack_ts=None):
+        """
+        Sends an answer, replacing the acknowledgement ``ack_ts`` when the view posted one.
+        """
+        return self._enqueue(Delivery(channel, text, time.time(), update_of=ack_ts))
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued message has been delivered or given up on.
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else float("inf"))
+        with self._cond:
+            while self._sending or any(self._queues.values()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 0.1))
+        return True
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, queued=sum(len(queue) for queue in self._queues.values()))
+
+    def _enqueue(self, delivery):
+        with self._cond:
+            self._queues.setdefault(delivery.channel, []).append(delivery)
+            self._cond.notify()
+        return delivery
+
+    def _next_delivery(self, now):
+        """
+        Returns the delivery to send now, or the time to wake up next.
+        """
+        wake_at = None
+        for channel, queue in self._queues.items():
+            if not queue:
+                continue
+            ready_at = self._channel_ready.get(channel, 0)
+            due = [d for d in queue if d.due <= now]
+            if due:
+                head = due[0]
+                method = "chat.update" if head.update_of is not None else "chat.postMessage"
+                ready_at = max(ready_at, self._workspace_ready.get(method, 0))
+                if ready_at <= now:
+                    queue.remove(head)
+                    head.state = "sending"
+                    self._sending = 1
+                    return head
+            channel_wake_at = max(ready_at, min(d.due for d in queue))
+            wake_at = channel_wake_at if wake_at is None else min(wake_at, channel_wake_at)
+        return wake_at
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    delivery = self._next_delivery(time.time())
+                    if isinstance(delivery, Delivery):
+                        break
+                    timeout = None if delivery is None else max(delivery - time.time(), 0.01)
+                    self._cond.wait(timeout)
+            self._send(delivery)
+
+    def _send(self, d):
+        update_of = d.update_of
+        method = "chat.update" if update_of is not None else "chat.postMessage"
+        try:
+            if update_of is not None:
+                response = self.client.chat_update(channel=d.channel, ts=update_of, text=d.text)
+            else:
+                response = self.client.chat_postMessage(channel=d.channel, text=d.text)
+        except Exception as e:
+            self._failed(d, method, e)
+            return
+
+        with self._cond:
+            d.state, d.ts = "sent", response.get("ts", update_of)
+            d.done.set()
+            self._channel_ready[d.channel] = time.time() + self.channel_interval
+            self._stats["updated" if update_of is not None else "posted"] += 1
+            self._sending = 0
+            self._cond.notify_all()
+
+    def _failed(self, d, method, error):
+        response = getattr(error, "response", None)
+        rate_limited = response is not None and response.status_code == 429
+        with self._cond:
+            if rate_limited:
+                retry_after = float(response.headers.get("Retry-After", response.headers.get("retry-after", 1)))
+                ready_at = time.time() + retry_after
+                if _RATE_LIMIT_SCOPE.get(method) == "workspace":
+                    self._workspace_ready[method] = ready_at
+                else:
+                    self._channel_ready[d.channel] = ready_at
+                self._stats["rate_limited"] += 1
+                logger.warning(f"Slack {method} rate limited in {d.channel}; retrying in {retry_after}s.")
+            d.attempts += 1
+            retry = True
+            if rate_limited or d.attempts < self.max_attempts:
+                d.state = "pending"
+            elif d.update_of is not None:
+                # e.g. the acknowledgement was deleted: the answer still has to reach the user
+                logger.warning(f"Could not replace Slack message {d.update_of} in {d.channel}, posting instead: {error}")
+                d.update_of, d.attempts, d.state = None, 0, "pending"
+            else:
+                retry = False
+                d.state = "failed"
+                d.done.set()
+                self._stats["failed"] += 1
+                logger.error(f"Giving up on Slack message to {d.channel}: {error}")
+            if retry:
+                # Retries keep their place at the front of the channel's queue
+                self._queues[d.channel].insert(0, d)
+            if not rate_limited:
+                self._channel_ready[d.channel] = time.time() + self.channel_interval
+            self._sending = 0
+            self._cond.notify_all()
+
+
+def _build_slack_outbox():
+    return SlackOutbox(
+        get_slack_client(),
+        channel_interval=settings.SLACK_CHANNEL_INTERVAL,
+        max_attempts=settings.SLACK_MAX_RETRIES,
+    )
+
+
+def get_slack_outbox():
+    return get_client_registry().get("slack_outbox", _build_slack_outbox)
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+# Tags an LLM call whose whole output is the answer (routed and RAG answers), so it streams unbuffered
+ANSWER_STREAM_TAG = "answer_stream"
+
+
+def sse_event(event, data):
+    """
+    Formats one Server-Sent Event; ``data`` is sent as JSON.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StreamMetrics:
+    """
+    Rolling time-to-first-token and total latency of streamed answers in this process.
+    """
+
+    def __init__(self, window=1000):
+        self._ttft = deque(maxlen=window)
+        self._total = deque(maxlen=window)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def record(self, ttft, total):
+        with self._lock:
+            if ttft is not None:
+                self._ttft.append(ttft)
+            self._total.append(total)
+            self._count += 1
+
+    def stats(self):
+        def percentile(values, q):
+            values = sorted(values)
+            return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 1) if values else None
+
+        with self._lock:
+            return {
+                "streams": self._count,
+                "ttft_p50_ms": percentile(self._ttft, 0.5),
+                "ttft_p95_ms": percentile(self._ttft, 0.95),
+                "total_p50_ms": percentile(self._total, 0.5),
+                "total_p95_ms": percentile(self._total, 0.95),
+            }
+
+
+_stream_metrics = StreamMetrics()
+
+
+def get_stream_metrics():
+    return _stream_metrics
+
+
+def _make_callback_handler(emit):
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class StreamingCallbackHandler(BaseCallbackHandler):
+        """
+        Turns agent callbacks into stream events. Each LLM call of the ReAct loop is buffered
+        until its "Final Answer:" marker; the tokens after it are the answer and are emitted as
+        they arrive. Calls tagged ANSWER_STREAM_TAG (answers that skip the agent) are emitted
+        from their first token. Tool calls and their results are emitted as steps.
+        """
+
+        def __init__(self):
+            self.buffer = ""
+            self.answer_started = False
+
+        def on_llm_start(self, serialized, prompts, **kwargs):
+            self.buffer = ""
+            self.answer_started = ANSWER_STREAM_TAG in (kwargs.get("tags") or [])
+
+        on_chat_model_start = on_llm_start
+
+        def on_llm_new_token(self, token, **kwargs):
+            if self.answer_started:
+                emit("token", {"text": token})
+                return
+            self.buffer += token
+            marker = self.buffer.find(FINAL_ANSWER_MARKER)
+            if marker != -1:
+                self.answer_started = True
+                rest = self.buffer[marker + len(FINAL_ANSWER_MARKER):].lstrip()
+                if rest:
+                    emit("token", {"text": rest})
+
+        def on_agent_action(self, action, **kwargs):
+            emit("step", {"tool": action.tool, "input": str(action.tool_input)})
+
+        def on_tool_end(self, output, **kwargs):
+            emit("observation", {"text": str(output)[:500]})
+
+    return StreamingCallbackHandler()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_stream_executor():
+    # Streamed agents run in their own threads so they never hold the event loop
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.CHAT_STREAM_MAX_WORKERS, thread_name_prefix="chat-stream")
+        return _executor
+
+
+async def stream_agent_answer(user_input, company_id=None, session_id=None):
+    """
+    Runs the agent for ``user_input`` and yields Server-Sent Events while it works:
+    ``step`` and ``observation`` for tool calls, ``token`` for the answer as it is generated,
+    then ``done`` with the full answer and timings.
+    """
+    from ai_chatbot.agent_tools import run_agent_task
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    started = time.perf_counter()
+
+    def emit(event, data):
+        loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+
+    handler = _make_callback_handler(emit)
+    future = loop.run_in_executor(
+        get_stream_executor(),
+        lambda: run_agent_task(user_input, company_id=company_id, callbacks=[handler], session_id=session_id)
+    )
+    future.add_done_callback(lambda _: queue.put_nowait(("finished", None)))
+
+    ttft = None
+    while True:
+        try:
+            event, data = await asyncio.wait_for(queue.get(), timeout=settings.CHAT_STREAM_KEEPALIVE)
+        except asyncio.TimeoutError:
+            # An SSE comment keeps proxies from closing a quiet connection during a long tool call
+            yield ": keepalive\n\n"
+            continue
+        if event == "finished":
+            break
+        if event == "token" and ttft is None:
+            ttft = time.perf_counter() - started
+        yield sse_event(event, data)
+
+    answer = future.result()
+    total = time.perf_counter() - started
+    if ttft is None:
+        # Nothing was streamed (e.g. an error message), so the answer itself is the first token
+        ttft = total
+    metrics = get_stream_metrics()
+    metrics.record(ttft, total)
+    logger.info(f"Streamed answer: time to first token {ttft * 1000:.0f} ms, total {total * 1000:.0f} ms.")
+    stats = metrics.stats()
+    if stats["streams"] % 100 == 0:
+        logger.info(f"Streaming latency over the last {min(stats['streams'], 1000)} answers: {stats}")
+    yield sse_event("done", {"message": answer, "ttft_ms": round(ttft * 1000), "total_ms": round(total * 1000)})
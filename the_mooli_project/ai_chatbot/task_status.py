@@ -0,0 +1,58 @@
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_raw_states(task_ids):
+    """
+    Returns the result-backend records of ``task_ids`` as stored (bytes, or None for tasks
+    with no stored state yet), fetched with one MGET from the Redis result backend.
+    """
+    from celery import current_app
+
+    backend = current_app.backend
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    try:
+        return backend.mget(keys)
+    except NotImplementedError:
+        # Key-value backends without a multi-get: one lookup per task
+        return [backend.get(key) for key in keys]
+
+
+def states_etag(task_ids, raw_states):
+    """
+    Returns an ETag that changes whenever any of the tasks changes state (or progress).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for task_id, raw in zip(task_ids, raw_states):
+        digest.update(task_id.encode())
+        digest.update(b"\0")
+        digest.update(raw if isinstance(raw, bytes) else (raw or "").encode())
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()}"'
+
+
+def decode_states(task_ids, raw_states):
+    """
+    Returns ``{task_id: {"status": ..., "result"|"progress": ...}}`` with empty fields left out.
+    """
+    from celery import current_app
+
+    backend = current_app.backend
+    states = {}
+    for task_id, raw in zip(task_ids, raw_states):
+        if raw is None:
+            states[task_id] = {"status": "PENDING"}
+            continue
+        meta = backend.decode_result(raw)
+        status, result = meta["status"], meta.get("result")
+        state = {"status": status}
+        if status == "PROGRESS":
+            state["progress"] = result
+        elif status == "FAILURE":
+            state["result"] = str(backend.exception_to_python(result))
+        elif result is not None:
+            state["result"] = result
+        states[task_id] = state
+    return states
@@ -1,35 +1,17 @@
 from celery import shared_task
-import boto3
 import json
 import os
-import asyncio
 from django.conf import settings
-from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext
-from botbuilder.schema import Activity, ActivityTypes, ConversationReference
-from llama_index.core import VectorStoreIndex, ServiceContext
-from llama_index.llms.bedrock import Bedrock
-from llama_index.vector_stores.faiss import FaissVectorStore
-from llama_index.embeddings.bedrock import BedrockEmbedding
-from llama_index.readers.file import PDFReader
-import faiss
 import logging
-import tempfile
 import re
 
-from io import BytesIO
-# Import my existing functions from agent_tools.py
-from ai_chatbot.agent_tools import ingest_from_s3, create_faiss_index
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from ai_chatbot.shards import index_name_for_company, list_index_names
+
+# The RAG engine, LangChain, FAISS, boto3 and botbuilder are imported inside the tasks,
+# so importing this module (e.g. from the views) stays cheap
 
 logger = logging.getLogger(__name__)
 
-boto3_session = boto3.Session(
-    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.environ.get("AWS_REGION_NAME", "us-east-1"),
-)
-bedrock_runtime = boto3_session.client('bedrock-runtime')
 
 @shared_task(bind=True)
 def process_message(self, request_data):
@@ -37,6 +19,9 @@ def process_message(self, request_data):
     Celery task to process messages, generate a response using RAG with FAISS, and send it back.
     Handles Slack and Teams payloads with specific S3 file indexing.
     """
+    from ai_chatbot.conversation_memory import conversation_id_for, get_conversation_memory, standalone_question
+    from ai_chatbot.rag_engine import EmptyDocumentError, answer_question, ensure_s3_document
+
     try:
         platform = request_data.get('platform', 'teams')
         channel_id = None
@@ -59,6 +44,13 @@ def process_message(self, request_data):
             response_text = "Please provide a valid message."
             send_response(platform, request_data, channel_id, conversation_id, response_text)
             return
+
+        # Follow-ups ("and its limitations?") are rewritten with the channel's conversation memory
+        user_message = message_text
+        memory = get_conversation_memory() if "unknown" not in (channel_id, conversation_id) else None
+        memory_id = conversation_id_for(platform, channel_id, conversation_id)
+        if memory:
+            message_text = standalone_question(memory.load(memory_id), message_text)
         
         # Extract file name and query type
         file_match = re.search(r'PythonAI\.pdf|pythonai\.pdf', message_text, re.IGNORECASE)
@@ -70,75 +62,30 @@ def process_message(self, request_data):
             send_response(platform, request_data, channel_id, conversation_id, response_text)
             return
         
-        # Initialize Bedrock LLM and Embedding
-        llm = Bedrock(
-            model="anthropic.claude-3-sonnet-20240229-v1:0",
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name="us-east-1"
-        )
-        embed_model = BedrockEmbedding(
-            model="amazon.titan-embed-text-v1",
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name="us-east-1"
-        )
-        
-        # Set ServiceContext to ensure Bedrock
-        service_context = ServiceContext.from_defaults(llm=llm, embed_model=embed_model)
-        
-        # Initialize FAISS vector store
-        faiss_index = faiss.IndexFlatL2(1536)
-        vector_store = FaissVectorStore(faiss_index=faiss_index)
-        
-        # Use boto3 directly to download the file instead of S3Reader
-        s3_client = boto3_session.client('s3')
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            try:
-                # Download the file from S3
-                s3_client.download_fileobj(settings.S3_BUCKET_NAME, file_key, tmp_file)
-                tmp_file.flush()
-                
-                # Use PDFReader to load the document
-                pdf_reader = PDFReader()
-                documents = pdf_reader.load_data(tmp_file.name)
-                
-                if not documents:
-                    response_text = f"File {file_key} is empty or could not be read."
-                    send_response(platform, request_data, channel_id, conversation_id, response_text)
-                    return
-                    
-                # Index documents with FAISS
-                index = VectorStoreIndex.from_documents(
-                    documents, 
-                    vector_store=vector_store, 
-                    embed_model=embed_model, 
-                    service_context=service_context
-                )
-                
-                if summarize_match:
-                    query_engine = index.as_query_engine(response_mode="compact")
-                    response = query_engine.query("Provide a concise summary of the document.")
-                    response_text = f"Summary of PythonAI.pdf:\n{str(response)}"
-                else:
-                    query_engine = index.as_query_engine()
-                    response = query_engine.query(message_text)
-                    response_text = str(response)
-                    
-            except Exception as e:
-                logger.error(f"Error processing file from S3: {e}", exc_info=True)
-                response_text = f"Error processing file {file_key}: {str(e)}"
-                send_response(platform, request_data, channel_id, conversation_id, response_text)
-                return
-            finally:
-                # Clean up temp file
-                try:
-                    os.unlink(tmp_file.name)
-                except:
-                    pass
+        try:
+            # The document is (re)indexed into the shared corpus only when its S3 ETag changes,
+            # and retrieval is restricted to its chunks
+            entry = ensure_s3_document(settings.S3_BUCKET_NAME, file_key)
+            if summarize_match:
+                summary_query = "Provide a concise summary of the document."
+                response = answer_question(summary_query, doc_id=file_key, entry=entry)
+                response_text = f"Summary of PythonAI.pdf:\n{response}"
+            else:
+                response_text = answer_question(message_text, doc_id=file_key, entry=entry)
+
+        except EmptyDocumentError as e:
+            send_response(platform, request_data, channel_id, conversation_id, str(e))
+            return
+        except Exception as e:
+            logger.error(f"Error processing file from S3: {e}", exc_info=True)
+            response_text = f"Error processing file {file_key}: {str(e)}"
+            send_response(platform, request_data, channel_id, conversation_id, response_text)
+            return
         
         logger.info(f"Generated response: {response_text}")
         send_response(platform, request_data, channel_id, conversation_id, response_text)
+        if memory:
+            memory.append(memory_id, user_message, response_text)
 
     except Exception as e:
         logger.error(f"Error in process_message: {e}", exc_info=True)
@@ -148,112 +95,93 @@ def process_message(self, request_data):
 def send_response(platform, request_data, channel_id, conversation_id, response_text):
     if platform == 'slack' and channel_id and channel_id != "unknown":
         try:
-            from slack_bolt import App
-            app = App(token=settings.SLACK_BOT_TOKEN)
-            app.client.chat_postMessage(channel=channel_id, text=response_text)
-            logger.info("Message sent to Slack.")
+            from ai_chatbot.slack_outbox import get_slack_outbox
+            # Queued; the outbox paces the channel and replaces the view's acknowledgement with the answer
+            get_slack_outbox().reply(channel_id, response_text, ack_ts=request_data.get("ack_ts"))
+            logger.info("Message queued for Slack.")
         except Exception as e:
             logger.error(f"Error sending Slack response: {e}", exc_info=True)
     elif platform == 'teams':
         try:
-            activity = Activity.deserialize(request_data)
-            teams_reference = TurnContext.get_conversation_reference(activity)
-            if teams_reference is None or not hasattr(teams_reference, 'conversation') or not teams_reference.conversation:
-                logger.error(f"Invalid teams_reference: {teams_reference}")
+            from ai_chatbot.teams_sender import get_teams_sender
+
+            sender = get_teams_sender()
+            teams_reference = sender.conversation_reference(request_data)
+            if teams_reference is None:
+                logger.error(f"No conversation reference in Teams activity for conversation {conversation_id}")
                 return
-            asyncio.run(send_teams_message(teams_reference, response_text))
+            sender.send(teams_reference, response_text)
+            logger.info("Message sent to Teams.")
         except Exception as e:
             logger.error(f"Error processing Teams activity: {e}", exc_info=True)
 
-async def send_teams_message(teams_reference: ConversationReference, response_text: str):
-    try:
-        app_id = os.environ.get("TEAMS_APP_ID")
-        app_password = os.environ.get("TEAMS_APP_PASSWORD")
-        if not app_id or not app_password:
-            raise ValueError("TEAMS_APP_ID or TEAMS_APP_PASSWORD not set.")
-        
-        adapter = BotFrameworkAdapter(
-            BotFrameworkAdapterSettings(app_id=app_id, app_password=app_password)
-        )
-
-        async def send_response(turn_context: TurnContext):
-            if turn_context is None:
-                logger.error("TurnContext is None")
-                return
-            await turn_context.send_activity(
-                Activity(
-                    type=ActivityTypes.message,
-                    text=response_text
-                )
-            )
-
-        await adapter.continue_conversation(
-            teams_reference,
-            send_response,
-            bot_id=app_id
-        )
-        logger.info("Message sent to Teams.")
-    except Exception as e:
-        logger.error(f"Error in send_teams_message: {e}", exc_info=True)
-        raise
-
-def ingest_from_temp_file(file_path):
+def upload_to_s3(file_path):
     """
-    Loads a PDF from a temporary file path, splits it, and returns document chunks.
-    This is an adaptation of your original ingest_from_s3 function.
+    Uploads a processed file to S3 for permanent storage and returns its key.
     """
-    try:
-        logger.info(f"Loading {file_path} for ingestion...")
-        
-        loader = PyPDFLoader(file_path)
-        documents = loader.load()
-        
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-        docs = text_splitter.split_documents(documents)
-        logger.info(f"Split document into {len(docs)} chunks.")
-        
-        # Optionally, you can now upload this to S3 for permanent storage if needed
-        s3_client = boto3.client('s3')
-        s3_file_key = f"uploads/{os.path.basename(file_path)}"
-        s3_client.upload_file(file_path, settings.S3_BUCKET_NAME, s3_file_key)
-        logger.info(f"File uploaded to S3 at: {s3_file_key}")
-        
-        return docs
-    except Exception as e:
-        logger.error(f"Error ingesting file from temp path: {e}")
-        return []
+    from ai_chatbot.clients import get_s3_client
 
-@shared_task(bind=True)
-def process_uploaded_file(self, file_path):
+    s3_client = get_s3_client()
+    s3_file_key = f"uploads/{os.path.basename(file_path)}"
+    s3_client.upload_file(file_path, settings.S3_BUCKET_NAME, s3_file_key)
+    logger.info(f"File uploaded to S3 at: {s3_file_key}")
+    return s3_file_key
+
+@shared_task(bind=True, publishes_progress=True)
+def process_uploaded_file(self, file_path, company_id=None):
     """
-    Celery task to handle the ingestion of an uploaded file in the background.
+    Celery task to handle the ingestion of an uploaded file in the background,
+    into the uploading company's index shard. Each stage is pushed to the
+    browser (see progress.py); completion is pushed from the task_postrun signal.
     """
+    from ai_chatbot.corpus import CorpusManager, document_id_for
+    from ai_chatbot.pdf_pipeline import ingest_pdf
+    from ai_chatbot.progress import ProgressReporter
+
+    progress = ProgressReporter(self)
     try:
         filename = os.path.basename(file_path)
         logger.info(f"Starting Celery task to process file: {filename} at path: {file_path}")
+        progress("downloaded", filename=filename, bytes=os.path.getsize(file_path))
         
-        # 1. Ingest the document from the temporary file path
-        documents = ingest_from_temp_file(file_path)
+        # 1. Stream the pages of the temporary file into the company's corpus,
+        #    replacing an earlier upload of the same file
+        corpus = CorpusManager(index_name_for_company(company_id))
+        vector_store, stats = ingest_pdf(file_path, document_id_for(file_path), corpus, progress=progress)
 
-        if not documents:
+        if not vector_store:
             logger.error(f"No documents were created from the uploaded file: {filename}.")
             return "Failed to process file."
 
-        # 2. Create the FAISS index from the new documents
-        vector_store = create_faiss_index(documents)
+        logger.info(
+            f"File {filename} successfully processed and added to the FAISS index "
+            f"({stats['pages']} pages, {stats['chunks']} chunks, peak RSS {stats['peak_rss_mb']} MB, "
+            f"{stats['embedding_calls_saved']} embedding calls and {stats['index_bytes_saved'] / 1e6:.1f} MB "
+            f"saved by deduplication)."
+        )
 
-        if vector_store:
-            logger.info(f"File {filename} successfully processed and FAISS index created.")
-            # Clean up the temporary file after processing is complete
-            os.remove(file_path)
-            return f"File {filename} successfully processed and indexed."
-        else:
-            logger.error("FAISS index creation failed.")
-            return "Failed to create knowledge base from file."
+        # 2. Keep a permanent copy in S3, then clean up the temporary file
+        upload_to_s3(file_path)
+        os.remove(file_path)
+        return f"File {filename} successfully processed and indexed."
 
     except Exception as e:
         logger.error(f"An unexpected error occurred during file processing: {filename}: {e}")
-        return f"Failed to process file {filename}."
\ No newline at end of file
+        return f"Failed to process file {filename}."
+
+@shared_task
+def compact_corpus(index_name=None):
+    """
+    Periodic Celery task that compacts the shared corpus index
+    and every company shard, or only ``index_name`` when given.
+    """
+    from ai_chatbot.corpus import CorpusManager
+
+    results = []
+    for name in [index_name] if index_name else list_index_names():
+        vector_store = CorpusManager(name).compact()
+        if vector_store is None:
+            results.append(f"No index '{name}' to compact.")
+        else:
+            results.append(f"Compacted '{name}' to {vector_store.index.ntotal} vectors.")
+    return " ".join(results)
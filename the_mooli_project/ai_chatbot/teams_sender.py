@@ -0,0 +1,112 @@
+import asyncio
+import copy
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from ai_chatbot.clients import get_client_registry
+
+logger = logging.getLogger(__name__)
+
+
+class TeamsSender:
+    """
+    Sends Teams replies from one long-lived event loop per process.
+
+    The Bot Framework adapter caches a connector client per service URL, and each connector
+    keeps an aiohttp session bound to the loop that opened it. The adapter's app credentials
+    keep their MSAL token cache, which hands out the same access token until it expires.
+    With ``asyncio.run`` per reply all of that was thrown away every time. Here the loop,
+    the adapter and therefore the sessions and the token live as long as the worker process.
+    """
+
+    def __init__(self, app_id, app_password, max_references=1024):
+        self.app_id = app_id
+        self.app_password = app_password
+        self.max_references = max_references
+        self._adapter = None
+        self._references = OrderedDict()
+        self._references_lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="teams-sender", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def conversation_reference(self, request_data):
+        """
+        Returns the ConversationReference for an incoming Teams activity payload. References are
+        cached per conversation id, so only the first message of a conversation is deserialized;
+        later ones just refresh the reply-to id and service URL.
+        """
+        conversation_id = request_data.get("conversation", {}).get("id")
+        with self._references_lock:
+            reference = self._references.get(conversation_id)
+            if reference is not None:
+                self._references.move_to_end(conversation_id)
+        if reference is None:
+            from botbuilder.core import TurnContext
+            from botbuilder.schema import Activity
+
+            reference = TurnContext.get_conversation_reference(Activity.deserialize(request_data))
+            if reference is None or not reference.conversation:
+                return None
+            with self._references_lock:
+                self._references[conversation_id] = reference
+                while len(self._references) > self.max_references:
+                    self._references.popitem(last=False)
+        reference = copy.copy(reference)
+        reference.activity_id = request_data.get("id", reference.activity_id)
+        reference.service_url = request_data.get("serviceUrl", reference.service_url)
+        return reference
+
+    def send(self, reference, text, timeout=None):
+        """
+        Sends ``text`` into the conversation from any thread and waits for it to be delivered.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._send(reference, text), self._loop)
+        return future.result(timeout or settings.TEAMS_SEND_TIMEOUT)
+
+    async def _send(self, reference, text):
+        from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+        from botbuilder.schema import Activity, ActivityTypes
+
+        if self._adapter is None:
+            # Created on the loop, as its connector clients must be
+            self._adapter = BotFrameworkAdapter(
+                BotFrameworkAdapterSettings(app_id=self.app_id, app_password=self.app_password)
+            )
+
+        async def send_response(turn_context):
+            if turn_context is None:
+                logger.error("TurnContext is None")
+                return
+            await turn_context.send_activity(Activity(type=ActivityTypes.message, text=text))
+
+        await self._adapter.continue_conversation(reference, send_response, bot_id=self.app_id)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        if not self._thread.is_alive():
+            self._loop.close()
+
+
+def _build_teams_sender():
+    if not settings.TEAMS_APP_ID or not settings.TEAMS_APP_PASSWORD:
+        raise ValueError("TEAMS_APP_ID or TEAMS_APP_PASSWORD not set.")
+    return TeamsSender(
+        settings.TEAMS_APP_ID, settings.TEAMS_APP_PASSWORD, max_references=settings.TEAMS_REFERENCE_CACHE_SIZE
+    )
+
+
+def get_teams_sender():
+    """
+    Returns this process's Teams sender. It lives in the client registry, so a forked
+    worker starts its own loop thread instead of inheriting a dead one.
+    """
+    return get_client_registry().get("teams", _build_teams_sender)
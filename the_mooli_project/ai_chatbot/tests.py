@@ -1,3 +1,1804 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+# Modules that must only be imported when the chatbot is first used
+HEAVY_MODULES = (
+    "langchain", "langchain_community", "langchain_core", "faiss", "numpy",
+    "boto3", "botocore", "botbuilder", "slack_bolt", "slack_sdk", "pypdf",
+)
+
+COLD_IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import the_mooli_project.wsgi
+from django.urls import get_resolver
+get_resolver().url_patterns
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "modules": sorted({name.split(".")[0] for name in sys.modules})}))
+"""
+
+
+class ColdStartTests(SimpleTestCase):
+    """
+    Imports the WSGI application and the URLconf in a fresh interpreter, as a web worker
+    does on startup, and fails if that pulls in the AI stack or exceeds the time budget.
+    """
+
+    budget_seconds = float(os.getenv("IMPORT_TIME_BUDGET", "1.5"))
+
+    def cold_import(self):
+        env = dict(os.environ, AI_CHATBOT_EAGER_WARMUP="False")
+        env.setdefault("DJANGO_SETTINGS_MODULE", "the_mooli_project.settings")
+        result = subprocess.run(
+            [sys.executable, "-c", COLD_IMPORT_SCRIPT],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def test_wsgi_import_does_not_load_ai_dependencies(self):
+        loaded = set(self.cold_import()["modules"])
+        self.assertEqual(sorted(loaded.intersection(HEAVY_MODULES)), [])
+
+    def test_wsgi_import_time_budget(self):
+        # Best of three, so a busy CI machine does not fail the build on one slow run
+        seconds = min(self.cold_import()["seconds"] for _ in range(3))
+        self.assertLess(
+            seconds, self.budget_seconds,
+            f"Cold import of the_mooli_project.wsgi took {seconds:.2f}s (budget {self.budget_seconds}s)"
+        )
+
+
+class EnsureS3DocumentTests(SimpleTestCase):
+    """
+    An S3 document is ingested again only when its ETag changes.
+    """
+
+    def ensure(self, stored_etag, chunks=5):
+        from ai_chatbot import rag_engine
+
+        registry = mock.Mock()
+        cache = mock.Mock()
+        cache.fetch.return_value = ("/tmp/PythonAI.pdf", '"v2"')
+        documents = {} if stored_etag is None else {"uploads/PythonAI.pdf": {"etag": stored_etag}}
+        with mock.patch.object(rag_engine, "get_s3_cache", return_value=cache), \
+                mock.patch.object(rag_engine, "get_s3_client"), \
+                mock.patch.object(rag_engine, "get_vector_store_registry", return_value=registry), \
+                mock.patch.object(rag_engine, "get_manifest", return_value={"documents": documents}), \
+                mock.patch.object(rag_engine, "ingest_pdf", return_value=(None, {"chunks": chunks})) as ingest, \
+                mock.patch("ai_chatbot.corpus.CorpusManager"):
+            entry = rag_engine.ensure_s3_document("bucket", "uploads/PythonAI.pdf")
+        return entry, registry, ingest
+
+    def test_unchanged_document_is_not_ingested(self):
+        entry, registry, ingest = self.ensure('"v2"')
+        ingest.assert_not_called()
+        self.assertIs(entry, registry.get.return_value)
+
+    def test_changed_document_is_ingested_with_its_etag(self):
+        for stored_etag in ('"v1"', None):
+            with self.subTest(stored_etag):
+                _, registry, ingest = self.ensure(stored_etag)
+                self.assertEqual(ingest.call_args.kwargs["info"], {"etag": '"v2"'})
+                registry.invalidate.assert_called_once_with("faiss_index")
+
+    def test_empty_document(self):
+        from ai_chatbot.rag_engine import EmptyDocumentError
+
+        with self.assertRaises(EmptyDocumentError):
+            self.ensure('"v1"', chunks=0)
+
+
+def make_embeddings(dimensions=16):
+    """
+    Returns deterministic LangChain embeddings (a hash of the text), so FAISS code runs without Bedrock.
+    """
+    import numpy as np
+    from langchain_core.embeddings import Embeddings
+
+    class HashEmbeddings(Embeddings):
+        def __init__(self):
+            self.calls = 0
+
+        def embed_query(self, text):
+            self.calls += 1
+            seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=4).digest(), "big")
+            vector = np.random.default_rng(seed).standard_normal(dimensions)
+            return (vector / np.linalg.norm(vector)).tolist()
+
+        def embed_documents(self, texts):
+            return [self.embed_query(text) for text in texts]
+
+    return HashEmbeddings()
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    """
+    The persistent chunk-embedding cache: only misses reach the model, once per distinct chunk.
+    """
+
+    def setUp(self):
+        from ai_chatbot.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        self.cache = EmbeddingCache(os.path.join(cache_dir, "embeddings.sqlite3"))
+        self.model = make_embeddings()
+        self.embeddings = CachedEmbeddings(self.model, "test-model", cache=self.cache)
+
+    def test_repeated_chunks_are_embedded_once(self):
+        first = self.embeddings.embed_documents(["alpha beta", "gamma", "alpha  beta"])
+        self.assertEqual(self.model.calls, 2)
+        self.assertEqual(first[0], first[2])
+
+        second = self.embeddings.embed_documents(["gamma", "alpha beta", "delta"])
+        self.assertEqual(self.model.calls, 3)
+        self.assertEqual(second[:2], [first[1], first[0]])
+
+    def test_vectors_survive_a_new_cache_instance(self):
+        from ai_chatbot.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+        vectors = self.embeddings.embed_documents(["Python is a language."])
+        reopened = CachedEmbeddings(make_embeddings(), "test-model", cache=EmbeddingCache(self.cache.path))
+        self.assertEqual(reopened.embed_documents(["Python is a language."]), vectors)
+        self.assertEqual(reopened.embeddings.calls, 0)
+
+    def test_queries_are_only_cached_in_memory(self):
+        from ai_chatbot.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+        self.cache.max_queries = 2
+        for query in ("What is Python?", "What is Django?", "What is Python?", "What is FAISS?"):
+            self.embeddings.embed_query(query)
+        self.assertEqual(self.model.calls, 3)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+        # The least recently asked query was evicted
+        self.embeddings.embed_query("What is Django?")
+        self.assertEqual(self.model.calls, 4)
+
+        reopened = CachedEmbeddings(make_embeddings(), "test-model", cache=EmbeddingCache(self.cache.path))
+        reopened.embed_query("What is Python?")
+        self.assertEqual(reopened.embeddings.calls, 1)
+
+    def test_models_do_not_share_vectors(self):
+        from ai_chatbot.embedding_cache import CachedEmbeddings
+
+        self.embeddings.embed_query("What is Python?")
+        other = CachedEmbeddings(make_embeddings(), "other-model", cache=self.cache)
+        other.embed_query("What is Python?")
+        self.assertEqual(other.embeddings.calls, 1)
+
+    def test_stats(self):
+        self.embeddings.embed_documents(["a", "b"])
+        self.embeddings.embed_documents(["a"])
+        stats = self.cache.stats()
+        self.assertEqual((stats["process_hits"], stats["process_misses"], stats["entries"]), (1, 2, 2))
+
+    def test_counters_are_flushed_periodically(self):
+        import sqlite3
+
+        def persisted():
+            with sqlite3.connect(self.cache.path) as conn:
+                return dict(conn.execute("SELECT name, value FROM counters"))
+
+        self.embeddings.embed_documents(["a", "b"])
+        self.embeddings.embed_documents(["a"])
+        self.assertEqual(persisted(), {})
+        self.cache.flush_interval = 0
+        self.embeddings.embed_documents(["b"])
+        self.assertEqual(persisted(), {"hits": 2, "misses": 2})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class EmbeddingRateTests(SimpleTestCase):
+    """
+    The embedding engine's AIMD pacing: halve on throttling, then grow back one step per window.
+    """
+
+    def make_embedder(self, clock, rate=20.0):
+        from ai_chatbot.embedding_engine import BatchedEmbedder, TokenBucket
+
+        bucket = TokenBucket(rate, capacity=8, clock=clock)
+        return BatchedEmbedder(lambda text: [0.0], rate=rate, bucket=bucket, rate_step=0.5, rate_window=1.0)
+
+    def test_rate_halves_on_throttle(self):
+        clock = FakeClock()
+        embedder = self.make_embedder(clock)
+        embedder._on_throttle()
+        self.assertEqual(embedder.bucket.rate, 10.0)
+        self.assertEqual(embedder.throttled, 1)
+
+    def test_simultaneous_throttles_halve_once(self):
+        clock = FakeClock()
+        embedder = self.make_embedder(clock)
+        for _ in range(8):
+            embedder._on_throttle()
+        self.assertEqual(embedder.bucket.rate, 10.0)
+        clock.now += 1.0
+        embedder._on_throttle()
+        self.assertEqual(embedder.bucket.rate, 5.0)
+
+    def test_rate_recovers_one_step_per_window(self):
+        clock = FakeClock()
+        embedder = self.make_embedder(clock)
+        embedder._on_throttle()
+        # Many successes inside one window do not raise the rate
+        for _ in range(100):
+            embedder._on_success()
+        self.assertEqual(embedder.bucket.rate, 10.0)
+        for _ in range(4):
+            clock.now += 1.0
+            for _ in range(50):
+                embedder._on_success()
+        self.assertEqual(embedder.bucket.rate, 12.0)
+
+    def test_rate_is_capped(self):
+        clock = FakeClock()
+        embedder = self.make_embedder(clock, rate=2.0)
+        for _ in range(100):
+            clock.now += 1.0
+            embedder._on_success()
+        self.assertEqual(embedder.bucket.rate, embedder.max_rate)
+
+    def test_throttled_request_is_retried(self):
+        from botocore.exceptions import ClientError
+
+        calls = []
+
+        def embed_one(text):
+            calls.append(text)
+            if len(calls) == 1:
+                raise ClientError({"Error": {"Code": "ThrottlingException"}}, "InvokeModel")
+            return [float(len(text))]
+
+        from ai_chatbot.embedding_engine import BatchedEmbedder
+
+        embedder = BatchedEmbedder(embed_one, max_workers=1, rate=1000.0)
+        self.assertEqual(embedder.embed(["a", "bb"]), [[1.0], [2.0]])
+        self.assertEqual(embedder.throttled, 1)
+        self.assertEqual(embedder.bucket.rate, 500.0)
+
+
+class FakeStore:
+    """
+    The part of a FAISS vector store ``publish_index`` uses.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def save_local(self, path):
+        os.makedirs(path)
+        with open(os.path.join(path, "name"), "w") as f:
+            f.write(self.name)
+
+
+class VectorStoreRegistryTests(SimpleTestCase):
+    """
+    Published index versions are swapped in atomically and loaded indexes stay within their memory budget.
+    """
+
+    def setUp(self):
+        from ai_chatbot.vector_store_registry import VectorStoreRegistry
+
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.loads = []
+        self.registry = VectorStoreRegistry(self.load, check_interval=0)
+
+    def load(self, path):
+        self.loads.append(path)
+        with open(os.path.join(path, "name")) as f:
+            return f.read()
+
+    def publish(self, index, name):
+        from ai_chatbot.vector_store_registry import publish_index
+
+        with self.settings(FAISS_MMAP_SERVING=False, FAISS_INDEX_KEEP_VERSIONS=2):
+            return publish_index(FakeStore(name), os.path.join(self.root, index))
+
+    def test_unpublished_index(self):
+        self.assertIsNone(self.registry.get(os.path.join(self.root, "missing")))
+
+    def test_new_version_is_swapped_in(self):
+        index = os.path.join(self.root, "shared")
+        first_version = self.publish("shared", "first")
+        first = self.registry.get(index)
+        self.assertEqual((first.version, first.vector_store), (first_version, "first"))
+        self.assertIs(self.registry.get(index), first)
+        self.assertEqual(len(self.loads), 1)
+
+        second_version = self.publish("shared", "second")
+        second = self.registry.get(index)
+        self.assertEqual((second.version, second.vector_store), (second_version, "second"))
+        # Queries that already hold the old entry keep their version
+        self.assertEqual(first.vector_store, "first")
+
+    def test_old_versions_are_removed(self):
+        versions = [self.publish("shared", name) for name in ("a", "b", "c")]
+        on_disk = sorted(name for name in os.listdir(os.path.join(self.root, "shared")) if name.startswith("v-"))
+        self.assertEqual(on_disk, sorted(versions[1:]))
+
+    def test_least_recently_used_index_is_evicted(self):
+        from ai_chatbot.vector_store_registry import VectorStoreRegistry
+
+        registry = VectorStoreRegistry(self.load, check_interval=60, max_bytes=2, sizer=lambda store: 1)
+        for name in ("a", "b", "c"):
+            self.publish(name, name)
+        registry.get(os.path.join(self.root, "a"))
+        registry.get(os.path.join(self.root, "b"))
+        registry.get(os.path.join(self.root, "a"))
+        registry.get(os.path.join(self.root, "c"))
+        self.assertEqual(sorted(os.path.basename(name) for name in registry.loaded()), ["a", "c"])
+
+
+def make_chunks(doc_name, count):
+    from langchain_core.documents import Document
+
+    # Distinct vocabulary per chunk, so deduplication does not merge them
+    return [
+        Document(page_content=" ".join(f"{doc_name}-{n}-word{i}" for i in range(40)), metadata={"source": doc_name})
+        for n in range(count)
+    ]
+
+
+class CorpusTestCase(SimpleTestCase):
+    """
+    Runs against a corpus in a temporary directory, with hash embeddings and an exact index.
+    """
+
+    def setUp(self):
+        from ai_chatbot.corpus import CorpusManager
+
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        self.corpus = CorpusManager(os.path.join(self.index_dir, "corpus"), embeddings=make_embeddings(), index_type="flat")
+        patcher = mock.patch("ai_chatbot.corpus.load_vector_store", self.load_vector_store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def load_vector_store(self, path):
+        from langchain_community.vectorstores import FAISS
+
+        return FAISS.load_local(path, self.corpus.embeddings, allow_dangerous_deserialization=True)
+
+    def published(self):
+        """
+        Returns the published manifest and the chunk ids stored in the published index.
+        """
+        vector_store, manifest = self.corpus._load()
+        return manifest, sorted(vector_store.index_to_docstore_id.values()) if vector_store else []
+
+
+class CorpusManagerTests(CorpusTestCase):
+    """
+    Documents are added, replaced and deleted without rebuilding the rest of the corpus.
+    """
+
+    def test_add_lists_documents(self):
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        self.corpus.add_document("uploads/b.pdf", make_chunks("b", 2))
+        self.assertEqual(self.corpus.list_documents(), {"uploads/a.pdf": 3, "uploads/b.pdf": 2})
+        manifest, stored = self.published()
+        self.assertEqual(stored, sorted(manifest["documents"]["uploads/a.pdf"]["chunks"] + manifest["documents"]["uploads/b.pdf"]["chunks"]))
+
+    def test_replace_drops_previous_chunks(self):
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        self.corpus.add_document("uploads/b.pdf", make_chunks("b", 2))
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a2", 2))
+
+        manifest, stored = self.published()
+        self.assertEqual(self.corpus.list_documents(), {"uploads/a.pdf": 2, "uploads/b.pdf": 2})
+        self.assertEqual(len(stored), 4)
+        vector_store, _ = self.corpus._load()
+        contents = [vector_store.docstore.search(chunk_id).page_content for chunk_id in manifest["documents"]["uploads/a.pdf"]["chunks"]]
+        self.assertTrue(all(content.startswith("a2-") for content in contents))
+
+    def test_delete_removes_only_that_document(self):
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        self.corpus.add_document("uploads/b.pdf", make_chunks("b", 2))
+
+        self.assertTrue(self.corpus.delete_document("uploads/a.pdf"))
+        self.assertFalse(self.corpus.delete_document("uploads/a.pdf"))
+        manifest, stored = self.published()
+        self.assertEqual(list(manifest["documents"]), ["uploads/b.pdf"])
+        self.assertEqual(stored, sorted(manifest["documents"]["uploads/b.pdf"]["chunks"]))
+        self.assertEqual(manifest["deleted_chunks"], 3)
+
+    def test_compact_keeps_live_chunks_searchable(self):
+        chunks = make_chunks("b", 2)
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        self.corpus.add_document("uploads/b.pdf", chunks)
+        self.corpus.delete_document("uploads/a.pdf")
+
+        compacted = self.corpus.compact()
+        manifest, stored = self.published()
+        self.assertEqual(manifest["deleted_chunks"], 0)
+        self.assertEqual(compacted.index.ntotal, 2)
+        self.assertEqual(len(stored), 2)
+        found = compacted.similarity_search(chunks[1].page_content, k=1)[0]
+        self.assertEqual(found.page_content, chunks[1].page_content)
+
+    def test_compact_without_index(self):
+        self.assertIsNone(self.corpus.compact())
+
+    def test_duplicates_are_stored_by_default(self):
+        self.assertFalse(settings.INGEST_DEDUP)
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        self.corpus.add_document("uploads/copy.pdf", make_chunks("a", 3))
+        manifest, stored = self.published()
+        self.assertEqual(len(stored), 6)
+        self.assertNotIn("fingerprints", manifest)
+
+
+class IndexTestCase(SimpleTestCase):
+    """
+    Runs against 8000 random vectors, searched for themselves.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        import numpy as np
+
+        cls.vectors = np.random.default_rng(0).standard_normal((8000, 16)).astype(np.float32)
+
+    def recall_at_1(self, index, n=200):
+        _, labels = index.search(self.vectors[:n], 1)
+        return float((labels[:, 0] == range(n)).mean())
+
+
+class AnnIndexTests(IndexTestCase):
+    """
+    Index types are chosen by corpus size, and every type finds a stored vector again.
+    """
+
+    def test_choose_index_type(self):
+        from ai_chatbot.ann import choose_index_type
+
+        with self.settings(FAISS_ANN_THRESHOLD=1000, FAISS_ANN_INDEX_TYPE="hnsw"):
+            self.assertEqual(choose_index_type(999, "auto"), "flat")
+            self.assertEqual(choose_index_type(1000, "auto"), "hnsw")
+        # Too few vectors to train the IVF coarse quantizer
+        self.assertEqual(choose_index_type(500, "ivf_flat"), "flat")
+        self.assertEqual(choose_index_type(30000, "ivf_flat"), "ivf_flat")
+        with self.assertRaises(ValueError):
+            choose_index_type(10, "annoy")
+
+    def test_every_index_type_finds_stored_vectors(self):
+        from ai_chatbot.ann import build_index, index_type_of
+
+        for index_type in ("flat", "hnsw", "ivf_flat"):
+            with self.subTest(index_type):
+                index = build_index(index_type, self.vectors)
+                self.assertEqual((index_type_of(index), index.ntotal), (index_type, len(self.vectors)))
+                self.assertGreaterEqual(self.recall_at_1(index), 0.95)
+
+    def test_retype_keeps_vector_positions(self):
+        from types import SimpleNamespace
+
+        from ai_chatbot.ann import build_index, index_type_of, retype_vector_store
+
+        vector_store = SimpleNamespace(index=build_index("flat", self.vectors))
+        retype_vector_store(vector_store, "hnsw")
+        self.assertEqual(index_type_of(vector_store.index), "hnsw")
+        self.assertGreaterEqual(self.recall_at_1(vector_store.index), 0.95)
+
+
+class StreamingIngestionTests(CorpusTestCase):
+    """
+    PDFs are parsed, split and embedded batch by batch, with progress reported along the way.
+    """
+
+    def pages(self, count, fail_at=None):
+        from langchain_core.documents import Document
+
+        for n in range(count):
+            if n == fail_at:
+                raise ValueError("damaged page")
+            yield Document(page_content=" ".join(f"page{n}-word{i}" for i in range(150)), metadata={"page": n})
+
+    def test_prefetch_keeps_order_and_bounds_the_buffer(self):
+        from ai_chatbot.pdf_pipeline import prefetch
+
+        produced = []
+
+        def items():
+            for n in range(10):
+                produced.append(n)
+                yield n
+
+        consumed = []
+        for item in prefetch(items(), maxsize=2):
+            time.sleep(0.01)
+            # At most the buffer, plus the item the producer is blocked on, runs ahead
+            self.assertLessEqual(len(produced) - len(consumed), 4)
+            consumed.append(item)
+        self.assertEqual(consumed, list(range(10)))
+
+    def test_prefetch_reraises_producer_errors(self):
+        from ai_chatbot.pdf_pipeline import prefetch
+
+        def items():
+            yield 1
+            raise ValueError("damaged page")
+
+        with self.assertRaises(ValueError):
+            list(prefetch(items()))
+
+    def test_pages_are_ingested_in_batches(self):
+        from ai_chatbot.pdf_pipeline import ingest_pdf
+
+        events = []
+        with mock.patch("ai_chatbot.pdf_pipeline.iter_pages", return_value=self.pages(4)):
+            vector_store, stats = ingest_pdf(
+                "PythonAI.pdf", "uploads/PythonAI.pdf", self.corpus, batch_size=3,
+                progress=lambda stage, **data: events.append((stage, data)),
+            )
+
+        self.assertEqual(stats["pages"], 4)
+        self.assertEqual(vector_store.index.ntotal, stats["chunks"])
+        self.assertEqual(self.corpus.list_documents(), {"uploads/PythonAI.pdf": stats["chunks"]})
+        stages = [stage for stage, _ in events]
+        self.assertIn("parsed", stages)
+        self.assertEqual(events[-2:], [("embedded", {"done": stats["chunks"], "total": stats["chunks"]}), ("indexed", {"chunks": stats["chunks"]})])
+        done = [data["done"] for stage, data in events if stage == "embedded"]
+        self.assertEqual(done, sorted(done))
+
+    def test_damaged_pdf_publishes_nothing(self):
+        from ai_chatbot.pdf_pipeline import ingest_pdf
+
+        with mock.patch("ai_chatbot.pdf_pipeline.iter_pages", return_value=self.pages(4, fail_at=2)):
+            with self.assertRaises(ValueError):
+                ingest_pdf("PythonAI.pdf", "uploads/PythonAI.pdf", self.corpus, batch_size=1)
+        self.assertEqual(self.published()[1], [])
+
+
+class FakeS3:
+    """
+    An in-memory S3 client serving ranged GETs, recording every request.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects  # key -> (etag, data)
+        self.requests = []
+
+    def head_object(self, Bucket, Key, IfMatch=None):
+        etag, data = self.objects[Key]
+        self.requests.append(("head", Key))
+        return {"ETag": etag, "ContentLength": len(data)}
+
+    def get_object(self, Bucket, Key, Range, IfMatch):
+        from io import BytesIO
+
+        etag, data = self.objects[Key]
+        if IfMatch != etag:
+            raise RuntimeError("PreconditionFailed")
+        start, end = (int(n) for n in Range[len("bytes="):].split("-"))
+        self.requests.append(("get", Key, start, end))
+        body = BytesIO(data[start:end + 1])
+        return {"Body": mock.Mock(iter_chunks=lambda chunk_size: iter(lambda: body.read(chunk_size), b""))}
+
+
+class BulkIngestTests(CorpusTestCase):
+    """
+    bulk_ingest takes the corpus write lock per checkpoint, so uploads are indexed while it runs.
+    """
+
+    def test_upload_runs_between_checkpoints(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from django.core.management import call_command
+        from filelock import FileLock
+        from langchain_core.documents import Document
+
+        from ai_chatbot.management.commands import bulk_ingest
+
+        keys = [f"uploads/bulk{n}.pdf" for n in range(5)]
+        s3 = mock.Mock()
+        s3.get_paginator.return_value.paginate.return_value = [{"Contents": [{"Key": key, "ETag": "e"} for key in keys]}]
+        upload = make_chunks("upload", 2)
+
+        def parse_pdf(bucket_name, key, etag):
+            if key == keys[3]:
+                # An upload arriving mid-run: it only has to wait for the checkpoint in progress
+                with FileLock(os.path.join(self.corpus.index_name, ".write.lock")).acquire(timeout=10):
+                    pass
+                self.corpus.add_document("uploads/upload.pdf", upload)
+            return [Document(page_content=f"{key} chunk {n}") for n in range(3)]
+
+        with mock.patch.object(bulk_ingest, "ProcessPoolExecutor", lambda max_workers, initializer: ThreadPoolExecutor(1)), \
+                mock.patch.object(bulk_ingest, "parse_pdf", parse_pdf), \
+                mock.patch.object(bulk_ingest, "get_s3_client", return_value=s3), \
+                mock.patch.object(bulk_ingest, "CorpusManager", return_value=self.corpus):
+            call_command("bulk_ingest", index=self.corpus.index_name, workers=1, publish_every=2, stdout=mock.Mock())
+
+        manifest, _ = self.published()
+        self.assertEqual(sorted(manifest["documents"]), sorted(keys + ["uploads/upload.pdf"]))
+
+
+class S3ObjectCacheTests(SimpleTestCase):
+    """
+    S3 objects are downloaded once in ranged parts and revalidated by ETag.
+    """
+
+    def setUp(self):
+        from ai_chatbot.s3_cache import S3ObjectCache
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.cache = S3ObjectCache(root, max_bytes=10_000, part_size=100, max_concurrency=4)
+        self.data = os.urandom(250)
+        self.s3 = FakeS3({"uploads/a.pdf": ('"v1"', self.data)})
+
+    def gets(self):
+        return [request for request in self.s3.requests if request[0] == "get"]
+
+    def test_download_in_ranged_parts(self):
+        path, etag = self.cache.fetch(self.s3, "bucket", "uploads/a.pdf")
+        self.assertEqual(etag, '"v1"')
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(sorted(request[2:] for request in self.gets()), [(0, 99), (100, 199), (200, 249)])
+
+    def test_unchanged_object_is_not_downloaded_again(self):
+        first, _ = self.cache.fetch(self.s3, "bucket", "uploads/a.pdf")
+        self.s3.requests.clear()
+        second, _ = self.cache.fetch(self.s3, "bucket", "uploads/a.pdf")
+        self.assertEqual(first, second)
+        self.assertEqual(self.s3.requests, [("head", "uploads/a.pdf")])
+
+    def test_known_etag_skips_the_head_request(self):
+        self.cache.fetch(self.s3, "bucket", "uploads/a.pdf")
+        self.s3.requests.clear()
+        self.cache.fetch(self.s3, "bucket", "uploads/a.pdf", etag='"v1"')
+        self.assertEqual(self.s3.requests, [])
+
+    def test_changed_object_is_downloaded_again(self):
+        self.cache.fetch(self.s3, "bucket", "uploads/a.pdf")
+        new_data = os.urandom(120)
+        self.s3.objects["uploads/a.pdf"] = ('"v2"', new_data)
+        path, etag = self.cache.fetch(self.s3, "bucket", "uploads/a.pdf")
+        self.assertEqual(etag, '"v2"')
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), new_data)
+
+    def test_short_read_leaves_no_file(self):
+        real_get = self.s3.get_object
+
+        def truncated_get(**kwargs):
+            response = real_get(**kwargs)
+            chunks = list(response["Body"].iter_chunks(1024))
+            response["Body"] = mock.Mock(iter_chunks=lambda chunk_size: iter([chunks[0][:-1]]))
+            return response
+
+        self.s3.get_object = truncated_get
+        with self.assertRaises(IOError):
+            self.cache.fetch(self.s3, "bucket", "uploads/a.pdf")
+        self.assertEqual(os.listdir(self.cache.root), [os.path.basename(self.cache._entry_path("bucket", "uploads/a.pdf")) + ".lock"])
+
+    def test_least_recently_used_objects_are_evicted(self):
+        self.cache.max_bytes = 400
+        self.cache.min_age_for_eviction = 0
+        self.s3.objects["uploads/b.pdf"] = ('"v1"', os.urandom(250))
+        old_path, _ = self.cache.fetch(self.s3, "bucket", "uploads/a.pdf")
+        new_path, _ = self.cache.fetch(self.s3, "bucket", "uploads/b.pdf")
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(new_path))
+
+
+@override_settings(INGEST_DEDUP=True)
+class CorpusWriterRollbackTests(CorpusTestCase):
+    """
+    A document that fails part-way through a multi-document write must leave no trace.
+    """
+
+    def failing_batches(self, doc_name, good_batches=1):
+        chunks = make_chunks(doc_name, 4)
+        for i in range(good_batches):
+            yield chunks[i * 2:i * 2 + 2]
+        raise RuntimeError("parser died")
+
+    def test_failed_document_is_rolled_back_and_can_be_retried(self):
+        with self.corpus.writer() as writer:
+            writer.add_document_batches("uploads/a.pdf", [make_chunks("a", 3)])
+            with self.assertRaises(RuntimeError):
+                writer.add_document_batches("uploads/b.pdf", self.failing_batches("b"))
+            self.assertFalse(writer.broken)
+            writer.publish()
+
+            manifest, stored = self.published()
+            self.assertEqual(sorted(manifest["documents"]), ["uploads/a.pdf"])
+            self.assertEqual(stored, sorted(manifest["documents"]["uploads/a.pdf"]["chunks"]))
+            self.assertFalse(any(chunk_id.startswith("uploads/b.pdf") for chunk_id in manifest["fingerprints"]))
+
+            # The retry reuses the same chunk ids without colliding with leftovers
+            count, replaced = writer.add_document_batches("uploads/b.pdf", [make_chunks("b", 4)])
+            self.assertEqual((count, replaced), (4, False))
+
+        manifest, stored = self.published()
+        self.assertEqual(len(manifest["documents"]["uploads/b.pdf"]["chunks"]), 4)
+        self.assertEqual(len(stored), 7)
+
+    def test_failed_replacement_restores_previous_version(self):
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        previous, _ = self.published()
+
+        with self.corpus.writer() as writer:
+            with self.assertRaises(RuntimeError):
+                writer.add_document_batches("uploads/a.pdf", self.failing_batches("a2"))
+            self.assertFalse(writer.dirty)
+            self.assertEqual(
+                writer.manifest["documents"]["uploads/a.pdf"]["chunks"],
+                previous["documents"]["uploads/a.pdf"]["chunks"],
+            )
+            self.assertEqual(
+                sorted(writer.vector_store.index_to_docstore_id.values()),
+                sorted(previous["documents"]["uploads/a.pdf"]["chunks"]),
+            )
+
+    def test_failure_in_first_document_leaves_no_index(self):
+        with self.corpus.writer() as writer:
+            with self.assertRaises(RuntimeError):
+                writer.add_document_batches("uploads/b.pdf", self.failing_batches("b"))
+            self.assertIsNone(writer.vector_store)
+            self.assertFalse(writer.dirty)
+        self.assertEqual(self.published(), ({"documents": {}, "deleted_chunks": 0}, []))
+
+    def test_broken_writer_refuses_to_publish(self):
+        from ai_chatbot.corpus import CorpusWriterError
+
+        with self.assertRaises(CorpusWriterError):
+            with self.corpus.writer() as writer:
+                writer.add_document_batches("uploads/a.pdf", [make_chunks("a", 2)])
+                writer.broken = True
+                writer.publish()
+        self.assertEqual(self.published()[1], [])
+
+
+class AnswerCacheTests(SimpleTestCase):
+    """
+    Exact and near-duplicate answer reuse, and the guards against reusing the answer of a different question.
+    """
+
+    def setUp(self):
+        from ai_chatbot.answer_cache import AnswerCache
+
+        self.cache = AnswerCache(similarity_threshold=0.95)
+        self.embedded = []
+
+    def embed_same(self, query):
+        # Every question gets the same vector, so only the signature guard can tell them apart
+        self.embedded.append(query)
+        return [1.0, 0.0, 0.0]
+
+    def ask(self, query, answer="computed", version="v1"):
+        return self.cache.get_or_compute("faiss_index", version, query, lambda: answer, embed=self.embed_same)
+
+    def test_exact_hit_does_not_embed(self):
+        self.ask("What is Python?", "a language")
+        self.embedded.clear()
+        self.assertEqual(self.ask("what is python", "other"), "a language")
+        self.assertEqual(self.embedded, [])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_paraphrase_is_a_semantic_hit(self):
+        self.ask("What is Python?", "a language")
+        self.assertEqual(self.ask("What is Python exactly?", "other"), "a language")
+        self.assertEqual(self.cache.semantic_hits, 1)
+
+    def test_negated_question_does_not_share_answer(self):
+        self.ask("Does pandas support parquet?", "yes")
+        self.assertEqual(self.ask("Does pandas not support parquet?", "it does"), "it does")
+        self.assertEqual(self.ask("Why doesn't pandas support parquet?", "it does"), "it does")
+        self.assertEqual(self.cache.semantic_hits, 0)
+
+    def test_swapped_entity_does_not_share_answer(self):
+        self.ask("Does pandas support parquet?", "yes")
+        self.assertEqual(self.ask("Does numpy support parquet?", "no"), "no")
+        self.assertEqual(self.ask("Does pandas support chapter 3?", "no"), "no")
+        self.assertEqual(self.cache.semantic_hits, 0)
+
+    def test_different_intent_does_not_share_answer(self):
+        self.ask("How does pandas read parquet?", "with read_parquet")
+        self.assertEqual(self.ask("Why does pandas read parquet?", "speed"), "speed")
+        self.assertEqual(self.ask("Summarize how pandas reads parquet", "summary"), "summary")
+
+    def test_new_index_version_drops_answers(self):
+        self.ask("What is Python?", "old")
+        self.assertEqual(self.ask("What is Python?", "new", version="v2"), "new")
+
+    def test_signatures(self):
+        from ai_chatbot.answer_cache import query_signature, signatures_compatible
+
+        base = query_signature("Does pandas support parquet?")
+        self.assertTrue(signatures_compatible(base, query_signature("does pandas supports parquet")))
+        self.assertTrue(signatures_compatible(base, query_signature("Does pandas support parquet files?")))
+        self.assertFalse(signatures_compatible(base, query_signature("Does pandas support parquet? No?")))
+        self.assertFalse(signatures_compatible(base, query_signature("Does polars support parquet?")))
+
+
+class ShardNamingTests(SimpleTestCase):
+    """
+    Each company gets its own index directory; requests without a company use the shared one.
+    """
+
+    def test_index_names(self):
+        from types import SimpleNamespace
+
+        from ai_chatbot.shards import DEFAULT_INDEX_NAME, company_id_for_user, index_name_for_company, list_index_names
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        with self.settings(FAISS_SHARD_ROOT=root):
+            self.assertEqual(index_name_for_company(None), DEFAULT_INDEX_NAME)
+            self.assertNotEqual(index_name_for_company(1), index_name_for_company(2))
+            os.makedirs(index_name_for_company(2))
+            os.makedirs(os.path.join(root, "tmp"))
+            self.assertEqual(list_index_names(), [DEFAULT_INDEX_NAME, index_name_for_company(2)])
+        # Shards do not move with the worker's working directory
+        self.assertTrue(os.path.isabs(index_name_for_company(1)))
+
+        user = SimpleNamespace(is_authenticated=True, userprofile=SimpleNamespace(current_company_id=7))
+        self.assertEqual(company_id_for_user(user), 7)
+        self.assertIsNone(company_id_for_user(SimpleNamespace(is_authenticated=False)))
+        self.assertIsNone(company_id_for_user(None))
+
+
+class CompanyShardFallbackTests(SimpleTestCase):
+    """
+    Companies are only answered from their own shard; only the shared index is built on demand.
+    """
+
+    def setUp(self):
+        from ai_chatbot import agent_tools
+
+        self.agent_tools = agent_tools
+        self.token = agent_tools.current_index_name.set(agent_tools.index_name_for_company(7))
+        self.addCleanup(agent_tools.current_index_name.reset, self.token)
+
+    def test_missing_shard_does_not_use_shared_index(self):
+        answers = {"faiss_index": "shared answer"}
+        with mock.patch.object(self.agent_tools, "answer_question", side_effect=lambda q, name, **kw: answers.get(name)) as answer, \
+                mock.patch.object(self.agent_tools, "ensure_s3_document") as ensure:
+            self.assertEqual(self.agent_tools.perform_qa_with_rag("What is Python?"), self.agent_tools.NO_COMPANY_DOCUMENTS)
+        self.assertEqual([c.args[1] for c in answer.call_args_list], [self.agent_tools.index_name_for_company(7)])
+        ensure.assert_not_called()
+
+    def test_missing_shared_index_is_built(self):
+        self.agent_tools.current_index_name.set("faiss_index")
+        calls = []
+
+        def answer_question(query, name, entry=None, callbacks=None):
+            calls.append(name)
+            return "built answer" if entry is not None else None
+
+        with mock.patch.object(self.agent_tools, "answer_question", side_effect=answer_question), \
+                mock.patch.object(self.agent_tools, "ensure_s3_document", return_value=object()) as ensure:
+            self.assertEqual(self.agent_tools.perform_qa_with_rag("What is Python?"), "built answer")
+        self.assertEqual(ensure.call_args.args[2], "faiss_index")
+        self.assertEqual(calls[-1], "faiss_index")
+
+    def test_empty_shard_counts_as_missing(self):
+        from types import SimpleNamespace
+
+        from ai_chatbot.rag_engine import answer_question
+
+        empty = SimpleNamespace(version="v-1", vector_store=SimpleNamespace(index=SimpleNamespace(ntotal=0)))
+        self.assertIsNone(answer_question("What is Python?", "faiss_shards/company_7", entry=empty))
+
+
+class MmapFlatIndexTests(CorpusTestCase):
+    """
+    Published flat indexes are searched by FAISS straight from memory-mapped files, with the same results.
+    """
+
+    def setUp(self):
+        super().setUp()
+        import numpy as np
+
+        self.vectors = np.random.default_rng(0).standard_normal((50, 8)).astype(np.float32)
+        self.queries = np.random.default_rng(1).standard_normal((3, 8)).astype(np.float32)
+        self.path = os.path.join(self.index_dir, "serving")
+        os.makedirs(self.path)
+
+    def flat_index(self):
+        import faiss
+
+        index = faiss.IndexFlatL2(8)
+        index.add(self.vectors)
+        return index
+
+    def test_search_matches_flat_index(self):
+        import numpy as np
+
+        from ai_chatbot.mmap_index import is_memory_mapped, load_serving_index, save_serving_files
+
+        index = self.flat_index()
+        save_serving_files(index, self.path)
+        mapped = load_serving_index(self.path)
+        self.assertTrue(is_memory_mapped(mapped))
+
+        expected_distances, expected_labels = index.search(self.queries, 5)
+        distances, labels = mapped.search(self.queries, 5)
+        np.testing.assert_array_equal(labels, expected_labels)
+        np.testing.assert_allclose(distances, expected_distances, rtol=1e-4, atol=1e-4)
+
+    def test_k_larger_than_index_pads_with_minus_one(self):
+        from ai_chatbot.mmap_index import load_serving_index, save_serving_files
+
+        save_serving_files(self.flat_index(), self.path)
+        _, labels = load_serving_index(self.path).search(self.queries[:1], 60)
+        self.assertEqual(sorted(labels[0][:50]), list(range(50)))
+        self.assertEqual(set(labels[0][50:]), {-1})
+
+    def test_mmap_serving_is_opt_in(self):
+        from django.conf import settings
+
+        self.assertFalse(settings.FAISS_MMAP_SERVING)
+
+    def test_published_version_is_served_memory_mapped(self):
+        from ai_chatbot.mmap_index import is_memory_mapped, load_serving_vector_store
+        from ai_chatbot.vector_store_registry import read_index_version, resolve_index_path
+
+        chunks = make_chunks("a", 5)
+        with self.settings(FAISS_MMAP_SERVING=True):
+            self.corpus.add_document("uploads/a.pdf", chunks)
+        path = resolve_index_path(self.corpus.index_name, read_index_version(self.corpus.index_name))
+        vector_store = load_serving_vector_store(path, self.corpus.embeddings)
+        self.assertTrue(is_memory_mapped(vector_store.index))
+        found = vector_store.similarity_search(chunks[3].page_content, k=1)[0]
+        self.assertEqual(found.page_content, chunks[3].page_content)
+
+
+class CompressedIndexTests(IndexTestCase):
+    """
+    float16 and PQ-with-re-ranking indexes use less memory and still find stored vectors.
+    """
+
+    def test_compressed_types_save_memory(self):
+        from ai_chatbot.ann import build_index, estimate_index_bytes, index_type_of, is_lossy
+
+        flat_bytes = estimate_index_bytes(build_index("flat", self.vectors))
+        with self.settings(FAISS_PQ_M=4, FAISS_REFINE_K_FACTOR=8):
+            for index_type, max_share in (("sq_fp16", 0.5), ("ivf_pq", 0.5), ("ivf_pq_refine", 0.9)):
+                with self.subTest(index_type):
+                    index = build_index(index_type, self.vectors)
+                    self.assertEqual(index_type_of(index), index_type)
+                    self.assertTrue(is_lossy(index))
+                    self.assertLessEqual(estimate_index_bytes(index), flat_bytes * max_share)
+                    if index_type != "ivf_pq":
+                        self.assertGreaterEqual(self.recall_at_1(index), 0.95)
+
+
+class CompressedCorpusTests(CorpusTestCase):
+    """
+    A compressed corpus is rebuilt from exact embeddings, not from its approximated vectors.
+    """
+
+    def test_compaction_re_embeds_lossy_vectors(self):
+        from ai_chatbot.ann import index_type_of
+
+        self.corpus.index_type = "sq_fp16"
+        chunks = make_chunks("b", 2)
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        self.corpus.add_document("uploads/b.pdf", chunks)
+        self.corpus.delete_document("uploads/a.pdf")
+        calls = self.corpus.embeddings.calls
+
+        compacted = self.corpus.compact()
+        self.assertEqual(index_type_of(compacted.index), "sq_fp16")
+        self.assertEqual(self.corpus.embeddings.calls, calls + 2)
+        self.assertEqual(self.published()[0]["index_type"], "sq_fp16")
+        found = compacted.similarity_search(chunks[0].page_content, k=1)[0]
+        self.assertEqual(found.page_content, chunks[0].page_content)
+
+
+@override_settings(INGEST_DEDUP=True)
+class DeduplicationTests(CorpusTestCase):
+    """
+    Chunks already in the corpus are aliased instead of embedded and stored again;
+    near duplicates are stored with their own text.
+    """
+
+    def words(self, count, prefix="word"):
+        return [f"{prefix}{i}" for i in range(count)]
+
+    def test_fingerprint_matches(self):
+        from ai_chatbot.dedup import FingerprintIndex, fingerprint
+
+        words = self.words(200)
+        index = FingerprintIndex(min_bands=4)
+        index.add("a#0", fingerprint(" ".join(words)))
+
+        self.assertEqual(index.match(fingerprint("  ".join(words))), ("a#0", "exact"))
+        edited = words[:100] + ["changed"] + words[101:]
+        self.assertEqual(index.match(fingerprint(" ".join(edited))), ("a#0", "near"))
+        self.assertEqual(index.match(fingerprint(" ".join(self.words(200, "other")))), (None, None))
+
+        index.discard(["a#0"])
+        self.assertEqual(index.match(fingerprint(" ".join(words))), (None, None))
+
+    def test_duplicate_document_is_aliased(self):
+        chunks = make_chunks("a", 3)
+        self.corpus.add_document("uploads/a.pdf", chunks)
+        calls = self.corpus.embeddings.calls
+
+        self.corpus.add_document("uploads/copy.pdf", make_chunks("a", 3))
+        self.assertEqual(self.corpus.embeddings.calls, calls)
+        self.assertEqual(self.corpus.last_dedup_stats["embedding_calls_saved"], 3)
+        manifest, stored = self.published()
+        self.assertEqual(len(stored), 3)
+        self.assertEqual(sorted(manifest["documents"]["uploads/copy.pdf"]["aliases"].values()), stored)
+        self.assertEqual(self.corpus.list_documents(), {"uploads/a.pdf": 3, "uploads/copy.pdf": 3})
+
+    def test_deleting_the_owner_hands_chunks_to_the_alias(self):
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        self.corpus.add_document("uploads/copy.pdf", make_chunks("a", 3))
+        _, stored_before = self.published()
+
+        self.corpus.delete_document("uploads/a.pdf")
+        manifest, stored = self.published()
+        self.assertEqual(stored, stored_before)
+        entry = manifest["documents"]["uploads/copy.pdf"]
+        self.assertEqual(sorted(entry["chunks"]), stored)
+        self.assertEqual(entry["aliases"], {})
+        self.assertEqual(manifest["deleted_chunks"], 0)
+
+    def test_unchanged_replacement_reuses_vectors(self):
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        _, stored_before = self.published()
+        calls = self.corpus.embeddings.calls
+
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        self.assertEqual(self.corpus.embeddings.calls, calls)
+        self.assertEqual(self.corpus.last_dedup_stats["reused_from_previous"], 3)
+        manifest, stored = self.published()
+        self.assertEqual(stored, stored_before)
+        self.assertNotIn("aliases", manifest["documents"]["uploads/a.pdf"])
+
+    def test_revised_chunk_keeps_its_new_text(self):
+        from langchain_core.documents import Document
+
+        words = self.words(200)
+        original = Document(page_content=" ".join(words), metadata={"source": "a"})
+        self.corpus.add_document("uploads/a.pdf", [original])
+        revised = Document(page_content=" ".join(words[:100] + ["2026"] + words[101:]), metadata={"source": "a"})
+        self.corpus.add_document("uploads/a.pdf", [revised])
+
+        self.assertEqual(self.corpus.last_dedup_stats["near_duplicates"], 1)
+        self.assertEqual(self.corpus.last_dedup_stats["embedding_calls_saved"], 0)
+        vector_store, manifest = self.corpus._load()
+        self.assertEqual(manifest["documents"]["uploads/a.pdf"].get("aliases", {}), {})
+        found = vector_store.similarity_search(revised.page_content, k=1)[0]
+        self.assertEqual(found.page_content, revised.page_content)
+        self.assertEqual(vector_store.index.ntotal, 1)
+
+    def test_compaction_keeps_fingerprints_of_live_chunks(self):
+        self.corpus.add_document("uploads/a.pdf", make_chunks("a", 3))
+        self.corpus.add_document("uploads/b.pdf", make_chunks("b", 2))
+        self.corpus.delete_document("uploads/a.pdf")
+
+        self.corpus.compact()
+        manifest, stored = self.published()
+        self.assertEqual(sorted(manifest["fingerprints"]), stored)
+
+
+class ClientRegistryTests(SimpleTestCase):
+    """
+    Network clients are built once per process and never shared with a forked child.
+    """
+
+    def setUp(self):
+        from ai_chatbot.clients import ClientRegistry
+
+        self.registry = ClientRegistry()
+        self.factory = mock.Mock(side_effect=lambda: object())
+
+    def test_client_is_reused(self):
+        first = self.registry.get("s3", self.factory)
+        self.assertIs(self.registry.get("s3", self.factory), first)
+        self.assertEqual(self.factory.call_count, 1)
+        self.assertEqual(self.registry.stats()["clients"]["s3"], {"created": 1, "reused": 1, "reuse_ratio": 0.5})
+
+    def test_forked_process_builds_its_own_client(self):
+        first = self.registry.get("s3", self.factory)
+        # As seen from a child process: the registry still carries the parent's pid
+        self.registry._pid = -1
+        self.assertIsNone(self.registry.peek("s3"))
+        self.assertIsNot(self.registry.get("s3", self.factory), first)
+        self.assertEqual(self.registry.stats()["pid"], os.getpid())
+
+    def test_discarded_client_is_rebuilt(self):
+        first = self.registry.get("s3", self.factory)
+        self.registry.discard("s3")
+        self.assertIsNot(self.registry.get("s3", self.factory), first)
+        self.assertEqual(self.registry.stats()["clients"]["s3"]["created"], 2)
+
+
+class TeamsSenderTests(SimpleTestCase):
+    """
+    Teams replies share one event loop per process, and conversation references are cached.
+    """
+
+    def setUp(self):
+        from ai_chatbot.teams_sender import TeamsSender
+
+        self.sender = TeamsSender("app-id", "secret")
+        self.addCleanup(self.sender.close)
+
+    def test_replies_share_one_loop(self):
+        import asyncio
+
+        loops = []
+
+        async def send(reference, text):
+            loops.append((asyncio.get_running_loop(), threading.current_thread().name, text))
+
+        self.sender._send = send
+        self.sender.send("reference", "first", timeout=5)
+        # Replies can be sent from any worker thread
+        thread = threading.Thread(target=self.sender.send, args=("reference", "second", 5))
+        thread.start()
+        thread.join()
+
+        self.assertEqual([text for _, _, text in loops], ["first", "second"])
+        self.assertEqual({loop for loop, _, _ in loops}, {self.sender._loop})
+        self.assertEqual({name for _, name, _ in loops}, {"teams-sender"})
+
+    def test_cached_reference_is_refreshed_per_message(self):
+        from types import SimpleNamespace
+
+        cached = SimpleNamespace(activity_id="1", service_url="https://old.example", conversation=SimpleNamespace(id="c1"))
+        self.sender._references["c1"] = cached
+        reference = self.sender.conversation_reference(
+            {"conversation": {"id": "c1"}, "id": "2", "serviceUrl": "https://new.example"}
+        )
+        self.assertEqual((reference.activity_id, reference.service_url), ("2", "https://new.example"))
+        # The cached reference is copied, not changed under other messages of the conversation
+        self.assertEqual((cached.activity_id, cached.service_url), ("1", "https://old.example"))
+
+
+class FakeSlack:
+    """
+    Records Slack Web API calls; ``errors`` are raised (in order) before any call succeeds.
+    """
+
+    def __init__(self, errors=()):
+        self.calls = []
+        self.errors = list(errors)
+
+    def _call(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"ts": kwargs.get("ts") or f"{len(self.calls)}.0"}
+
+    def chat_postMessage(self, **kwargs):
+        return self._call("chat.postMessage", **kwargs)
+
+    def chat_update(self, **kwargs):
+        return self._call("chat.update", **kwargs)
+
+
+def slack_error(status_code, retry_after=None):
+    error = Exception(f"Slack returned {status_code}")
+    error.response = mock.Mock(status_code=status_code, headers={"Retry-After": retry_after} if retry_after else {})
+    return error
+
+
+class SlackOutboxTests(SimpleTestCase):
+    """
+    Answers replace the view's acknowledgement, are paced per channel and survive rate limits.
+    """
+
+    def outbox(self, client, **kwargs):
+        from ai_chatbot.slack_outbox import SlackOutbox
+
+        kwargs.setdefault("channel_interval", 0)
+        outbox = SlackOutbox(client, **kwargs)
+        self.addCleanup(outbox.flush, 5)
+        return outbox
+
+    def test_answer_replaces_acknowledgement(self):
+        client = FakeSlack()
+        delivery = self.outbox(client).reply("C1", "The answer", ack_ts="111.1")
+        self.assertTrue(delivery.done.wait(5))
+        self.assertEqual(client.calls, [("chat.update", {"channel": "C1", "ts": "111.1", "text": "The answer"})])
+
+    def test_answer_without_acknowledgement_is_posted(self):
+        client = FakeSlack()
+        delivery = self.outbox(client).reply("C1", "The answer")
+        self.assertTrue(delivery.done.wait(5))
+        self.assertEqual(client.calls, [("chat.postMessage", {"channel": "C1", "text": "The answer"})])
+
+    def test_unreplaceable_acknowledgement_falls_back_to_a_post(self):
+        client = FakeSlack(errors=[slack_error(404)])
+        delivery = self.outbox(client, max_attempts=1).reply("C1", "The answer", ack_ts="111.1")
+        self.assertTrue(delivery.done.wait(5))
+        self.assertEqual([method for method, _ in client.calls], ["chat.update", "chat.postMessage"])
+        self.assertEqual(delivery.state, "sent")
+
+    def test_rate_limit_waits_for_retry_after(self):
+        client = FakeSlack(errors=[slack_error(429, retry_after="0.2")])
+        outbox = self.outbox(client)
+        started = time.monotonic()
+        delivery = outbox.post("C1", "Hello")
+        self.assertTrue(delivery.done.wait(5))
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(len(client.calls), 2)
+        self.assertEqual(outbox.stats()["rate_limited"], 1)
+
+    def test_replies_to_different_requests_stay_separate(self):
+        client = FakeSlack()
+        outbox = self.outbox(client, channel_interval=0.3)
+        outbox.post("C1", "first")
+        # Queued while the channel waits out its interval after the first message
+        time.sleep(0.1)
+        alice = outbox.reply("C1", "Answer for Alice")
+        bob = outbox.reply("C1", "Answer for Bob", ack_ts="333.3")
+        self.assertTrue(outbox.flush(5))
+        self.assertEqual(client.calls[1:], [
+            ("chat.postMessage", {"channel": "C1", "text": "Answer for Alice"}),
+            ("chat.update", {"channel": "C1", "ts": "333.3", "text": "Answer for Bob"}),
+        ])
+        self.assertEqual((alice.state, bob.state), ("sent", "sent"))
+        self.assertEqual(outbox.stats()["posted"], 2)
+
+    def test_view_acknowledges_before_queueing(self):
+        from ai_chatbot import views
+
+        order = []
+        say = mock.Mock(side_effect=lambda text: order.append("ack") or {"ts": "222.2"})
+        with mock.patch.object(views.process_message, "delay", side_effect=lambda data: order.append(data)):
+            views.handle_message({"channel": "C1", "text": "hi", "ts": "100.0"}, say)
+        self.assertEqual(order, ["ack", {"event": {"channel": "C1", "text": "hi", "ts": "100.0"}, "platform": "slack", "ack_ts": "222.2"}])
+
+    def test_failed_acknowledgement_still_queues_the_message(self):
+        from ai_chatbot import views
+
+        with mock.patch.object(views.process_message, "delay") as delay:
+            views.handle_message({"channel": "C1", "text": "hi"}, mock.Mock(side_effect=slack_error(429)))
+        self.assertNotIn("ack_ts", delay.call_args.args[0])
+
+
+class AnswerStreamTests(SimpleTestCase):
+    """
+    Answers are sent as Server-Sent Events while they are generated, then closed with "done".
+    """
+
+    def stream(self, run_agent_task, **settings_overrides):
+        import asyncio
+
+        from ai_chatbot.streaming import stream_agent_answer
+
+        async def collect():
+            return [event async for event in stream_agent_answer("What is Python?")]
+
+        with self.settings(**settings_overrides), mock.patch("ai_chatbot.agent_tools.run_agent_task", run_agent_task):
+            return asyncio.run(collect())
+
+    def test_tokens_stream_before_done(self):
+        from ai_chatbot.streaming import ANSWER_STREAM_TAG
+
+        def run_agent_task(user_input, company_id=None, callbacks=None, session_id=None):
+            handler = callbacks[0]
+            handler.on_chat_model_start({}, [[]], tags=[ANSWER_STREAM_TAG])
+            for token in ("Python ", "is ", "a language."):
+                handler.on_llm_new_token(token)
+            return "Python is a language."
+
+        events = self.stream(run_agent_task)
+        self.assertEqual(events[:3], [f'event: token\ndata: {{"text": "{token}"}}\n\n' for token in ("Python ", "is ", "a language.")])
+        self.assertTrue(events[3].startswith("event: done\n"))
+        done = json.loads(events[3].split("data: ", 1)[1])
+        self.assertEqual(done["message"], "Python is a language.")
+        self.assertLessEqual(done["ttft_ms"], done["total_ms"])
+
+    def test_quiet_runs_send_keepalives(self):
+        def run_agent_task(user_input, company_id=None, callbacks=None, session_id=None):
+            time.sleep(0.3)
+            return "cached answer"
+
+        events = self.stream(run_agent_task, CHAT_STREAM_KEEPALIVE=0.1)
+        self.assertIn(": keepalive\n\n", events)
+        self.assertEqual(json.loads(events[-1].split("data: ", 1)[1])["message"], "cached answer")
+
+
+class DirectAnswerStreamingTests(SimpleTestCase):
+    """
+    Routed and RAG answers stream their tokens like the agent's final answer does.
+    """
+
+    def handler(self):
+        from ai_chatbot.streaming import _make_callback_handler
+
+        events = []
+        return _make_callback_handler(lambda event, data: events.append((event, data))), events
+
+    def test_tagged_answer_streams_from_first_token(self):
+        from ai_chatbot.streaming import ANSWER_STREAM_TAG
+
+        handler, events = self.handler()
+        handler.on_chat_model_start({}, [[]], tags=[ANSWER_STREAM_TAG])
+        handler.on_llm_new_token("Python ")
+        handler.on_llm_new_token("is")
+        self.assertEqual(events, [("token", {"text": "Python "}), ("token", {"text": "is"})])
+
+    def test_agent_reasoning_is_buffered_until_final_answer(self):
+        handler, events = self.handler()
+        handler.on_chat_model_start({}, [[]], tags=[])
+        handler.on_llm_new_token("Thought: I know it. Final ")
+        self.assertEqual(events, [])
+        handler.on_llm_new_token("Answer: Python")
+        self.assertEqual(events, [("token", {"text": "Python"})])
+
+    def test_rag_answer_passes_callbacks_to_the_chain(self):
+        from types import SimpleNamespace
+
+        from ai_chatbot import rag_engine
+        from ai_chatbot.streaming import ANSWER_STREAM_TAG
+
+        entry = SimpleNamespace(
+            version="v-1",
+            vector_store=SimpleNamespace(index=SimpleNamespace(ntotal=3), embedding_function=SimpleNamespace(embed_query=None)),
+        )
+        chain = mock.Mock()
+        chain.run.return_value = "Python is a language."
+        cache = mock.Mock(get_or_compute=lambda namespace, version, query, compute, embed: compute())
+        callbacks = [object()]
+        with mock.patch.object(rag_engine, "get_qa_chain", return_value=chain), \
+                mock.patch.object(rag_engine, "get_answer_cache", return_value=cache):
+            self.assertEqual(rag_engine.answer_question("What is Python?", entry=entry, callbacks=callbacks), "Python is a language.")
+            rag_engine.answer_question("What is Python?", entry=entry)
+        self.assertEqual(chain.run.call_args_list, [
+            mock.call("What is Python?", callbacks=callbacks, tags=[ANSWER_STREAM_TAG]),
+            mock.call("What is Python?", callbacks=None, tags=None),
+        ])
+
+    def test_routed_answer_receives_the_stream_callbacks(self):
+        from ai_chatbot import agent_tools
+        from ai_chatbot.intent_router import DOCUMENT_QA
+
+        callbacks = [object()]
+        with mock.patch.object(agent_tools, "route_message", return_value=DOCUMENT_QA), \
+                mock.patch.object(agent_tools, "answer_question", return_value="Python is a language.") as answer, \
+                mock.patch.object(agent_tools, "get_agent_executor") as executor:
+            self.assertEqual(agent_tools.run_agent_task("What does the pdf say about Python?", callbacks=callbacks), "Python is a language.")
+        self.assertIs(answer.call_args.kwargs["callbacks"], callbacks)
+        executor.assert_not_called()
+
+
+class TaskProgressLongPollTests(SimpleTestCase):
+    """
+    The long-poll fallback answers at once with a newer event, or waits for the next pushed one.
+    """
+
+    def poll(self, snapshot, after_seq, push=None, timeout=2):
+        import asyncio
+
+        from asgiref.sync import sync_to_async
+
+        from ai_chatbot.progress import publish_event, wait_for_event
+
+        async def run():
+            waiter = asyncio.ensure_future(wait_for_event("task-1", after_seq, timeout))
+            if push is not None:
+                await asyncio.sleep(0.1)
+                await sync_to_async(publish_event)("task-1", push)
+            return await waiter
+
+        layers = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+        with self.settings(CHANNEL_LAYERS=layers), mock.patch("ai_chatbot.progress.snapshot", return_value=snapshot):
+            return asyncio.run(run())
+
+    def test_newer_stored_event_is_returned_at_once(self):
+        event = {"stage": "parsed", "seq": 2}
+        self.assertEqual(self.poll(event, after_seq=1), event)
+
+    def test_waits_for_the_next_pushed_event(self):
+        pushed = {"stage": "embedded", "done": 64, "total": 128, "seq": 3}
+        self.assertEqual(self.poll({"stage": "parsed", "seq": 2}, after_seq=2, push=pushed), pushed)
+
+    def test_times_out_without_news(self):
+        self.assertIsNone(self.poll({"stage": "parsed", "seq": 2}, after_seq=2, timeout=0.1))
+
+
+class ProgressReporterTests(SimpleTestCase):
+    """
+    Progress reported from the ingestion pipeline's prefetch thread keeps the task's id.
+    """
+
+    def test_report_from_another_thread(self):
+        from ai_chatbot.progress import ProgressReporter
+        from ai_chatbot.tasks import process_uploaded_file
+
+        process_uploaded_file.push_request(id="task-1")
+        self.addCleanup(process_uploaded_file.pop_request)
+        reporter = ProgressReporter(process_uploaded_file)
+        seen = {}
+
+        def report():
+            seen["request_id"] = process_uploaded_file.request.id
+            reporter("parsed", pages=3, chunks=12)
+
+        with mock.patch.object(process_uploaded_file, "update_state") as update_state, \
+                mock.patch("ai_chatbot.progress.publish_event") as publish_event:
+            thread = threading.Thread(target=report)
+            thread.start()
+            thread.join()
+
+        # Celery's request is thread-local: the prefetch thread does not see the task's id
+        self.assertIsNone(seen["request_id"])
+        event = {"pages": 3, "chunks": 12, "stage": "parsed", "seq": 1}
+        update_state.assert_called_once_with(task_id="task-1", state="PROGRESS", meta=event)
+        publish_event.assert_called_once_with("task-1", event)
+
+
+class TaskStatusBatchTests(SimpleTestCase):
+    """
+    Many task states are read with one MGET, and an unchanged batch is answered with a 304.
+    """
+
+    def setUp(self):
+        from types import SimpleNamespace
+
+        import fakeredis
+        from celery import current_app
+        from celery.backends.redis import RedisBackend
+
+        self.backend = RedisBackend(app=current_app, url="redis://localhost:6379/0")
+        self.backend.client = fakeredis.FakeRedis()
+        patcher = mock.patch("celery.current_app", SimpleNamespace(backend=self.backend))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, task_ids, etag=None):
+        from django.test import RequestFactory
+
+        from ai_chatbot.views import get_task_statuses
+
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return get_task_statuses(RequestFactory().get("/ai_chatbot/api/task-statuses/", {"task_ids": task_ids}, **headers))
+
+    def test_states_are_read_with_one_mget(self):
+        self.backend.store_result("done", {"chunks": 12}, "SUCCESS")
+        self.backend.store_result("running", {"stage": "parsed", "seq": 1}, "PROGRESS")
+        self.backend.store_result("broken", ValueError("bad pdf"), "FAILURE")
+
+        with mock.patch.object(self.backend.client, "mget", wraps=self.backend.client.mget) as mget:
+            response = self.get("done,running,broken,queued,done")
+        self.assertEqual(mget.call_count, 1)
+        self.assertEqual(json.loads(response.content), {
+            "done": {"status": "SUCCESS", "result": {"chunks": 12}},
+            "running": {"status": "PROGRESS", "progress": {"stage": "parsed", "seq": 1}},
+            "broken": {"status": "FAILURE", "result": "bad pdf"},
+            "queued": {"status": "PENDING"},
+        })
+
+    def test_unchanged_states_get_a_304(self):
+        self.backend.store_result("running", {"stage": "parsed", "seq": 1}, "PROGRESS")
+        etag = self.get("running,queued")["ETag"]
+
+        response = self.get("running,queued", etag=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        self.backend.store_result("running", {"stage": "indexed", "seq": 2}, "PROGRESS")
+        response = self.get("running,queued", etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_batch_size_is_limited(self):
+        with self.settings(TASK_STATUS_BATCH_MAX=2):
+            self.assertEqual(self.get("a,b,c").status_code, 400)
+        self.assertEqual(self.get("").status_code, 400)
+
+
+class IntentClassifierTests(SimpleTestCase):
+    """
+    Rules route the unambiguous messages; the embedding classifier only routes clear document questions.
+    """
+
+    def setUp(self):
+        import numpy as np
+
+        from ai_chatbot.intent_router import DOCUMENT_QA, EXEMPLARS, IntentRouter
+
+        # Document examples point one way and the others another; queries are placed in between
+        self.intent_of = {text: intent for intent, texts in EXEMPLARS.items() for text in texts}
+        self.queries = {}
+        embeddings = mock.Mock()
+        embeddings.embed_documents.side_effect = lambda texts: [
+            [1.0, 0.0] if self.intent_of[text] == DOCUMENT_QA else [0.0, 1.0] for text in texts
+        ]
+        embeddings.embed_query.side_effect = lambda text: np.asarray(self.queries[text])
+        self.embeddings = embeddings
+        self.router = IntentRouter(embeddings, min_similarity=0.6, margin=0.05)
+
+    def test_rules(self):
+        from ai_chatbot.intent_router import DOCUMENT_QA, SUMMARIZE, UPLOAD
+
+        self.assertEqual(self.router.classify("Please upload the report.pdf file"), (UPLOAD, "rule"))
+        self.assertEqual(self.router.classify("Give me a quick summary"), (SUMMARIZE, "rule"))
+        self.assertEqual(self.router.classify("What does the pdf say about loops?"), (DOCUMENT_QA, "rule"))
+        self.assertEqual(self.router.classify("hello there"), (None, None))
+        self.embeddings.embed_query.assert_not_called()
+
+    def test_embedding_classifier(self):
+        from ai_chatbot.intent_router import DOCUMENT_QA
+
+        self.queries = {
+            "How are decorators used?": [0.9, 0.1],
+            "What is the weather today?": [0.1, 0.9],
+            "Why is the sky blue?": [0.7, 0.68],
+        }
+        self.assertEqual(self.router.classify("How are decorators used?"), (DOCUMENT_QA, "embedding"))
+        self.assertEqual(self.router.classify("What is the weather today?"), (None, None))
+        # Closer to the document examples, but not by the required margin
+        self.assertEqual(self.router.classify("Why is the sky blue?"), (None, None))
+        self.assertEqual(self.embeddings.embed_documents.call_count, len({intent for intent in self.intent_of.values()}))
+
+    def test_summaries_share_one_query(self):
+        from ai_chatbot.intent_router import SUMMARIZE, SUMMARY_QUERY, rag_query_for
+
+        self.assertEqual(rag_query_for(SUMMARIZE, "Can you summarize the PythonAI.pdf?"), SUMMARY_QUERY)
+        self.assertEqual(rag_query_for(SUMMARIZE, "Give me a brief overview of this document"), SUMMARY_QUERY)
+        self.assertEqual(rag_query_for(SUMMARIZE, "Summarize the chapter on decorators"), "Summarize the chapter on decorators")
+
+    def test_metrics_count_saved_agent_calls(self):
+        from ai_chatbot.intent_router import RouterMetrics
+
+        metrics = RouterMetrics()
+        metrics.record("agent", 2.0, agent_llm_calls=3)
+        metrics.record("agent", 2.0, agent_llm_calls=5)
+        self.assertEqual(metrics.record("summarize", 0.5), 4.0)
+        stats = metrics.stats()
+        self.assertEqual(stats["requests"], {"agent": 2, "summarize": 1})
+        self.assertEqual(stats["llm_calls_saved"], 4.0)
+
+
+class IntentRoutingTests(SimpleTestCase):
+    """
+    Recognized messages skip the agent; a failing classifier leaves them to the agent.
+    """
+
+    def run_task(self, router):
+        from ai_chatbot import agent_tools
+
+        executor = mock.Mock()
+        executor.invoke.return_value = {"output": "agent answer"}
+        with self.settings(INTENT_ROUTER_ENABLED=True), \
+                mock.patch("ai_chatbot.intent_router.get_intent_router", return_value=router), \
+                mock.patch.object(agent_tools, "answer_question", return_value="direct answer") as answer, \
+                mock.patch.object(agent_tools, "get_agent_executor", return_value=executor) as get_executor:
+            response = agent_tools.run_agent_task("Summarize the PythonAI.pdf document")
+        return response, answer, get_executor
+
+    def test_routed_intent_skips_the_agent(self):
+        from ai_chatbot.intent_router import SUMMARIZE, SUMMARY_QUERY
+
+        router = mock.Mock()
+        router.classify.return_value = (SUMMARIZE, "rule")
+        response, answer, get_executor = self.run_task(router)
+        self.assertEqual(response, "direct answer")
+        self.assertEqual(answer.call_args.args[0], SUMMARY_QUERY)
+        get_executor.assert_not_called()
+
+    def test_classifier_error_falls_back_to_the_agent(self):
+        router = mock.Mock()
+        router.classify.side_effect = RuntimeError("Bedrock unavailable")
+        response, answer, get_executor = self.run_task(router)
+        self.assertEqual(response, "agent answer")
+        answer.assert_not_called()
+        get_executor.assert_called_once()
+
+
+class SessionToolMemoTests(SimpleTestCase):
+    """
+    Repeated DocumentQA inputs within a chat session reuse the earlier observation.
+    """
+
+    def setUp(self):
+        from ai_chatbot import agent_tools
+        from ai_chatbot.tool_memo import SessionToolMemo
+
+        self.agent_tools = agent_tools
+        self.memo = SessionToolMemo(max_sessions=2, max_entries=2, ttl=60)
+        patcher = mock.patch.object(agent_tools, "get_tool_memo", return_value=self.memo)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tool = mock.Mock(side_effect=lambda query: f"answer to {query}")
+        self.run = agent_tools.memoized_per_session("DocumentQA", self.tool)
+
+    def in_session(self, session_id, trace=None):
+        session_token = self.agent_tools.current_session_id.set(session_id)
+        self.addCleanup(self.agent_tools.current_session_id.reset, session_token)
+        trace_token = self.agent_tools.current_trace.set(trace)
+        self.addCleanup(self.agent_tools.current_trace.reset, trace_token)
+
+    def test_repeated_input_is_answered_from_the_memo(self):
+        self.in_session("s1")
+        self.assertEqual(self.run("What is Python?"), "answer to What is Python?")
+        self.assertEqual(self.run("  what is python? "), "answer to What is Python?")
+        self.assertEqual(self.tool.call_count, 1)
+        self.assertEqual(self.memo.stats()["hits"], 1)
+
+    def test_calls_outside_a_session_are_not_remembered(self):
+        self.run("What is Python?")
+        self.run("What is Python?")
+        self.assertEqual(self.tool.call_count, 2)
+
+    def test_unavailable_knowledge_base_is_not_remembered(self):
+        self.in_session("s1")
+        self.tool.side_effect = lambda query: self.agent_tools.KNOWLEDGE_BASE_UNAVAILABLE
+        self.run("What is Python?")
+        self.run("What is Python?")
+        self.assertEqual(self.tool.call_count, 2)
+
+    def test_repeat_in_the_same_run_is_traced_and_hinted(self):
+        from ai_chatbot.agent_trace import AgentTrace
+
+        trace = AgentTrace()
+        self.in_session("s1", trace)
+        trace.on_tool_start({"name": "DocumentQA"}, "What is Python?", run_id="t1")
+        self.run("What is Python?")
+        trace.on_tool_end("", run_id="t1")
+        trace.on_tool_start({"name": "DocumentQA"}, "What is Python?", run_id="t2")
+        observation = self.run("What is Python?")
+        trace.on_tool_end("", run_id="t2")
+
+        self.assertTrue(observation.endswith(self.agent_tools.REPEATED_OBSERVATION_HINT))
+        summary = trace.summary()
+        self.assertEqual((summary["tool_calls"], summary["memoized_tool_calls"]), (2, 1))
+
+    def test_entries_expire_and_sessions_are_bounded(self):
+        from ai_chatbot.tool_memo import SessionToolMemo
+
+        key = SessionToolMemo.key("faiss_index", "DocumentQA", "What is Python?")
+        with mock.patch("ai_chatbot.tool_memo.time.monotonic", return_value=1000.0):
+            self.memo.store("s1", key, "old")
+        with mock.patch("ai_chatbot.tool_memo.time.monotonic", return_value=1061.0):
+            self.assertIsNone(self.memo.lookup("s1", key))
+
+        for session_id in ("s1", "s2", "s3"):
+            self.memo.store(session_id, key, session_id)
+        self.assertIsNone(self.memo.lookup("s1", key))
+        self.assertEqual(self.memo.lookup("s3", key), "s3")
+        self.assertEqual(self.memo.stats()["sessions"], 2)
+
+
+class AgentTraceTests(SimpleTestCase):
+    """
+    Agent runs are traced with per-call token usage, estimated when the model reports none.
+    """
+
+    def llm_result(self, text, llm_output=None):
+        from langchain_core.outputs import Generation, LLMResult
+
+        return LLMResult(generations=[[Generation(text=text)]], llm_output=llm_output)
+
+    def test_reported_and_estimated_token_usage(self):
+        from ai_chatbot.agent_trace import AgentTrace
+
+        trace = AgentTrace()
+        trace.on_llm_start({}, ["x" * 400], run_id="a")
+        trace.on_llm_end(self.llm_result("done", {"usage": {"prompt_tokens": 90, "completion_tokens": 5}}), run_id="a")
+        trace.on_llm_start({}, ["x" * 400], run_id="b")
+        trace.on_llm_end(self.llm_result("y" * 40), run_id="b")
+
+        summary = trace.summary()
+        self.assertEqual((summary["llm_calls"], summary["prompt_tokens"], summary["completion_tokens"]), (2, 190, 15))
+        self.assertNotIn("estimated", summary["steps"][0])
+        self.assertTrue(summary["steps"][1]["estimated"])
+
+    def test_stopped_run_answers_with_last_observation(self):
+        from types import SimpleNamespace
+
+        from ai_chatbot.agent_tools import KNOWLEDGE_BASE_UNAVAILABLE, REPEATED_OBSERVATION_HINT, answer_from_stopped_run
+
+        steps = [
+            (SimpleNamespace(tool="DocumentQA"), "Python is a language." + REPEATED_OBSERVATION_HINT),
+            (SimpleNamespace(tool="DocumentQA"), KNOWLEDGE_BASE_UNAVAILABLE),
+        ]
+        self.assertEqual(answer_from_stopped_run({"intermediate_steps": steps}), "Python is a language.")
+        self.assertTrue(answer_from_stopped_run({"intermediate_steps": []}).startswith("I could not work out"))
+
+
+class WordEncoding:
+    """
+    Stands in for the tiktoken encoding (which is downloaded on first use): one token per word.
+    """
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+class ConversationMemoryTests(SimpleTestCase):
+    """
+    Conversations stay within their token budgets, and only real follow-ups cost a rewrite.
+    """
+
+    def setUp(self):
+        import fakeredis
+
+        from ai_chatbot import conversation_memory
+        from ai_chatbot.conversation_memory import ConversationMemory
+
+        self.conversation_memory = conversation_memory
+        patcher = mock.patch.object(conversation_memory, "_encoding", WordEncoding())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        redis_client = fakeredis.FakeRedis()
+        # Redis locks are released with a Lua script, which fakeredis only runs with lupa installed
+        lock = threading.Lock()
+        redis_client.lock = lambda name, **kwargs: lock
+        self.memory = ConversationMemory(redis_client, max_tokens=40, summary_tokens=10, turn_tokens=8)
+
+    def test_follow_ups(self):
+        from ai_chatbot.conversation_memory import is_follow_up
+
+        for message in ("and its limitations?", "What about Java?", "It crashes on startup", "tell me more",
+                        "why is that?", "Can you explain it again?"):
+            self.assertTrue(is_follow_up(message), message)
+        for message in ("What is Python?", "What are the features of Python that make it popular?",
+                        "Summarize the PythonAI.pdf document", "Does this document cover machine learning?",
+                        "How do I also install numpy?", "ok thanks", ""):
+            self.assertFalse(is_follow_up(message), message)
+
+    def test_truncate_tokens(self):
+        from ai_chatbot.conversation_memory import truncate_tokens
+
+        text = "one two three four five"
+        self.assertEqual(truncate_tokens(text, 5), text)
+        self.assertEqual(truncate_tokens(text, 3), "one two …")
+        self.assertEqual(truncate_tokens(text, 2, keep="tail"), "four five")
+        self.assertEqual(truncate_tokens(text, 0), "")
+        self.assertEqual(truncate_tokens(text, 0, keep="tail"), "")
+
+    def test_old_exchanges_are_folded_into_the_summary(self):
+        with mock.patch.object(self.conversation_memory, "summarize", return_value="They discussed Python " * 5) as summarize:
+            for n in range(6):
+                self.memory.append("web:s1", f"question {n} " + "word " * 10, f"answer {n}")
+
+        conversation = self.memory.load("web:s1")
+        self.assertTrue(summarize.called)
+        self.assertLessEqual(conversation.tokens(), self.memory.max_tokens)
+        self.assertLessEqual(conversation.summary_tokens, self.memory.summary_tokens)
+        self.assertEqual(conversation.turns[-1][:2], ["question 5 word word word word word …", "answer 5"])
+        self.assertLessEqual(len(conversation.render(15).split()), 15)
+
+    def test_standalone_questions_are_not_rewritten(self):
+        from ai_chatbot.conversation_memory import Conversation, standalone_question
+
+        conversation = Conversation(turns=[["What is Python?", "A language.", 6]])
+        with mock.patch("ai_chatbot.rag_engine.get_chat_llm") as get_chat_llm:
+            self.assertEqual(standalone_question(conversation, "What is Java?"), "What is Java?")
+            get_chat_llm.assert_not_called()
+            get_chat_llm.return_value.invoke.return_value.content = "What are the limitations of Python?"
+            self.assertEqual(standalone_question(conversation, "and its limitations?"), "What are the limitations of Python?")
+
+    def test_disabled_by_default(self):
+        from ai_chatbot.conversation_memory import get_conversation_memory
+
+        self.assertFalse(settings.CONVERSATION_MEMORY_ENABLED)
+        self.assertIsNone(get_conversation_memory())
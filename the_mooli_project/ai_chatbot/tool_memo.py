@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from ai_chatbot.answer_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+class SessionToolMemo:
+    """
+    Remembers the observations agent tools returned in each chat session, keyed by
+    (index, tool, normalized input). A ReAct loop that asks DocumentQA the same thing
+    again (in the same run or a later turn) gets the earlier observation back instead
+    of another retrieval and LLM call.
+
+    At most ``max_sessions`` sessions are kept (least recently used first out), each
+    with at most ``max_entries`` observations, which expire after ``ttl`` seconds.
+    """
+
+    def __init__(self, max_sessions=1024, max_entries=32, ttl=900):
+        self.max_sessions = max_sessions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(index_name, tool, tool_input):
+        return index_name, tool, normalize_query(str(tool_input))
+
+    def lookup(self, session_id, key):
+        """
+        Returns the remembered observation, or None.
+        """
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            entry = entries.get(key) if entries is not None else None
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                self._sessions.move_to_end(session_id)
+                entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del entries[key]
+            self.misses += 1
+            return None
+
+    def store(self, session_id, key, observation):
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            if entries is None:
+                entries = self._sessions[session_id] = OrderedDict()
+            self._sessions.move_to_end(session_id)
+            entries[key] = (observation, time.monotonic())
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "sessions": len(self._sessions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+_memo = None
+_memo_lock = threading.Lock()
+
+
+def get_tool_memo():
+    global _memo
+    with _memo_lock:
+        if _memo is None:
+            _memo = SessionToolMemo(
+                max_sessions=settings.AGENT_TOOL_MEMO_MAX_SESSIONS,
+                max_entries=settings.AGENT_TOOL_MEMO_MAX_ENTRIES,
+                ttl=settings.AGENT_TOOL_MEMO_TTL,
+            )
+        return _memo
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import slack_events, teams_webhook, root_handler, web_chat, process_chat_message, process_file_upload, get_task_status
+from .views import slack_events, teams_webhook, root_handler, web_chat, process_chat_message, stream_chat_message, process_file_upload, get_task_status, get_task_statuses, wait_task_progress
 
 urlpatterns = [
     path('', root_handler),  # so POST / doesn’t 403
@@ -7,6 +7,9 @@ urlpatterns = [
     path('teams/webhook/', teams_webhook, name='teams_webhook'),
     path('chat/', web_chat, name='web_chat'),
     path('api/chat/', process_chat_message, name='process_chat_message'),
+    path('api/chat/stream/', stream_chat_message, name='stream_chat_message'),
     path('api/upload/', process_file_upload, name='process_file_upload'),
     path('api/task-status/', get_task_status, name='get_task_status'),
+    path('api/task-statuses/', get_task_statuses, name='get_task_statuses'),
+    path('api/task-progress/', wait_task_progress, name='wait_task_progress'),
 ]
\ No newline at end of file
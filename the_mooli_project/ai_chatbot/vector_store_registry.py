@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CURRENT_POINTER = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+def read_index_version(index_name):
+    """
+    Returns the published version of ``index_name``, or None if it has never been built.
+    Indexes saved directly into the directory (the old layout) are versioned by mtime.
+    """
+    try:
+        with open(os.path.join(index_name, CURRENT_POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        pass
+    legacy_file = os.path.join(index_name, "index.faiss")
+    if os.path.exists(legacy_file):
+        return f"mtime-{os.stat(legacy_file).st_mtime_ns}"
+    return None
+
+
+def resolve_index_path(index_name, version=None):
+    """
+    Returns the directory holding the files of the given (or current) version.
+    """
+    version = version or read_index_version(index_name)
+    if version is None:
+        return None
+    if version.startswith("mtime-"):
+        return index_name
+    return os.path.join(index_name, version)
+
+
+def publish_index(vector_store, index_name, manifest=None):
+    """
+    Saves ``vector_store`` (and its optional corpus manifest) as a new version of
+    ``index_name`` and atomically points CURRENT at it, so readers never observe
+    a half-written index.
+    """
+    os.makedirs(index_name, exist_ok=True)
+    version = f"v-{time.time_ns()}"
+    tmp_path = os.path.join(index_name, f"{version}.tmp")
+    vector_store.save_local(tmp_path)
+    if settings.FAISS_MMAP_SERVING:
+        from .mmap_index import save_serving_files
+        save_serving_files(vector_store.index, tmp_path)
+    if manifest is not None:
+        with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f)
+    os.rename(tmp_path, os.path.join(index_name, version))
+
+    pointer_tmp = os.path.join(index_name, f"{CURRENT_POINTER}.tmp-{os.getpid()}")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(index_name, CURRENT_POINTER))
+    logger.info(f"Published version {version} of '{index_name}'.")
+
+    _remove_old_versions(index_name, keep=settings.FAISS_INDEX_KEEP_VERSIONS)
+    return version
+
+
+def _remove_old_versions(index_name, keep):
+    versions = sorted(
+        (name for name in os.listdir(index_name) if name.startswith("v-") and not name.endswith(".tmp")),
+        key=lambda name: int(name[2:]),
+        reverse=True,
+    )
+    # Older versions stay around briefly so processes still reading them can finish
+    for name in versions[keep:]:
+        shutil.rmtree(os.path.join(index_name, name), ignore_errors=True)
+
+
+class RegistryEntry:
+    def __init__(self, version, vector_store, size_bytes=0):
+        self.version = version
+        self.vector_store = vector_store
+        self.size_bytes = size_bytes
+        self.checked_at = time.monotonic()
+        # Per-version objects built on top of the store (e.g. QA chains)
+        self.resources = {}
+
+
+class VectorStoreRegistry:
+    """
+    Keeps indexes loaded once per process and hot-swaps them when a new version is published.
+
+    Callers get an immutable entry; a reload builds a new entry and swaps the reference,
+    so in-flight queries keep using the version they started with. Only the very first
+    load of an index blocks; while a reload is running, other threads keep serving
+    the previous version. Loading one index never waits on another index's lock.
+
+    Loaded indexes (e.g. one shard per company) form an LRU bounded by ``max_bytes``,
+    as measured by ``sizer(vector_store)``; cold indexes are loaded lazily on first use.
+    """
+
+    def __init__(self, loader, check_interval=2.0, max_bytes=None, sizer=None):
+        self.loader = loader
+        self.check_interval = check_interval
+        self.max_bytes = max_bytes
+        self.sizer = sizer
+        self._entries = OrderedDict()
+        self._entries_lock = threading.Lock()
+        self._locks = defaultdict(threading.Lock)
+
+    def _lookup(self, index_name):
+        with self._entries_lock:
+            entry = self._entries.get(index_name)
+            if entry is not None:
+                self._entries.move_to_end(index_name)
+            return entry
+
+    def get(self, index_name):
+        entry = self._lookup(index_name)
+        if entry is not None and time.monotonic() - entry.checked_at < self.check_interval:
+            return entry
+
+        version = read_index_version(index_name)
+        if version is None:
+            return entry
+        if entry is not None and entry.version == version:
+            entry.checked_at = time.monotonic()
+            return entry
+
+        lock = self._locks[index_name]
+        if not lock.acquire(blocking=entry is None):
+            return entry
+        try:
+            current = self._lookup(index_name)
+            if current is not None and current.version == version:
+                return current
+            started = time.monotonic()
+            vector_store = self.loader(resolve_index_path(index_name, version))
+            size_bytes = self.sizer(vector_store) if self.sizer else 0
+            new_entry = RegistryEntry(version, vector_store, size_bytes)
+            with self._entries_lock:
+                self._entries[index_name] = new_entry
+                self._entries.move_to_end(index_name)
+                self._evict(keep=index_name)
+            logger.info(
+                f"Loaded '{index_name}' version {version} ({size_bytes / 1e6:.1f} MB) in "
+                f"{time.monotonic() - started:.2f}s (previous: {entry.version if entry else None})."
+            )
+            return new_entry
+        finally:
+            lock.release()
+
+    def _evict(self, keep):
+        # Called with _entries_lock held; the index just loaded is never evicted
+        if not self.max_bytes:
+            return
+        total = sum(entry.size_bytes for entry in self._entries.values())
+        for name in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            total -= self._entries.pop(name).size_bytes
+            logger.info(f"Evicted '{name}' from the vector store registry to stay within the memory budget.")
+
+    def loaded(self):
+        with self._entries_lock:
+            return {name: (entry.version, entry.size_bytes) for name, entry in self._entries.items()}
+
+    def invalidate(self, index_name):
+        with self._entries_lock:
+            self._entries.pop(index_name, None)
@@ -1,19 +1,18 @@
 import logging
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.conf import settings
+from django.utils.cache import get_conditional_response
 import json
 import os
+import threading
 from .tasks import process_message
-from .agent_tools import run_agent_task
+from .shards import company_id_for_user
 from celery.result import AsyncResult
-
-# Slack specific imports
-from slack_bolt import App
-from slack_bolt.adapter.django import SlackRequestHandler
+from asgiref.sync import sync_to_async
 
 logger = logging.getLogger(__name__)
 
@@ -24,11 +23,27 @@ def root_handler(request):
     return JsonResponse({"message": "OK"}, status=200)
 
 # Slack Setup
-slack_app = App(
-    token=settings.SLACK_BOT_TOKEN,
-    signing_secret=settings.SLACK_SIGNING_SECRET
-)
-slack_handler = SlackRequestHandler(slack_app)
+# The Slack app verifies its token over the network when created, so it is built on the first event
+_slack_handler = None
+_slack_handler_lock = threading.Lock()
+
+def get_slack_handler():
+    global _slack_handler
+    with _slack_handler_lock:
+        if _slack_handler is None:
+            from slack_bolt import App
+            from slack_bolt.adapter.django import SlackRequestHandler
+
+            from .clients import get_slack_client
+
+            # Shares the pooled Web API client with the outbound replies
+            slack_app = App(
+                client=get_slack_client(),
+                signing_secret=settings.SLACK_SIGNING_SECRET
+            )
+            slack_app.event("message")(handle_message)
+            _slack_handler = SlackRequestHandler(slack_app)
+        return _slack_handler
 
 @csrf_exempt
 def slack_events(request):
@@ -36,17 +51,24 @@ def slack_events(request):
     Handles Slack events. The SlackRequestHandler manages the CSRF exemption
     and event dispatching automatically, including the URL verification challenge.
     """
-    return slack_handler.handle(request)
+    return get_slack_handler().handle(request)
 
-@slack_app.event("message")
 def handle_message(event, say):
     """
     Handles incoming Slack messages.
     """
     if "bot_id" in event or event.get("subtype") == "bot_message":
         return 
-    say(":wave: Got it! Working on that now...")
-    process_message.delay({"event": event, "platform": "slack"})
+    from .slack_outbox import ACK_TEXT
+
+    request_data = {"event": event, "platform": "slack"}
+    # Acknowledged before queueing, so the user sees it even when the workers are backlogged;
+    # the worker's answer replaces this message
+    try:
+        request_data["ack_ts"] = say(ACK_TEXT)["ts"]
+    except Exception as e:
+        logger.warning(f"Could not acknowledge Slack message: {e}")
+    process_message.delay(request_data)
 
 # Teams Setup
 @csrf_exempt
@@ -76,6 +98,17 @@ def web_chat(request):
     """Render the main chat page."""
     return render(request, 'web_chat.html')
 
+def chat_session_id(request):
+    """
+    Returns the id of the web chat conversation: the browser's Django session, created on
+    its first message.
+    """
+    from .conversation_memory import conversation_id_for
+
+    if not request.session.session_key:
+        request.session.save()
+    return conversation_id_for("web", session_key=request.session.session_key)
+
 @csrf_exempt
 @require_POST
 def process_chat_message(request):
@@ -87,12 +120,46 @@ def process_chat_message(request):
         if not user_message:
             return JsonResponse({'message': 'Please enter a valid message.'}, status=400)
             
-        bot_response = run_agent_task(user_message)
+        # Each company only searches its own index shard
+        from .agent_tools import run_agent_task
+        bot_response = run_agent_task(
+            user_message, company_id=company_id_for_user(request.user), session_id=chat_session_id(request)
+        )
         
         return JsonResponse({'message': bot_response})
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
 
+async def stream_chat_message(request):
+    """
+    Streams the agent's answer as Server-Sent Events while it is generated.
+    Served through the_mooli_project.asgi, so waiting clients do not hold a worker thread.
+    """
+    # Django 4.2's csrf_exempt and require_POST wrap views synchronously, so they are applied by hand
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    user_message = data.get('message', '')
+    if not user_message:
+        return JsonResponse({'message': 'Please enter a valid message.'}, status=400)
+
+    from .streaming import stream_agent_answer
+    # Resolving the session user and creating the session touch the database
+    company_id = await sync_to_async(company_id_for_user)(request.user)
+    session_id = await sync_to_async(chat_session_id)(request)
+    response = StreamingHttpResponse(
+        stream_agent_answer(user_message, company_id=company_id, session_id=session_id),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
+
+stream_chat_message.csrf_exempt = True
+
 @csrf_exempt
 @require_POST
 def process_file_upload(request):
@@ -113,7 +180,10 @@ def process_file_upload(request):
             
     # Trigger the agent's file processing logic
     # This now returns the Celery task object
-    task = run_agent_task("process file upload", file_path=file_path)
+    from .agent_tools import run_agent_task
+    task = run_agent_task(
+        "process file upload", file_path=file_path, company_id=company_id_for_user(request.user)
+    )
     
     # Get the task ID from the object
     task_id = task.id
@@ -123,6 +193,50 @@ def process_file_upload(request):
         'task_id': task_id
     })
 
+async def wait_task_progress(request):
+    """
+    Long-poll fallback for browsers that cannot keep a WebSocket open: returns the task's next
+    progress event after ``after`` (a sequence number), waiting for it to be pushed instead of
+    having the client poll. Returns 204 when nothing happened before the timeout.
+    """
+    task_id = request.GET.get('task_id')
+    if not task_id:
+        return JsonResponse({'status': 'invalid_id'}, status=400)
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid sequence number'}, status=400)
+
+    from .progress import wait_for_event
+    event = await wait_for_event(task_id, after, settings.TASK_PROGRESS_LONG_POLL_TIMEOUT)
+    if event is None:
+        return HttpResponse(status=204)
+    return JsonResponse(event)
+
+def get_task_statuses(request):
+    """
+    Returns the states of many tasks (``?task_ids=id1,id2,...``) from one result-backend MGET.
+    Responses carry an ETag; a client that sends it back in If-None-Match gets an empty 304
+    while none of the tasks has changed.
+    """
+    task_ids = [task_id for task_id in request.GET.get('task_ids', '').split(',') if task_id]
+    if not task_ids:
+        return JsonResponse({'status': 'invalid_id'}, status=400)
+    if len(task_ids) > settings.TASK_STATUS_BATCH_MAX:
+        return JsonResponse({'error': f'At most {settings.TASK_STATUS_BATCH_MAX} task ids per request'}, status=400)
+    task_ids = list(dict.fromkeys(task_ids))
+
+    from .task_status import decode_states, fetch_raw_states, states_etag
+    raw_states = fetch_raw_states(task_ids)
+    etag = states_etag(task_ids, raw_states)
+    # Unchanged states are answered before anything is decoded or serialized
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(decode_states(task_ids, raw_states), json_dumps_params={'separators': (',', ':')})
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
 def get_task_status(request):
     task_id = request.GET.get('task_id')
     if not task_id:
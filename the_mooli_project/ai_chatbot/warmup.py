@@ -0,0 +1,48 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """
+    Builds what the first chat request would otherwise pay for: the Bedrock clients,
+    the ReAct agent and the shared FAISS index.
+    """
+    from ai_chatbot.agent_tools import get_agent_executor
+    from ai_chatbot.rag_engine import get_vector_store_registry
+    from ai_chatbot.shards import DEFAULT_INDEX_NAME
+
+    started = time.perf_counter()
+    get_agent_executor()
+    agent_ready = time.perf_counter()
+    entry = get_vector_store_registry().get(DEFAULT_INDEX_NAME)
+    finished = time.perf_counter()
+    logger.info(
+        f"Warm-up finished in {finished - started:.2f}s (agent {agent_ready - started:.2f}s, "
+        f"index '{DEFAULT_INDEX_NAME}' {'version ' + str(entry.version) if entry else 'not built yet'} "
+        f"{finished - agent_ready:.2f}s)."
+    )
+
+
+def _warm_up_safely():
+    try:
+        warm_up()
+    except Exception as e:
+        # The first request will retry whatever failed here
+        logger.error(f"Warm-up failed: {e}", exc_info=True)
+
+
+def start_warm_up():
+    """
+    Warms up in a background thread when AI_CHATBOT_EAGER_WARMUP is set, so the process
+    starts serving (and answering health checks) without waiting for it.
+    """
+    if not settings.AI_CHATBOT_EAGER_WARMUP:
+        return None
+    thread = threading.Thread(target=_warm_up_safely, name="ai-chatbot-warmup", daemon=True)
+    thread.start()
+    return thread
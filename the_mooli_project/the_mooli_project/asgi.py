@@ -11,19 +11,27 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-# from channels.routing import ProtocolTypeRouter, URLRouter
-# from channels.auth import AuthMiddlewareStack
-# import ai_chatbot.routing
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'the_mooli_project.settings')
 
-application = get_asgi_application()
-
-# application = ProtocolTypeRouter({
-#     'http': get_asgi_application(),
-#     'websocket': AuthMiddlewareStack(
-#         URLRouter(
-#             ai_chatbot.routing.websocket_urlpatterns
-#         )
-#     ),
-# })
+# Initialize Django before importing anything that uses the ORM (consumers, auth middleware)
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+import ai_chatbot.routing  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(
+        AuthMiddlewareStack(
+            URLRouter(
+                ai_chatbot.routing.websocket_urlpatterns
+            )
+        )
+    ),
+})
+
+# Optionally build the AI chatbot's models and index in the background (AI_CHATBOT_EAGER_WARMUP)
+from ai_chatbot.warmup import start_warm_up  # noqa: E402
+start_warm_up()
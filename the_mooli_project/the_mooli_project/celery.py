@@ -1,7 +1,38 @@
+import logging
 import os
 from celery import Celery
+from celery.signals import task_postrun, worker_process_init, worker_process_shutdown
+
+logger = logging.getLogger(__name__)
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'the_mooli_project.settings')
 app = Celery('the_mooli_project')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def warm_up_worker(**kwargs):
+    # Each prefork child builds its own clients, so warm up after the fork
+    from ai_chatbot.warmup import start_warm_up
+    start_warm_up()
+
+
+@task_postrun.connect
+def push_task_completion(sender=None, task_id=None, retval=None, state=None, **kwargs):
+    # Runs after the result is stored, so a browser that reconnects sees the same final state
+    if getattr(sender, 'publishes_progress', False):
+        from ai_chatbot.progress import publish_completion
+        publish_completion(task_id, state, retval)
+
+
+@worker_process_shutdown.connect
+def log_client_stats(**kwargs):
+    from ai_chatbot.clients import get_client_registry
+    registry = get_client_registry()
+    outbox = registry.peek("slack_outbox")
+    if outbox is not None:
+        # Deliver queued Slack replies before the process exits
+        outbox.flush(timeout=10)
+        logger.info(f"Slack outbox: {outbox.stats()}")
+    logger.info(f"Client reuse in worker process: {registry.stats()}")
@@ -40,18 +40,23 @@ ALLOWED_HOSTS = [
 
 # Application definition
 
-# ASGI_APPLICATION = 'the_mooli_project.asgi.application'
-# CHANNEL_LAYERS = {
-#     'default': {
-#         'BACKEND': 'channels_redis.core.RedisChannelLayer',
-#         'CONFIG': {
-#             'hosts': [('127.0.0.1', 6379)],
-#         },
-#     },
-# }
+ASGI_APPLICATION = 'the_mooli_project.asgi.application'
+# Task progress is pushed to browsers over WebSockets through this layer
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            'hosts': [os.getenv('CHANNEL_LAYER_REDIS_URL', 'redis://127.0.0.1:6379/0')],
+        },
+    },
+}
+# Task ids accepted by one batch status request (/api/task-statuses/)
+TASK_STATUS_BATCH_MAX = int(os.getenv('TASK_STATUS_BATCH_MAX', '200'))
+# Seconds a long-poll request for task progress (the WebSocket fallback) waits for an event
+TASK_PROGRESS_LONG_POLL_TIMEOUT = float(os.getenv('TASK_PROGRESS_LONG_POLL_TIMEOUT', '25'))
 
 INSTALLED_APPS = [
-    # 'channels',
+    'channels',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -110,6 +115,12 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Manila'
+CELERY_BEAT_SCHEDULE = {
+    'compact-faiss-corpus': {
+        'task': 'ai_chatbot.tasks.compact_corpus',
+        'schedule': float(os.getenv('CORPUS_COMPACTION_INTERVAL', str(6 * 60 * 60))),  # seconds
+    },
+}
 
 # Slack and Teams Credentials (replace with real values after setup)
 SLACK_BOT_TOKEN = os.getenv('SLACK_BOT_TOKEN')
@@ -128,6 +139,115 @@ AWS_REGION_NAME = os.getenv('AWS_REGION_NAME')
 BEDROCK_MODEL_ID = os.getenv('BEDROCK_MODEL_ID')
 S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
 
+# Local cache of S3 objects (ETag-validated, LRU-bounded, shared by all workers on the host)
+S3_CACHE_DIR = os.getenv('S3_CACHE_DIR', str(BASE_DIR / 's3_cache'))
+S3_CACHE_MAX_BYTES = int(os.getenv('S3_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+S3_CACHE_PART_SIZE = int(os.getenv('S3_CACHE_PART_SIZE', str(8 * 1024 ** 2)))
+S3_CACHE_MAX_CONCURRENCY = int(os.getenv('S3_CACHE_MAX_CONCURRENCY', '8'))
+
+# Embedding cache shared by every ingestion path (float32 vectors keyed by model id and chunk hash)
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', str(BASE_DIR / 'embedding_cache' / 'embeddings.sqlite3'))
+# Query embeddings are only kept in memory, for the most recent queries of each process
+EMBEDDING_QUERY_CACHE_SIZE = int(os.getenv('EMBEDDING_QUERY_CACHE_SIZE', '1024'))
+
+# Batched embedding engine (concurrent Titan requests paced by a token bucket)
+EMBEDDING_MAX_WORKERS = int(os.getenv('EMBEDDING_MAX_WORKERS', '8'))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '16'))
+EMBEDDING_REQUESTS_PER_SECOND = float(os.getenv('EMBEDDING_REQUESTS_PER_SECOND', '20'))
+# After throttling, the rate grows back by EMBEDDING_RATE_STEP req/s per EMBEDDING_RATE_WINDOW seconds
+EMBEDDING_RATE_STEP = float(os.getenv('EMBEDDING_RATE_STEP', '0.5'))
+EMBEDDING_RATE_WINDOW = float(os.getenv('EMBEDDING_RATE_WINDOW', '1'))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '64'))  # chunks embedded and indexed per step
+# Per-process AWS clients (pool sizes follow EMBEDDING_MAX_WORKERS and S3_CACHE_MAX_CONCURRENCY)
+AWS_MAX_ATTEMPTS = int(os.getenv('AWS_MAX_ATTEMPTS', '5'))
+AWS_RETRY_MODE = os.getenv('AWS_RETRY_MODE', 'standard')  # or 'adaptive' to add client-side rate limiting
+AWS_CONNECT_TIMEOUT = float(os.getenv('AWS_CONNECT_TIMEOUT', '5'))
+AWS_READ_TIMEOUT = float(os.getenv('AWS_READ_TIMEOUT', '60'))
+# Slack Web API client and outbound queue: messages are spaced per channel, 429s pause the
+# channel (or workspace) for Retry-After, and answers replace the acknowledgement the view posted
+SLACK_TIMEOUT = int(os.getenv('SLACK_TIMEOUT', '30'))
+SLACK_MAX_RETRIES = int(os.getenv('SLACK_MAX_RETRIES', '3'))
+SLACK_CHANNEL_INTERVAL = float(os.getenv('SLACK_CHANNEL_INTERVAL', '1'))
+# Teams replies (per-process sender loop; conversation references cached per conversation id)
+TEAMS_SEND_TIMEOUT = float(os.getenv('TEAMS_SEND_TIMEOUT', '30'))
+TEAMS_REFERENCE_CACHE_SIZE = int(os.getenv('TEAMS_REFERENCE_CACHE_SIZE', '1024'))
+# Skip embedding chunks whose normalized text is already in the corpus. Chunks with at least
+# INGEST_DEDUP_MIN_BANDS of 16 MinHash bands in common are only reported as near duplicates
+# (0 disables near-duplicate matching)
+INGEST_DEDUP = os.getenv('INGEST_DEDUP', 'False') == 'True'
+INGEST_DEDUP_MIN_BANDS = int(os.getenv('INGEST_DEDUP_MIN_BANDS', '4'))
+
+# Published FAISS indexes (seconds between on-disk version checks, old versions kept for readers)
+VECTOR_STORE_CHECK_INTERVAL = float(os.getenv('VECTOR_STORE_CHECK_INTERVAL', '2'))
+FAISS_INDEX_KEEP_VERSIONS = int(os.getenv('FAISS_INDEX_KEEP_VERSIONS', '2'))
+# Per-company index shards, and the memory budget for the shards loaded in one worker
+FAISS_SHARD_ROOT = os.getenv('FAISS_SHARD_ROOT', str(BASE_DIR / 'faiss_shards'))
+VECTOR_STORE_MAX_BYTES = int(os.getenv('VECTOR_STORE_MAX_BYTES', str(2 * 1024 ** 3)))
+# OpenMP threads per FAISS search; 1 keeps a large shard's searches from starving the others
+FAISS_OMP_THREADS = int(os.getenv('FAISS_OMP_THREADS', '1'))
+# Serve published indexes from memory-mapped files shared by every worker on the host (opt-in)
+FAISS_MMAP_SERVING = os.getenv('FAISS_MMAP_SERVING', 'False') == 'True'
+
+# Fast-path router in front of the ReAct agent: summaries, uploads and document questions (by
+# rule, or by embedding similarity to example questions) are answered without the agent loop
+INTENT_ROUTER_ENABLED = os.getenv('INTENT_ROUTER_ENABLED', 'True') == 'True'
+INTENT_ROUTER_MIN_SIMILARITY = float(os.getenv('INTENT_ROUTER_MIN_SIMILARITY', '0.6'))
+INTENT_ROUTER_MARGIN = float(os.getenv('INTENT_ROUTER_MARGIN', '0.05'))
+
+# ReAct agent budget: steps and seconds before the loop is stopped and answered from what it has
+AGENT_MAX_ITERATIONS = int(os.getenv('AGENT_MAX_ITERATIONS', '5'))
+AGENT_MAX_EXECUTION_TIME = float(os.getenv('AGENT_MAX_EXECUTION_TIME', '60'))
+# DocumentQA observations remembered per chat session (sessions per process, entries per session, seconds)
+AGENT_TOOL_MEMO_MAX_SESSIONS = int(os.getenv('AGENT_TOOL_MEMO_MAX_SESSIONS', '1024'))
+AGENT_TOOL_MEMO_MAX_ENTRIES = int(os.getenv('AGENT_TOOL_MEMO_MAX_ENTRIES', '32'))
+AGENT_TOOL_MEMO_TTL = int(os.getenv('AGENT_TOOL_MEMO_TTL', '900'))
+
+# Conversation memory per Slack channel, Teams conversation or web session, stored in Redis.
+# Recent exchanges are kept verbatim and older ones folded into a rolling summary, so a
+# conversation never exceeds CONVERSATION_MEMORY_MAX_TOKENS (counted with tiktoken) and at
+# most CONVERSATION_MEMORY_PROMPT_TOKENS of it are added to a prompt. Off by default: a
+# follow-up costs one more LLM call to be rewritten as a standalone question.
+CONVERSATION_MEMORY_ENABLED = os.getenv('CONVERSATION_MEMORY_ENABLED', 'False') == 'True'
+CONVERSATION_MEMORY_REDIS_URL = os.getenv('CONVERSATION_MEMORY_REDIS_URL', 'redis://localhost:6379/0')
+CONVERSATION_MEMORY_REDIS_TIMEOUT = float(os.getenv('CONVERSATION_MEMORY_REDIS_TIMEOUT', '2'))
+CONVERSATION_MEMORY_ENCODING = os.getenv('CONVERSATION_MEMORY_ENCODING', 'cl100k_base')
+CONVERSATION_MEMORY_MAX_TOKENS = int(os.getenv('CONVERSATION_MEMORY_MAX_TOKENS', '2000'))
+CONVERSATION_MEMORY_SUMMARY_TOKENS = int(os.getenv('CONVERSATION_MEMORY_SUMMARY_TOKENS', '400'))
+CONVERSATION_MEMORY_TURN_TOKENS = int(os.getenv('CONVERSATION_MEMORY_TURN_TOKENS', '300'))
+CONVERSATION_MEMORY_PROMPT_TOKENS = int(os.getenv('CONVERSATION_MEMORY_PROMPT_TOKENS', '1200'))
+CONVERSATION_MEMORY_TTL = int(os.getenv('CONVERSATION_MEMORY_TTL', str(7 * 24 * 3600)))  # seconds
+
+# Streamed web chat answers (/api/chat/stream/, served through the_mooli_project.asgi): threads
+# running streamed agents per process, and seconds between keep-alive comments on a quiet stream
+CHAT_STREAM_MAX_WORKERS = int(os.getenv('CHAT_STREAM_MAX_WORKERS', '16'))
+CHAT_STREAM_KEEPALIVE = float(os.getenv('CHAT_STREAM_KEEPALIVE', '15'))
+
+# LangChain, FAISS, Bedrock and the agent are created on first use; set this to build them
+# in the background when a web or Celery worker process starts instead
+AI_CHATBOT_EAGER_WARMUP = os.getenv('AI_CHATBOT_EAGER_WARMUP', 'False') == 'True'
+
+# Answer cache (per index version; near-duplicate questions match by query-embedding cosine similarity)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1024'))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '3600'))  # seconds
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('ANSWER_CACHE_SIMILARITY_THRESHOLD', '0.95'))
+
+# FAISS index type: 'auto', 'flat', 'ivf_flat', 'ivf_pq' or 'hnsw'.
+# 'auto' uses exact search until the corpus reaches FAISS_ANN_THRESHOLD vectors.
+# sq_fp16 (float16 vectors) and ivf_pq_refine (PQ re-ranked with float16 vectors) trade a little recall for memory.
+FAISS_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'auto')
+# Per-index choice, e.g. "faiss_index=sq_fp16,faiss_shards/company_7=ivf_pq_refine"
+FAISS_INDEX_TYPE_OVERRIDES = dict(
+    item.split('=', 1) for item in os.getenv('FAISS_INDEX_TYPE_OVERRIDES', '').split(',') if '=' in item
+)
+FAISS_ANN_INDEX_TYPE = os.getenv('FAISS_ANN_INDEX_TYPE', 'hnsw')
+FAISS_ANN_THRESHOLD = int(os.getenv('FAISS_ANN_THRESHOLD', '50000'))
+FAISS_IVF_NPROBE = int(os.getenv('FAISS_IVF_NPROBE', '16'))
+FAISS_REFINE_K_FACTOR = int(os.getenv('FAISS_REFINE_K_FACTOR', '100'))  # PQ candidates per result re-ranked with float16 vectors
+FAISS_PQ_M = int(os.getenv('FAISS_PQ_M', '64'))  # sub-quantizers, must divide 1536
+FAISS_HNSW_M = int(os.getenv('FAISS_HNSW_M', '32'))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv('FAISS_HNSW_EF_CONSTRUCTION', '80'))
+FAISS_HNSW_EF_SEARCH = int(os.getenv('FAISS_HNSW_EF_SEARCH', '64'))
+
 # Disable auth for local development
 BOT_AUTH_DISABLED = True
 # Use localhost service URL for Emulator
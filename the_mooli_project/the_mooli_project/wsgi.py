@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'the_mooli_project.settings')
 
 application = get_wsgi_application()
+
+# Optionally build the AI chatbot's models and index in the background (AI_CHATBOT_EAGER_WARMUP)
+from ai_chatbot.warmup import start_warm_up  # noqa: E402
+start_warm_up()